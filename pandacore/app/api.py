@@ -2,182 +2,515 @@
 API routes for PandaLora backend.
 """
 
+import asyncio
+import base64
+import json
 import logging
 import time
-import uuid
-from typing import Optional
-from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect, UploadFile, File, Form
-from fastapi.responses import StreamingResponse
-from .models import TextInput, ChatResponse, StreamResponse, ChatMessage, InputType
-from .services import speech_service, ai_service, conversation_service
+from dataclasses import replace
+from typing import AsyncIterator, Optional
+from fastapi import APIRouter, HTTPException, Request, WebSocket, WebSocketDisconnect, UploadFile, File, Form, Header
+from fastapi.responses import Response, StreamingResponse
+from starlette.requests import ClientDisconnect
+from .batch import BatchResult, BatchRunner, PreviousItemFailed, read_lines
+from .connections import Connection, ConnectionManager, FrameKind
+from .framing import ChunkCoalescer, Envelope, dumps
+from .metrics import BATCH_ITEMS, begin_request, observe_stream, registry
+from .models import (
+    BatchChatRequest, BatchItem, BatchItemResult, BatchSummary, ChatMessage, ChatResponse, InputType,
+    StreamResponse, TextInput, TTSRequest
+)
+from .ratelimit import STREAM, TEXT, VOICE, RateLimited, RateLimiter
+from .services import get_ai_service, get_conversation_service, get_speech_service, get_tts_service
+from .streaming import ResumableStreams
+from .tts import SpeechPipeline, SpokenSentence
+from .turns import ConversationBusy, TurnPolicy, TurnSuperseded
+from .workers import ExecutorOverloaded, current_client
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-class ConnectionManager:
-    """Manages WebSocket connections for real-time streaming."""
-    
-    def __init__(self):
-        self.active_connections: list[WebSocket] = []
-    
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
-        logger.info(f"WebSocket connected. Total connections: {len(self.active_connections)}")
-    
-    def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
-            logger.info(f"WebSocket disconnected. Total connections: {len(self.active_connections)}")
-    
-    async def send_personal_message(self, message: str, websocket: WebSocket):
-        try:
-            await websocket.send_text(message)
-        except Exception as e:
-            logger.error(f"Error sending WebSocket message: {e}")
-            self.disconnect(websocket)
+manager = ConnectionManager.from_env()
+coalescer = ChunkCoalescer.from_env()
+resumable_streams = ResumableStreams.from_env()
+batch_runner = BatchRunner.from_env()
+rate_limiter = RateLimiter.from_env(lambda: get_conversation_service().state)
 
-manager = ConnectionManager()
+registry.callback(
+    "pandalora_websocket_connections",
+    "Open WebSocket connections.",
+    lambda: [((), len(manager.connections))]
+)
+registry.callback(
+    "pandalora_websocket_pending_frames",
+    "Frames queued for WebSocket clients but not yet written.",
+    lambda: [((), manager.stats()["pending_frames"])]
+)
+registry.callback(
+    "pandalora_websocket_slow_client_frames_total",
+    "Frames dropped or merged because a WebSocket client fell behind.",
+    lambda: [
+        (("dropped",), manager.stats()["dropped_frames"]),
+        (("coalesced",), manager.stats()["coalesced_frames"]),
+    ],
+    labelnames=("action",),
+    kind="counter"
+)
+registry.callback(
+    "pandalora_sse_streams_total",
+    "Server-Sent Event streams started, and reconnects that resumed one.",
+    lambda: [
+        (("started",), resumable_streams.started),
+        (("resumed",), resumable_streams.resumed),
+    ],
+    labelnames=("event",),
+    kind="counter"
+)
+registry.callback(
+    "pandalora_rate_limit_buckets",
+    "Rate limit buckets this worker has used recently.",
+    lambda: [((scope,), levels["tracked"]) for scope, levels in rate_limiter.bucket_levels().items()],
+    labelnames=("scope",)
+)
+registry.callback(
+    "pandalora_rate_limit_empty_buckets",
+    "Recently used rate limit buckets that cannot pay for another turn yet.",
+    lambda: [((scope,), levels["empty"]) for scope, levels in rate_limiter.bucket_levels().items()],
+    labelnames=("scope",)
+)
+registry.callback(
+    "pandalora_websocket_timed_out_total",
+    "WebSocket connections closed for not answering pings.",
+    lambda: [((), manager.timed_out)],
+    kind="counter"
+)
 
 @router.post("/chat/text", response_model=ChatResponse)
-async def chat_with_text(input_data: TextInput, conversation_id: Optional[str] = None):
-    """Process text input and return AI response."""
+async def chat_with_text(
+    request: Request,
+    input_data: TextInput,
+    conversation_id: Optional[str] = None,
+    timings: bool = False,
+    policy: Optional[TurnPolicy] = None,
+    speak: Optional[bool] = None
+):
+    """Process text input and return AI response.
+
+    Pass ``timings=true`` to get a per-stage timing breakdown in the response.
+    ``policy`` (queue, reject or supersede) decides what happens when the
+    conversation is already answering another message. ``speak=true`` adds
+    the spoken reply as ``audio_data`` when speech output is enabled.
+    """
+    ai_service = get_ai_service()
+    conversation_service = get_conversation_service()
     start_time = time.time()
+    request_timings = begin_request("text")
     
     try:
         # Create conversation ID if not provided
         if not conversation_id:
             conversation_id = conversation_service.create_conversation_id()
         
-        # Get conversation history
-        history = conversation_service.get_conversation_history(conversation_id)
-        
-        # Add user message to history
-        user_message = ChatMessage(role="user", content=input_data.text)
-        conversation_service.add_message(conversation_id, user_message)
+        await rate_limiter.admit(request, TEXT, conversation_id)
         
-        # Generate AI response
-        ai_response = await ai_service.generate_response(input_data.text, history)
-        
-        # Add AI response to history
-        ai_message = ChatMessage(role="assistant", content=ai_response)
-        conversation_service.add_message(conversation_id, ai_message)
+        async with conversation_service.turns.turn(conversation_id, policy) as turn:
+            # Get conversation history
+            history = await conversation_service.get_conversation_history(conversation_id)
+            
+            # Generate AI response
+            ai_response = await turn.run(
+                ai_service.generate_response(input_data.text, history, conversation_id=conversation_id)
+            )
+            
+            # Add the exchange to history once it has a reply, so a superseded
+            # turn leaves no unanswered message behind
+            user_message = ChatMessage(role="user", content=input_data.text)
+            await conversation_service.add_message(conversation_id, user_message)
+            ai_message = ChatMessage(role="assistant", content=ai_response)
+            await conversation_service.add_message(conversation_id, ai_message)
         
+        audio_data, audio_format = await _speak(ai_response, speak, InputType.TEXT)
         processing_time = time.time() - start_time
+        breakdown = request_timings.finish()
         
         return ChatResponse(
             response=ai_response,
             input_type=InputType.TEXT,
             processing_time=processing_time,
-            conversation_id=conversation_id
+            conversation_id=conversation_id,
+            timings=breakdown if timings else None,
+            audio_data=audio_data,
+            audio_format=audio_format
         )
         
+    except (ExecutorOverloaded, ConversationBusy, TurnSuperseded, RateLimited):
+        raise
     except Exception as e:
         logger.error(f"Error in text chat: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/chat/speech", response_model=ChatResponse)
 async def chat_with_speech(
+    request: Request,
     audio_file: UploadFile = File(...),
     language: str = Form("en-US"),
-    conversation_id: Optional[str] = Form(None)
+    conversation_id: Optional[str] = Form(None),
+    trim_silence: Optional[bool] = Form(None),
+    max_pause_ms: Optional[int] = Form(None),
+    timings: bool = Form(False),
+    policy: Optional[TurnPolicy] = Form(None),
+    speak: Optional[bool] = Form(None)
 ):
-    """Process speech input and return AI response."""
+    """Process speech input and return AI response.
+
+    When speech output is enabled the reply is also spoken, unless ``speak`` is false.
+    """
+    speech_service = get_speech_service()
+    ai_service = get_ai_service()
+    conversation_service = get_conversation_service()
     start_time = time.time()
+    request_timings = begin_request("speech")
     
     try:
         # Validate file type
         if not audio_file.content_type.startswith('audio/'):
             raise HTTPException(status_code=400, detail="File must be an audio file")
         
+        # Charged before the audio is decoded and recognized
+        await rate_limiter.admit(request, VOICE, conversation_id)
+        
         # Read audio data
-        audio_data = await audio_file.read()
+        with request_timings.stage("upload"):
+            audio_data = await audio_file.read()
+        
+        # Per-request overrides of the silence trimming defaults
+        vad = speech_service.vad
+        if trim_silence is not None:
+            vad = replace(vad, enabled=trim_silence)
+        if max_pause_ms is not None:
+            vad = replace(vad, max_pause_ms=max_pause_ms)
         
         # Convert speech to text
-        text_input = await speech_service.speech_to_text(audio_data, language)
+        transcription = await speech_service.transcribe(audio_data, language, vad)
+        for stage, seconds in transcription.timings.items():
+            request_timings.add(stage, seconds)
+        text_input = transcription.text
         logger.info(f"Speech converted to text: {text_input}")
         
         # Create conversation ID if not provided
         if not conversation_id:
             conversation_id = conversation_service.create_conversation_id()
         
-        # Get conversation history
-        history = conversation_service.get_conversation_history(conversation_id)
-        
-        # Add user message to history
-        user_message = ChatMessage(role="user", content=text_input)
-        conversation_service.add_message(conversation_id, user_message)
-        
-        # Generate AI response
-        ai_response = await ai_service.generate_response(text_input, history)
-        
-        # Add AI response to history
-        ai_message = ChatMessage(role="assistant", content=ai_response)
-        conversation_service.add_message(conversation_id, ai_message)
+        async with conversation_service.turns.turn(conversation_id, policy) as turn:
+            # Get conversation history
+            history = await conversation_service.get_conversation_history(conversation_id)
+            
+            # Generate AI response
+            ai_response = await turn.run(
+                ai_service.generate_response(text_input, history, pool="voice", conversation_id=conversation_id)
+            )
+            
+            # Add the exchange to history once it has a reply, so a superseded
+            # turn leaves no unanswered message behind
+            user_message = ChatMessage(role="user", content=text_input)
+            await conversation_service.add_message(conversation_id, user_message)
+            ai_message = ChatMessage(role="assistant", content=ai_response)
+            await conversation_service.add_message(conversation_id, ai_message)
         
+        audio_data, audio_format = await _speak(ai_response, speak, InputType.SPEECH)
         processing_time = time.time() - start_time
+        breakdown = request_timings.finish()
         
         return ChatResponse(
             response=ai_response,
             input_type=InputType.SPEECH,
             processing_time=processing_time,
-            conversation_id=conversation_id
+            conversation_id=conversation_id,
+            silence_removed=transcription.silence_removed,
+            timings=breakdown if timings else None,
+            audio_data=audio_data,
+            audio_format=audio_format
         )
         
+    except (HTTPException, ExecutorOverloaded, ConversationBusy, TurnSuperseded, RateLimited):
+        raise
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error in speech chat: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.get("/chat/stream/{conversation_id}")
-async def stream_chat_response(conversation_id: str, message: str):
-    """Stream AI response for better user experience."""
+# Body types read line by line as one batch item each
+NDJSON_TYPES = ("application/x-ndjson", "application/jsonl", "application/json-seq")
+
+@router.post("/chat/batch")
+async def chat_batch(request: Request, concurrency: Optional[int] = None, persist: bool = True):
+    """Answer many messages, streaming one NDJSON result line per message as it finishes.
+
+    The body is either ``{"items": [...], "concurrency": N}`` or NDJSON with
+    one ``{"text", "conversation_id", "id"}`` object per line. Messages in the
+    same conversation are answered in order, one at a time; other messages
+    run in parallel, up to ``concurrency`` at once. Items without a
+    conversation get a new one each. A failed item is reported on its line
+    and the rest of the batch carries on, except for later messages of the
+    same conversation, which are skipped. ``persist=false`` answers against
+    the stored history without adding to it. The last line is a summary.
+    Items are paced to the client's rate limit rather than refused, unless
+    that would mean waiting longer than ``RATE_LIMIT_MAX_WAIT``.
+    """
+    conversation_service = get_conversation_service()
+    client = rate_limiter.identify(request)
+    current_client.set(client)
+    body_read = asyncio.Event()
+    if request.headers.get("content-type", "").split(";")[0].strip() in NDJSON_TYPES:
+        # Read as the runner asks for items, so the body is never held whole
+        items = _batch_lines(request, body_read)
+    else:
+        body = await _read_document(request, batch_runner.max_document_bytes)
+        body_read.set()
+        try:
+            batch = BatchChatRequest.model_validate_json(body)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        items = _iterate(batch.items)
+        concurrency = concurrency or batch.concurrency
+    
+    async def source():
+        async for item in items:
+            if isinstance(item, BatchItem) and not item.conversation_id:
+                item.conversation_id = conversation_service.create_conversation_id()
+            yield item
+    
+    async def results():
+        started = time.time()
+        succeeded = failed = 0
+        async for result in batch_runner.run(
+            source(),
+            lambda item: _run_batch_item(item, persist, client),
+            key=lambda item: item.conversation_id if isinstance(item, BatchItem) else None,
+            concurrency=concurrency
+        ):
+            line = _batch_result_line(result)
+            if line.ok:
+                succeeded += 1
+            else:
+                failed += 1
+            BATCH_ITEMS.inc(outcome="ok" if line.ok else "skipped" if line.status == 424 else "failed")
+            yield line.model_dump_json(exclude_none=True) + "\n"
+        summary = BatchSummary(
+            total=succeeded + failed,
+            succeeded=succeeded,
+            failed=failed,
+            processing_time=time.time() - started
+        )
+        yield summary.model_dump_json() + "\n"
     
-    async def generate_stream():
+    return DuplexStreamingResponse(results(), body_read, media_type="application/x-ndjson")
+
+class DuplexStreamingResponse(StreamingResponse):
+    """A streamed response sent while the endpoint is still reading the request body.
+
+    ``StreamingResponse`` watches ``receive`` for a disconnect from the start,
+    which would swallow body chunks the endpoint has not read yet. This one
+    leaves ``receive`` to the endpoint until ``body_read`` is set.
+    """
+
+    def __init__(self, content, body_read: asyncio.Event, **kwargs):
+        super().__init__(content, **kwargs)
+        self.body_read = body_read
+
+    async def __call__(self, scope, receive, send):
+        async def watch():
+            await self.body_read.wait()
+            await self.listen_for_disconnect(receive)
+
+        streaming = asyncio.ensure_future(self.stream_response(send))
+        watcher = asyncio.ensure_future(watch())
         try:
-            # Get conversation history
-            history = conversation_service.get_conversation_history(conversation_id)
-            
-            # Add user message to history
-            user_message = ChatMessage(role="user", content=message)
-            conversation_service.add_message(conversation_id, user_message)
-            
-            # Generate streaming response
-            full_response = ""
-            async for chunk in ai_service.generate_streaming_response(message, history):
-                full_response += chunk
-                response_data = StreamResponse(
-                    chunk=chunk,
-                    is_complete=False,
-                    conversation_id=conversation_id
-                )
-                yield f"data: {response_data.json()}\n\n"
-            
-            # Add complete AI response to history
-            ai_message = ChatMessage(role="assistant", content=full_response)
-            conversation_service.add_message(conversation_id, ai_message)
-            
-            # Send completion signal
-            final_response = StreamResponse(
-                chunk="",
-                is_complete=True,
-                conversation_id=conversation_id
-            )
-            yield f"data: {final_response.json()}\n\n"
-            
-        except Exception as e:
-            logger.error(f"Error in streaming response: {e}")
-            error_response = StreamResponse(
-                chunk=f"Error: {str(e)}",
-                is_complete=True,
-                conversation_id=conversation_id
+            # A disconnect ends the watcher, and cancels the stream with it
+            await asyncio.wait({streaming, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in (streaming, watcher):
+                task.cancel()
+            await asyncio.gather(streaming, watcher, return_exceptions=True)
+        if not streaming.cancelled() and streaming.exception() is not None:
+            raise streaming.exception()
+        if self.background is not None:
+            await self.background()
+
+async def _read_document(request: Request, limit: int) -> bytes:
+    """The whole request body, refused with 413 once it grows past ``limit`` bytes."""
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > limit:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Batch body is larger than {limit} bytes; send large batches as NDJSON"
             )
-            yield f"data: {error_response.json()}\n\n"
+    return bytes(body)
+
+async def _iterate(items):
+    for item in items:
+        yield item
+
+async def _batch_lines(request: Request, body_read: asyncio.Event):
+    """Parse NDJSON as it arrives; a bad line becomes the error reported for that item."""
+    try:
+        async for line in read_lines(request.stream(), batch_runner.max_document_bytes):
+            if isinstance(line, ValueError):
+                yield line
+                continue
+            if not line.strip():
+                continue
+            try:
+                yield BatchItem.model_validate_json(line)
+            except ValueError as e:
+                yield e
+    except ClientDisconnect:
+        # The response's disconnect watcher, started below, stops the batch
+        pass
+    finally:
+        body_read.set()
+
+async def _run_batch_item(item, persist: bool, client: str) -> BatchItemResult:
+    ai_service = get_ai_service()
+    conversation_service = get_conversation_service()
+    if isinstance(item, Exception):
+        raise item
+    start_time = time.time()
+    conversation_id = item.conversation_id
+    await rate_limiter.pace(client, TEXT, conversation_id)
+    if persist:
+        # Batch turns queue behind live traffic on the same conversation
+        async with conversation_service.turns.turn(conversation_id, TurnPolicy.QUEUE) as turn:
+            history = await conversation_service.get_conversation_history(conversation_id)
+            ai_response = await turn.run(ai_service.generate_response(
+                item.text, history, pool="batch", conversation_id=conversation_id, fallback=False
+            ))
+            await conversation_service.add_message(conversation_id, ChatMessage(role="user", content=item.text))
+            await conversation_service.add_message(conversation_id, ChatMessage(role="assistant", content=ai_response))
+    else:
+        history = await conversation_service.get_conversation_history(conversation_id)
+        ai_response = await ai_service.generate_response(
+            item.text, history, pool="batch", conversation_id=conversation_id, fallback=False
+        )
+    return BatchItemResult(
+        index=0,
+        id=item.id,
+        conversation_id=conversation_id,
+        ok=True,
+        response=ai_response,
+        processing_time=time.time() - start_time
+    )
+
+def _batch_result_line(result: BatchResult) -> BatchItemResult:
+    if result.ok:
+        return result.value.model_copy(update={"index": result.index})
+    error = result.error
+    if isinstance(error, ExecutorOverloaded):
+        status = 503
+    elif isinstance(error, (ConversationBusy, TurnSuperseded)):
+        status = 409
+    elif isinstance(error, RateLimited):
+        status = 429
+    elif isinstance(error, PreviousItemFailed):
+        status = 424
+    elif isinstance(error, ValueError):
+        status = 422
+    else:
+        logger.error(f"Batch item {result.index} failed: {error}")
+        status = 502
+    item = result.item if isinstance(result.item, BatchItem) else None
+    return BatchItemResult(
+        index=result.index,
+        id=item.id if item else None,
+        conversation_id=item.conversation_id if item else None,
+        ok=False,
+        status=status,
+        error=str(error) or type(error).__name__
+    )
+
+async def _speak(text: str, speak: Optional[bool], input_type: InputType) -> tuple[Optional[str], Optional[str]]:
+    """Spoken reply as (base64 audio, format), or (None, None) when not wanted or synthesis fails."""
+    tts_service = get_tts_service()
+    if not tts_service.wants_audio(speak, input_type):
+        return None, None
+    try:
+        audio = await tts_service.speak(text)
+    except Exception as e:
+        logger.error(f"Speech synthesis failed, replying with text only: {e}")
+        return None, None
+    return base64.b64encode(audio).decode("ascii"), tts_service.engine.audio_format
+
+@router.post("/chat/stream/{conversation_id}")
+async def stream_chat(
+    request: Request,
+    conversation_id: str,
+    input_data: TextInput,
+    timings: bool = False,
+    policy: Optional[TurnPolicy] = None,
+    speak: Optional[bool] = None,
+    last_event_id: Optional[str] = Header(None)
+):
+    """Stream the AI response as Server-Sent Events.
+
+    Every event has an ID. If the connection drops, send the same request again
+    with the last ID received in ``Last-Event-ID`` to resume from the next
+    event; the reply keeps generating for a while after the client leaves.
+    With ``timings=true`` the completion event carries a per-stage timing breakdown.
+    With ``speak=true`` each sentence is also sent as an ``audio`` event.
+    """
+    return await _stream_response(request, conversation_id, input_data.text, timings, policy, speak, last_event_id)
+
+@router.get("/chat/stream/{conversation_id}")
+async def stream_chat_response(
+    request: Request,
+    conversation_id: str,
+    message: str,
+    timings: bool = False,
+    policy: Optional[TurnPolicy] = None,
+    speak: Optional[bool] = None,
+    last_event_id: Optional[str] = Header(None)
+):
+    """Stream AI response for better user experience.
+
+    Kept for EventSource clients, which can only send GET; prefer the POST
+    endpoint, which takes the message in the body.
+    """
+    return await _stream_response(request, conversation_id, message, timings, policy, speak, last_event_id)
+
+async def _stream_response(
+    request: Request,
+    conversation_id: str,
+    message: str,
+    timings: bool,
+    policy: Optional[TurnPolicy],
+    speak: Optional[bool],
+    last_event_id: Optional[str]
+) -> StreamingResponse:
+    ai_service = get_ai_service()
+    conversation_service = get_conversation_service()
+    tts_service = get_tts_service()
+    if last_event_id:
+        # Reattach to the generation the client was following
+        resumed = resumable_streams.resume(last_event_id)
+        if resumed is None:
+            raise HTTPException(status_code=410, detail="Stream is no longer available, send the message again")
+        stream_id, stream, start = resumed
+    else:
+        # Shed load before committing to a 200 event stream; resuming is free
+        ai_service.admit("stream")
+        conversation_service.turns.check(conversation_id, policy)
+        await rate_limiter.admit(request, STREAM, conversation_id)
+        stream_id, stream = resumable_streams.start(
+            _generate_stream(conversation_id, message, timings, policy, tts_service.wants_audio(speak, InputType.TEXT))
+        )
+        start = 0
     
     return StreamingResponse(
-        generate_stream(),
+        resumable_streams.events(stream_id, stream, start),
         media_type="text/plain",
         headers={
             "Cache-Control": "no-cache",
@@ -186,54 +519,443 @@ async def stream_chat_response(conversation_id: str, message: str):
         }
     )
 
+async def _generate_stream(
+    conversation_id: str,
+    message: str,
+    timings: bool,
+    policy: Optional[TurnPolicy],
+    speak: bool
+):
+    """Run one streamed turn, yielding its SSE frames."""
+    ai_service = get_ai_service()
+    conversation_service = get_conversation_service()
+    tts_service = get_tts_service()
+    request_timings = begin_request("sse")
+    try:
+        async with conversation_service.turns.turn(conversation_id, policy) as turn:
+            # Get conversation history
+            history = await conversation_service.get_conversation_history(conversation_id)
+
+            # Generate streaming response
+            parts = []
+            envelope = Envelope(
+                StreamResponse(chunk="", is_complete=False, conversation_id=conversation_id).model_dump(),
+                "chunk", before="data: ", after="\n\n"
+            )
+            stream = coalescer.coalesce(observe_stream(
+                turn.stream(ai_service.generate_streaming_response(message, history, conversation_id=conversation_id)),
+                "sse"
+            ))
+            speech = tts_service.pipeline() if speak else None
+            try:
+                async for chunk in stream:
+                    parts.append(chunk)
+                    with request_timings.stage("serialize"):
+                        frame = envelope.fill(chunk)
+                    yield frame
+                    if speech is not None:
+                        # Spoken sentences go out as soon as they are ready
+                        speech.feed(chunk)
+                        for spoken in speech.ready():
+                            yield _sse_audio_frame(spoken)
+                if speech is not None:
+                    speech.finish()
+                    async for spoken in speech.rest():
+                        yield _sse_audio_frame(spoken)
+            finally:
+                # Runs when an abandoned stream is cancelled too, releasing the Gemini stream thread
+                await stream.aclose()
+                if speech is not None:
+                    speech.cancel()
+
+            # Add the exchange to history once the reply is complete, so a
+            # superseded turn leaves no unanswered message behind
+            user_message = ChatMessage(role="user", content=message)
+            await conversation_service.add_message(conversation_id, user_message)
+            ai_message = ChatMessage(role="assistant", content="".join(parts))
+            await conversation_service.add_message(conversation_id, ai_message)
+
+        # Send completion signal
+        breakdown = request_timings.finish()
+        final_response = StreamResponse(
+            chunk="",
+            is_complete=True,
+            conversation_id=conversation_id,
+            timings=breakdown if timings else None
+        )
+        yield f"data: {final_response.model_dump_json()}\n\n"
+
+    except Exception as e:
+        logger.error(f"Error in streaming response: {e}")
+        error_response = StreamResponse(
+            chunk=f"Error: {str(e)}",
+            is_complete=True,
+            conversation_id=conversation_id
+        )
+        yield f"data: {error_response.model_dump_json()}\n\n"
+
+def _sse_audio_frame(spoken: SpokenSentence) -> str:
+    return f"event: audio\ndata: {dumps(spoken.frame())}\n\n"
+
 @router.websocket("/ws/chat/{conversation_id}")
-async def websocket_chat(websocket: WebSocket, conversation_id: str):
-    """WebSocket endpoint for real-time chat."""
-    await manager.connect(websocket)
+async def websocket_chat(
+    websocket: WebSocket,
+    conversation_id: str,
+    policy: Optional[TurnPolicy] = None,
+    speak: Optional[bool] = None
+):
+    """WebSocket endpoint for real-time chat.
+
+    The client sends {"type": "message", "text": "...", "policy": "queue",
+    "speak": true} (a plain text frame is also taken as the message). The
+    server answers with JSON frames, each carrying a ``seq`` number: chunk
+    frames with the reply text, audio frames with spoken sentences when
+    ``speak`` is on, then one end frame with the timing breakdown, or an
+    error frame. Messages other clients add to the conversation arrive as
+    message frames.
+    """
+    ai_service = get_ai_service()
+    conversation_service = get_conversation_service()
+    tts_service = get_tts_service()
+    connection = await manager.connect(websocket, conversation_id)
+    client = rate_limiter.identify(websocket)
+    current_client.set(client)
     
     try:
         while True:
             # Receive message from client
             data = await websocket.receive_text()
-            logger.info(f"Received WebSocket message: {data}")
+            connection.touch()
+            
+            request = _parse_chat_frame(data)
+            if request["type"] == "ping":
+                connection.send({"type": "pong"})
+                continue
+            if request["type"] != "message":
+                continue
+            text = request.get("text", "")
+            logger.info(f"Received WebSocket message: {text}")
             
             try:
-                # Get conversation history
-                history = conversation_service.get_conversation_history(conversation_id)
-                
-                # Add user message to history
-                user_message = ChatMessage(role="user", content=data)
-                conversation_service.add_message(conversation_id, user_message)
-                
-                # Stream AI response back
-                full_response = ""
-                async for chunk in ai_service.generate_streaming_response(data, history):
-                    full_response += chunk
-                    await manager.send_personal_message(chunk, websocket)
+                await rate_limiter.check(client, STREAM, conversation_id)
+            except RateLimited as e:
+                connection.send({"type": "error", "detail": str(e), "retry_after": e.retry_after})
+                continue
+            
+            try:
+                request_timings = begin_request("ws")
+                turn_policy = TurnPolicy(request["policy"]) if request.get("policy") else policy
+                speak_reply = tts_service.wants_audio(request.get("speak", speak), InputType.TEXT)
                 
-                # Add complete AI response to history
-                ai_message = ChatMessage(role="assistant", content=full_response)
-                conversation_service.add_message(conversation_id, ai_message)
+                with connection.turn():
+                    async with conversation_service.turns.turn(conversation_id, turn_policy) as turn:
+                        # Get conversation history
+                        history = await conversation_service.get_conversation_history(conversation_id)
+                        
+                        # Stream AI response back, stopping generation if the client drops
+                        parts = []
+                        stream = coalescer.coalesce(observe_stream(
+                            turn.stream(ai_service.generate_streaming_response(text, history, conversation_id=conversation_id)),
+                            "ws"
+                        ))
+                        speech = tts_service.pipeline() if speak_reply else None
+                        if not await _relay(connection, stream, speech, parts):
+                            logger.info("WebSocket client went away mid-stream, generation cancelled")
+                            return
+                        
+                        # Add the exchange to history once the reply is complete, so a
+                        # superseded turn leaves no unanswered message behind
+                        user_message = ChatMessage(role="user", content=text)
+                        await conversation_service.add_message(conversation_id, user_message, origin=connection.id)
+                        ai_message = ChatMessage(role="assistant", content="".join(parts))
+                        await conversation_service.add_message(conversation_id, ai_message, origin=connection.id)
                 
-                # Send end-of-response marker
-                await manager.send_personal_message("[END]", websocket)
+                connection.send({"type": "end", "timings": request_timings.finish()})
                 
             except Exception as e:
                 logger.error(f"Error processing WebSocket message: {e}")
-                await manager.send_personal_message(f"Error: {str(e)}", websocket)
+                connection.send({"type": "error", "detail": str(e)})
                 
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
         logger.info("WebSocket client disconnected")
+    finally:
+        manager.disconnect(connection)
+
+async def _relay(
+    connection: Connection,
+    stream: AsyncIterator[str],
+    speech: Optional[SpeechPipeline],
+    parts: list
+) -> bool:
+    """Send a reply stream, and its sentences as audio, to a socket; False if the client went away."""
+    try:
+        async for chunk in stream:
+            parts.append(chunk)
+            if not connection.send({"type": "chunk", "text": chunk}, FrameKind.CHUNK):
+                return False
+            if speech is not None:
+                # Spoken sentences go out as soon as they are ready
+                speech.feed(chunk)
+                for spoken in speech.ready():
+                    connection.send(spoken.frame())
+        if speech is not None:
+            speech.finish()
+            async for spoken in speech.rest():
+                if not connection.send(spoken.frame()):
+                    return False
+        return True
+    finally:
+        await stream.aclose()
+        if speech is not None:
+            speech.cancel()
+
+def _parse_chat_frame(data: str) -> dict:
+    """Read a client text frame; anything that is not a JSON control frame is message text."""
+    if data.startswith("{"):
+        try:
+            frame = json.loads(data)
+        except ValueError:
+            frame = None
+        if isinstance(frame, dict) and isinstance(frame.get("type"), str):
+            return frame
+    return {"type": "message", "text": data}
+
+@router.websocket("/ws/speech/{conversation_id}")
+async def websocket_speech(
+    websocket: WebSocket,
+    conversation_id: str,
+    policy: Optional[TurnPolicy] = None,
+    speak: Optional[bool] = None
+):
+    """WebSocket endpoint for live voice input.
+
+    The client streams audio as binary frames while the user is talking. An
+    optional first text frame configures the stream:
+    {"type": "config", "format": "auto|wav|pcm|webm|ogg", "sample_rate": 16000,
+    "channels": 1, "language": "en-US", "policy": "queue|reject|supersede",
+    "speak": true}; {"type": "end"} marks the end of input.
+    The server detects where each utterance ends, recognizes it and streams the
+    reply as JSON frames, each carrying a ``seq`` number: utterance,
+    transcript, chunk, audio (when speech output is enabled), response_end
+    and error.
+    Messages other clients add to the conversation arrive as message frames.
+    The server sends {"type": "ping"} when the socket has been quiet; any
+    frame from the client (for example {"type": "pong"}) keeps it open, and
+    it is never closed for being quiet while an utterance is answered.
+    """
+    speech_service = get_speech_service()
+    ai_service = get_ai_service()
+    conversation_service = get_conversation_service()
+    tts_service = get_tts_service()
+    connection = await manager.connect(websocket, conversation_id)
+    subscription = connection.id
+    client = rate_limiter.identify(websocket)
+    current_client.set(client)
+
+    async def send(frame: dict, kind: FrameKind = FrameKind.CONTROL) -> bool:
+        return connection.send(frame, kind)
+
+    language = "en-US"
+    session = None
+    responder = None
+
+    async def respond(session):
+        """Answer utterances in order as the session produces them."""
+        try:
+            while True:
+                pcm = await session.utterances.get()
+                if pcm is None:
+                    return
+
+                if not await send({"type": "utterance", "duration": round(pcm.duration, 3)}):
+                    return
+                with connection.turn():
+                    try:
+                        # Charged before the utterance is recognized
+                        await rate_limiter.check(client, VOICE, conversation_id)
+                    except RateLimited as e:
+                        await send({"type": "error", "detail": str(e), "retry_after": e.retry_after})
+                        continue
+                    request_timings = begin_request("ws_speech")
+                    try:
+                        with request_timings.stage("recognize"):
+                            text = await speech_service.recognize(pcm, language)
+                    except ExecutorOverloaded as e:
+                        await send({"type": "error", "detail": str(e), "retry_after": e.retry_after})
+                        continue
+                    except (ValueError, RuntimeError) as e:
+                        await send({"type": "error", "detail": str(e)})
+                        continue
+                    if not await send({"type": "transcript", "text": text}):
+                        return
+
+                    try:
+                        async with conversation_service.turns.turn(conversation_id, policy) as turn:
+                            # Get conversation history
+                            history = await conversation_service.get_conversation_history(conversation_id)
+
+                            # Stream AI response back, stopping generation if the client drops
+                            parts = []
+                            stream = coalescer.coalesce(observe_stream(
+                                turn.stream(ai_service.generate_streaming_response(
+                                    text, history, pool="voice", conversation_id=conversation_id
+                                )),
+                                "ws_speech"
+                            ))
+                            speech = tts_service.pipeline() if tts_service.wants_audio(speak, InputType.SPEECH) else None
+                            if not await _relay(connection, stream, speech, parts):
+                                return
+
+                            # Stored with its reply, so a superseded turn leaves no unanswered message
+                            await conversation_service.add_message(
+                                conversation_id, ChatMessage(role="user", content=text), origin=subscription
+                            )
+                            await conversation_service.add_message(
+                                conversation_id, ChatMessage(role="assistant", content="".join(parts)), origin=subscription
+                            )
+                    except (ExecutorOverloaded, ConversationBusy) as e:
+                        await send({"type": "error", "detail": str(e), "retry_after": e.retry_after})
+                        continue
+                    except TurnSuperseded as e:
+                        await send({"type": "error", "detail": str(e)})
+                        continue
+                    except Exception as e:
+                        # One failed turn must not stop the session answering later utterances
+                        logger.error(f"Error answering utterance: {e}")
+                        await send({"type": "error", "detail": str(e)})
+                        continue
+                    if not await send({"type": "response_end", "timings": request_timings.finish()}):
+                        return
+        finally:
+            # Never leave the feeder waiting on a consumer that has stopped
+            session.abandon()
+
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            connection.touch()
+
+            if message.get("bytes"):
+                if session is None:
+                    session = speech_service.open_stream()
+                    responder = asyncio.create_task(respond(session))
+                await session.feed(message["bytes"])
+                continue
+
+            control = _parse_chat_frame(message.get("text") or "")
+            if control["type"] == "message":
+                # A stray text frame is the client's mistake, not a reason to end the session
+                await send({"type": "error", "detail": "Text frames must be JSON control frames; send audio as binary frames"})
+            elif control["type"] == "config" and session is None:
+                try:
+                    config_policy = TurnPolicy(control["policy"]) if control.get("policy") else policy
+                    sample_rate = int(control.get("sample_rate", 16000))
+                    channels = int(control.get("channels", 1))
+                    if sample_rate <= 0 or channels <= 0:
+                        raise ValueError("sample_rate and channels must be positive")
+                except (TypeError, ValueError) as e:
+                    await send({"type": "error", "detail": f"Invalid config frame: {e}"})
+                    continue
+                language = control.get("language", language)
+                policy = config_policy
+                if control.get("speak") is not None:
+                    speak = bool(control["speak"])
+                session = speech_service.open_stream(
+                    audio_format=control.get("format", "auto"),
+                    sample_rate=sample_rate,
+                    channels=channels
+                )
+                responder = asyncio.create_task(respond(session))
+            elif control["type"] == "ping":
+                await send({"type": "pong"})
+            elif control["type"] == "end":
+                if session is not None:
+                    await session.finish()
+                    await responder
+                    session = responder = None
+                await send({"type": "end"})
+
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.error(f"Error in speech WebSocket: {e}")
+        await send({"type": "error", "detail": str(e)})
+    finally:
+        if responder is not None and not responder.done():
+            responder.cancel()
+        if session is not None:
+            await session.close()
+        manager.disconnect(connection)
+        logger.info("Speech WebSocket client disconnected")
+
+@router.post("/tts/generate")
+async def generate_speech(input_data: TTSRequest):
+    """Convert text to speech audio, returned as the engine's audio format."""
+    tts_service = get_tts_service()
+    if not tts_service.enabled:
+        raise HTTPException(status_code=503, detail="Speech output is disabled, set TTS_ENGINE to enable it")
+    try:
+        audio = await tts_service.speak(input_data.text, input_data.voice)
+    except ExecutorOverloaded:
+        raise
+    except Exception as e:
+        logger.error(f"Error generating speech: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    return Response(content=audio, media_type=tts_service.engine.media_type)
+
+# Field order of messages in compact conversation pages
+COMPACT_FIELDS = ("seq", "role", "content", "timestamp")
 
 @router.get("/conversation/{conversation_id}")
-async def get_conversation_history(conversation_id: str):
-    """Get conversation history."""
-    history = conversation_service.get_conversation_history(conversation_id)
-    return {"conversation_id": conversation_id, "messages": history}
+async def get_conversation_history(
+    conversation_id: str,
+    after: Optional[int] = None,
+    limit: Optional[int] = None,
+    compact: bool = False,
+    if_none_match: Optional[str] = Header(None)
+):
+    """Get conversation history.
+
+    Every message has a ``seq`` number. Pass the ``next_after`` of the last
+    page (or the highest ``seq`` seen) as ``after`` to get only newer
+    messages, ``limit`` at a time; ``has_more`` says whether more follow.
+    Without ``after`` the most recent messages are returned. Responses carry
+    an ETag, and ``If-None-Match`` gets ``304 Not Modified`` while nothing
+    was added. ``compact=true`` sends each message as a
+    ``[seq, role, content, timestamp]`` array.
+    """
+    conversation_service = get_conversation_service()
+    conversation = await conversation_service.get_conversation(conversation_id)
+    # Messages are only ever appended, so the latest seq identifies every page;
+    # it comes from the hot copy, so revalidating needs no store read
+    last_seq = await conversation_service.last_seq(conversation_id, conversation)
+    etag = f'W/"{last_seq}-{after}-{limit}-{int(compact)}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if if_none_match and _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    
+    page = await conversation_service.page(conversation_id, conversation, after, limit)
+    if compact:
+        body = page.model_dump(exclude={"messages"})
+        body["fields"] = COMPACT_FIELDS
+        body["messages"] = [[message.seq, message.role, message.content, message.timestamp] for message in page.messages]
+        content = dumps(body)
+    else:
+        content = page.model_dump_json()
+    return Response(content=content, media_type="application/json", headers=headers)
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """Weak comparison against an If-None-Match list."""
+    if if_none_match.strip() == "*":
+        return True
+    bare = etag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == bare for candidate in if_none_match.split(","))
 
 @router.post("/conversation/new")
 async def create_new_conversation():
     """Create a new conversation."""
+    conversation_service = get_conversation_service()
     conversation_id = conversation_service.create_conversation_id()
     return {"conversation_id": conversation_id}
@@ -0,0 +1,653 @@
+"""
+Audio decoding for PandaLora speech input.
+
+Uncompressed WAV is parsed in-process straight from the upload buffer and
+converted with NumPy. Compressed containers are decoded with pydub/ffmpeg by
+``decode_audio``, which runs inside worker processes, so this module must stay
+importable on its own and only exchange plain, picklable data.
+"""
+
+import asyncio
+import io
+import logging
+import os
+import struct
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Sample format handed to the speech recognizer
+TARGET_SAMPLE_WIDTH = 2  # 16-bit
+TARGET_CHANNELS = 1
+
+# WAV format tags we can read without ffmpeg
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+@dataclass
+class PCMAudio:
+    """Mono 16-bit PCM audio backed by a NumPy array."""
+
+    samples: np.ndarray
+    sample_rate: int
+    sample_width: int = TARGET_SAMPLE_WIDTH
+
+    @property
+    def data(self) -> memoryview:
+        """Little-endian sample bytes, without copying the array."""
+        return memoryview(np.ascontiguousarray(self.samples, dtype="<i2")).cast("B")
+
+    @property
+    def duration(self) -> float:
+        """Length of the audio in seconds."""
+        return len(self.samples) / self.sample_rate
+
+
+@dataclass
+class WavInfo:
+    """Header fields and a zero-copy view of the sample data of a WAV file."""
+
+    format_tag: int
+    channels: int
+    sample_rate: int
+    bits_per_sample: int
+    data: memoryview
+    # Where the sample data starts within the file
+    data_offset: int = 0
+
+
+def sniff_format(audio_data: bytes) -> str:
+    """Guess the container format of an upload from its magic bytes.
+
+    Browsers routinely label MediaRecorder output (webm/ogg) as ``audio/wav``,
+    so the declared content type cannot be trusted.
+    """
+    header = audio_data[:12]
+    if header[:4] == b"RIFF" and header[8:12] == b"WAVE":
+        return "wav"
+    if header[:4] == b"\x1a\x45\xdf\xa3":
+        return "webm"
+    if header[:4] == b"OggS":
+        return "ogg"
+    if header[:4] == b"fLaC":
+        return "flac"
+    if header[4:8] == b"ftyp":
+        return "mp4"
+    if header[:3] == b"ID3" or (len(header) > 1 and header[0] == 0xFF and header[1] & 0xE0 == 0xE0):
+        return "mp3"
+    return "unknown"
+
+
+def parse_wav(audio_data: bytes) -> WavInfo:
+    """Walk the RIFF chunks of a WAV file without copying the sample data."""
+    view = memoryview(audio_data)
+    if len(view) < 12 or view[:4] != b"RIFF" or view[8:12] != b"WAVE":
+        raise ValueError("Not a RIFF/WAVE file")
+
+    fmt = None
+    offset = 12
+    while offset + 8 <= len(view):
+        chunk_id = bytes(view[offset:offset + 4])
+        (chunk_size,) = struct.unpack_from("<I", view, offset + 4)
+        body = offset + 8
+
+        if chunk_id == b"fmt ":
+            format_tag, channels, sample_rate = struct.unpack_from("<HHI", view, body)
+            (bits_per_sample,) = struct.unpack_from("<H", view, body + 14)
+            if format_tag == WAVE_FORMAT_EXTENSIBLE and chunk_size >= 40:
+                # The real format tag is the first field of the SubFormat GUID
+                (format_tag,) = struct.unpack_from("<H", view, body + 24)
+            fmt = (format_tag, channels, sample_rate, bits_per_sample)
+        elif chunk_id == b"data":
+            if fmt is None:
+                raise ValueError("WAV data chunk precedes its fmt chunk")
+            # Streaming writers often leave the size unset; clamp to what we have
+            end = min(body + chunk_size, len(view))
+            block_align = fmt[1] * (fmt[3] // 8)
+            end -= (end - body) % block_align if block_align else 0
+            return WavInfo(*fmt, data=view[body:end], data_offset=body)
+
+        # Chunks are padded to an even number of bytes
+        offset = body + chunk_size + (chunk_size & 1)
+
+    raise ValueError("WAV file has no data chunk")
+
+
+def wav_samples(wav: WavInfo) -> np.ndarray:
+    """Interpret WAV sample data as interleaved int16 samples.
+
+    16-bit PCM is returned as a view over the upload buffer; other sample
+    formats are converted.
+    """
+    bits = wav.bits_per_sample
+    if wav.format_tag == WAVE_FORMAT_PCM:
+        if bits == 16:
+            return np.frombuffer(wav.data, dtype="<i2")
+        if bits == 8:
+            samples = np.frombuffer(wav.data, dtype=np.uint8).astype(np.int16)
+            return (samples - 128) << 8
+        if bits == 24:
+            raw = np.frombuffer(wav.data, dtype=np.uint8).reshape(-1, 3)
+            # Keep the two most significant bytes of each little-endian sample
+            return raw[:, 1].astype(np.int16) | (raw[:, 2].astype(np.int16) << 8)
+        if bits == 32:
+            return (np.frombuffer(wav.data, dtype="<i4") >> 16).astype(np.int16)
+    elif wav.format_tag == WAVE_FORMAT_IEEE_FLOAT:
+        if bits in (32, 64):
+            samples = np.frombuffer(wav.data, dtype="<f4" if bits == 32 else "<f8")
+            return (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16)
+    raise ValueError(f"Unsupported WAV encoding (format {wav.format_tag:#x}, {bits}-bit)")
+
+
+def to_mono(samples: np.ndarray, channels: int) -> np.ndarray:
+    """Downmix interleaved samples by averaging the channels."""
+    if channels <= 1:
+        return samples
+    frames = samples[: len(samples) - len(samples) % channels].reshape(-1, channels)
+    return frames.mean(axis=1, dtype=np.float32)
+
+
+def resample(samples: np.ndarray, source_rate: int, target_rate: int) -> np.ndarray:
+    """Linearly resample a mono signal, low-pass filtering first when downsampling."""
+    if source_rate == target_rate or len(samples) == 0:
+        return samples
+    samples = samples.astype(np.float32, copy=False)
+    if target_rate < source_rate:
+        # Box filter as wide as the decimation ratio keeps aliasing out of the
+        # speech band at a fraction of the cost of a proper FIR design
+        width = int(np.ceil(source_rate / target_rate))
+        if width > 1:
+            samples = np.convolve(samples, np.full(width, 1.0 / width, dtype=np.float32), mode="same")
+    duration = len(samples) / source_rate
+    target_length = int(round(duration * target_rate))
+    positions = np.arange(target_length, dtype=np.float64) * (source_rate / target_rate)
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+
+class StreamResampler:
+    """``resample`` for a signal that arrives in chunks.
+
+    The filter history and the interpolation phase carry over from one chunk
+    to the next, so the output has no seams at chunk boundaries and its
+    length follows the input's instead of drifting by a rounding per chunk.
+    """
+
+    def __init__(self, source_rate: int, target_rate: int):
+        self.step = source_rate / target_rate
+        width = int(np.ceil(source_rate / target_rate)) if target_rate < source_rate else 1
+        self._kernel = np.full(width, 1.0 / width, dtype=np.float32) if width > 1 else None
+        # Filter input carried over from the previous chunk
+        self._history = np.zeros(width - 1, dtype=np.float32)
+        # Last filtered sample, the left end of the next interpolation, and its index
+        self._last = np.zeros(0, dtype=np.float32)
+        self._last_index = 0
+        self._produced = 0
+
+    def feed(self, samples: np.ndarray) -> np.ndarray:
+        samples = samples.astype(np.float32, copy=False)
+        if self._kernel is not None:
+            padded = np.concatenate([self._history, samples])
+            self._history = padded[len(padded) - len(self._history):]
+            samples = np.convolve(padded, self._kernel, mode="valid")
+        signal = np.concatenate([self._last, samples])
+        if len(signal) == 0:
+            return signal
+        first = self._last_index
+        last = first + len(signal) - 1
+        # Output sample n sits at source position n * step
+        count = max(0, int(np.floor(last / self.step)) + 1 - self._produced)
+        positions = (self._produced + np.arange(count, dtype=np.float64)) * self.step - first
+        self._produced += count
+        self._last, self._last_index = signal[-1:], last
+        return np.interp(positions, np.arange(len(signal)), signal).astype(np.float32)
+
+
+def to_int16(samples: np.ndarray) -> np.ndarray:
+    """Round a signal to 16-bit samples, clipping what does not fit."""
+    if samples.dtype == np.int16:
+        return samples
+    return np.clip(np.rint(samples), -32768, 32767).astype(np.int16)
+
+
+def normalize_pcm(samples: np.ndarray, channels: int, sample_rate: int, target_rate: int) -> PCMAudio:
+    """Convert interleaved int16 samples to mono 16-bit audio for recognition.
+
+    Audio already recorded below ``target_rate`` is left at its native rate;
+    upsampling would add cost without adding information.
+    """
+    mono = to_mono(samples, channels)
+    if sample_rate > target_rate:
+        mono = resample(mono, sample_rate, target_rate)
+        sample_rate = target_rate
+    mono = to_int16(mono)
+    return PCMAudio(samples=mono, sample_rate=sample_rate)
+
+
+def load_wav(audio_data: bytes, target_rate: int) -> tuple[PCMAudio, dict]:
+    """Fast path for WAV uploads: parse and convert without ffmpeg."""
+    timings = {}
+
+    started = time.perf_counter()
+    wav = parse_wav(audio_data)
+    samples = wav_samples(wav)
+    timings["decode"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    pcm = normalize_pcm(samples, wav.channels, wav.sample_rate, target_rate)
+    timings["normalize"] = time.perf_counter() - started
+
+    return pcm, timings
+
+
+def decode_audio(audio_data: bytes, target_rate: int) -> tuple[PCMAudio, dict]:
+    """Decode any ffmpeg-supported container into mono 16-bit PCM.
+
+    Returns the PCM audio together with the time spent in each stage.
+    """
+    # pydub is only needed here, in the worker processes
+    from pydub import AudioSegment
+
+    timings = {}
+
+    started = time.perf_counter()
+    segment = AudioSegment.from_file(io.BytesIO(audio_data))
+    segment = segment.set_sample_width(TARGET_SAMPLE_WIDTH)
+    samples = np.frombuffer(segment.raw_data, dtype="<i2")
+    timings["decode"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    pcm = normalize_pcm(samples, segment.channels, segment.frame_rate, target_rate)
+    timings["normalize"] = time.perf_counter() - started
+
+    return pcm, timings
+
+
+def warm_up_worker() -> int:
+    """Load the decoder in a fresh worker process; returns its PID."""
+    from pydub import AudioSegment  # noqa: F401
+
+    return os.getpid()
+
+
+@dataclass
+class VADSettings:
+    """Voice-activity detection knobs used to trim silence before recognition."""
+
+    enabled: bool = True
+    # Analysis frame length
+    frame_ms: int = 30
+    # A frame is speech when it is this far above the estimated noise floor...
+    margin_db: float = 12.0
+    # ...and above this absolute level (dBFS)
+    floor_db: float = -50.0
+    # Audio kept after speech stops, so word endings are not clipped
+    hangover_ms: int = 300
+    # Audio kept before speech starts, for soft onsets
+    preroll_ms: int = 150
+    # Pauses inside the utterance are shortened to at most this long
+    max_pause_ms: int = 500
+    # Live streams only: silence that ends an utterance, and the longest
+    # utterance buffered before it is cut off
+    end_silence_ms: int = 700
+    max_utterance_ms: int = 30000
+
+    @classmethod
+    def from_env(cls) -> "VADSettings":
+        return cls(
+            enabled=os.getenv("VAD_ENABLED", "true").lower() in ("1", "true", "yes"),
+            margin_db=float(os.getenv("VAD_MARGIN_DB", str(cls.margin_db))),
+            floor_db=float(os.getenv("VAD_FLOOR_DB", str(cls.floor_db))),
+            hangover_ms=int(os.getenv("VAD_HANGOVER_MS", str(cls.hangover_ms))),
+            max_pause_ms=int(os.getenv("VAD_MAX_PAUSE_MS", str(cls.max_pause_ms))),
+            end_silence_ms=int(os.getenv("VAD_END_SILENCE_MS", str(cls.end_silence_ms))),
+            max_utterance_ms=int(os.getenv("VAD_MAX_UTTERANCE_MS", str(cls.max_utterance_ms))),
+        )
+
+
+def frame_energy_db(samples: np.ndarray, frame_length: int) -> np.ndarray:
+    """Mean energy of each whole frame, in dB relative to full scale."""
+    frame_count = len(samples) // frame_length
+    frames = samples[: frame_count * frame_length].reshape(frame_count, frame_length)
+    power = np.mean(np.square(frames, dtype=np.float64), axis=1) / (32768.0 ** 2)
+    return 10.0 * np.log10(power + 1e-12)
+
+
+def _window_any(flags: np.ndarray, before: int, after: int) -> np.ndarray:
+    """Dilate flags: mark ``before`` frames ahead of each set flag and ``after`` frames behind it."""
+    counts = np.concatenate(([0], np.cumsum(flags, dtype=np.int64)))
+    index = np.arange(len(flags))
+    lo = np.clip(index - after, 0, len(flags))
+    hi = np.clip(index + before + 1, 0, len(flags))
+    return counts[hi] - counts[lo] > 0
+
+
+def speech_frames(energy_db: np.ndarray, settings: VADSettings, frame_ms: int) -> np.ndarray:
+    """Classify frames as speech, extended by the hangover and pre-roll."""
+    if len(energy_db) == 0:
+        return np.zeros(0, dtype=bool)
+    # The quietest tenth of the clip approximates the background noise
+    noise_floor = np.percentile(energy_db, 10)
+    threshold = max(settings.floor_db, noise_floor + settings.margin_db)
+    speech = energy_db > threshold
+    hangover = settings.hangover_ms // frame_ms
+    preroll = settings.preroll_ms // frame_ms
+    return _window_any(speech, before=preroll, after=hangover)
+
+
+def trim_silence(pcm: PCMAudio, settings: VADSettings) -> tuple[PCMAudio, float]:
+    """Drop leading/trailing silence and shorten long pauses.
+
+    Returns the compacted audio and the number of seconds removed. Audio in
+    which no frame stands out (no silence to measure against, or too little
+    dynamic range) is returned untrimmed; the recognizer has the final say.
+    """
+    frame_length = max(1, pcm.sample_rate * settings.frame_ms // 1000)
+    active = speech_frames(frame_energy_db(pcm.samples, frame_length), settings, settings.frame_ms)
+    if not active.any():
+        return pcm, 0.0
+
+    # Within the spoken span, keep each pause's first and last half of max_pause
+    first, last = np.flatnonzero(active)[[0, -1]]
+    keep = np.zeros(len(active), dtype=bool)
+    span = active[first:last + 1]
+    half_pause = max(1, settings.max_pause_ms // settings.frame_ms // 2)
+    keep[first:last + 1] = _window_any(span, before=half_pause, after=half_pause)
+
+    frames = pcm.samples[: len(active) * frame_length].reshape(len(active), frame_length)
+    samples = frames[keep].reshape(-1)
+    removed = (len(pcm.samples) - len(samples)) / pcm.sample_rate
+    return PCMAudio(samples=samples, sample_rate=pcm.sample_rate), removed
+
+
+class StreamingVAD:
+    """Segments a live mono stream into utterances as audio arrives.
+
+    Memory is bounded: at most ``preroll_ms`` of audio is held while waiting
+    for speech, pauses are capped at ``max_pause_ms``, and an utterance is cut
+    off once it reaches ``max_utterance_ms``.
+    """
+
+    # Speech always dips between words; input that stays above the threshold
+    # this long without a single quieter frame is the background getting louder
+    NOISE_WINDOW_MS = 1500
+
+    def __init__(self, settings: VADSettings, sample_rate: int):
+        self.settings = settings
+        self.sample_rate = sample_rate
+        self.frame_length = max(1, sample_rate * settings.frame_ms // 1000)
+        frame_ms = settings.frame_ms
+        self._hangover_frames = settings.hangover_ms // frame_ms
+        self._max_pause_frames = max(self._hangover_frames, settings.max_pause_ms // frame_ms)
+        self._end_frames = max(1, settings.end_silence_ms // frame_ms)
+        self._max_frames = max(1, settings.max_utterance_ms // frame_ms)
+
+        self._remainder = np.zeros(0, dtype=np.int16)
+        self._preroll: deque = deque(maxlen=max(1, settings.preroll_ms // frame_ms))
+        self._utterance: list[np.ndarray] = []
+        self._silence_run = 0
+        # Start by assuming a quiet room; the estimate adapts on non-speech
+        # frames, and jumps to the level of input that never dips
+        self._noise_db = settings.floor_db - settings.margin_db
+        # Energies of the last NOISE_WINDOW_MS of frames
+        self._recent: deque = deque(maxlen=max(1, self.NOISE_WINDOW_MS // frame_ms))
+        self.in_speech = False
+
+    def _is_speech(self, energy_db: float) -> bool:
+        self._recent.append(energy_db)
+        threshold = max(self.settings.floor_db, self._noise_db + self.settings.margin_db)
+        if len(self._recent) == self._recent.maxlen and min(self._recent) > threshold:
+            self._noise_db = min(self._recent)
+            threshold = self._noise_db + self.settings.margin_db
+        if energy_db > threshold:
+            return True
+        # Follow drops in the noise floor immediately and rises slowly
+        if energy_db < self._noise_db:
+            self._noise_db = energy_db
+        else:
+            self._noise_db += 0.05 * (energy_db - self._noise_db)
+        return False
+
+    def feed(self, samples: np.ndarray) -> list[PCMAudio]:
+        """Consume samples, returning any utterances that ended in them."""
+        if len(self._remainder):
+            samples = np.concatenate((self._remainder, samples))
+        frame_count = len(samples) // self.frame_length
+        self._remainder = samples[frame_count * self.frame_length:].copy()
+        if frame_count == 0:
+            return []
+
+        frames = samples[: frame_count * self.frame_length].reshape(frame_count, self.frame_length)
+        completed = []
+        for frame, energy in zip(frames, frame_energy_db(samples, self.frame_length)):
+            speech = self._is_speech(energy)
+            if not self.in_speech:
+                if speech:
+                    self.in_speech = True
+                    self._utterance = list(self._preroll) + [frame]
+                    self._preroll.clear()
+                    self._silence_run = 0
+                else:
+                    self._preroll.append(frame)
+                continue
+
+            if speech:
+                self._silence_run = 0
+                self._utterance.append(frame)
+            else:
+                self._silence_run += 1
+                if self._silence_run <= self._max_pause_frames:
+                    self._utterance.append(frame)
+                if self._silence_run >= self._end_frames:
+                    completed.append(self._finish())
+                    continue
+
+            if len(self._utterance) >= self._max_frames:
+                completed.append(self._finish())
+        return completed
+
+    def flush(self) -> Optional[PCMAudio]:
+        """End the stream, returning the utterance in progress, if any."""
+        return self._finish() if self.in_speech else None
+
+    def _finish(self) -> PCMAudio:
+        # Keep only the hangover's worth of trailing silence
+        trailing = min(self._silence_run, self._max_pause_frames) - self._hangover_frames
+        frames = self._utterance[:-trailing] if trailing > 0 else self._utterance
+        utterance = PCMAudio(samples=np.concatenate(frames), sample_rate=self.sample_rate)
+        self._utterance = []
+        self._silence_run = 0
+        self.in_speech = False
+        return utterance
+
+
+class PCMStreamDecoder:
+    """Incrementally converts raw PCM or WAV byte chunks to mono 16-bit samples at ``target_rate``."""
+
+    # Give up on a WAV header that has not produced a data chunk by this size
+    MAX_HEADER_BYTES = 64 * 1024
+
+    def __init__(self, target_rate: int, sample_rate: int = 16000, channels: int = 1, wav: bool = False):
+        self.target_rate = target_rate
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self._pending = b""
+        self._need_header = wav
+        self._resampler: Optional[StreamResampler] = None
+
+    def feed(self, data: bytes) -> np.ndarray:
+        data = self._pending + data
+        if self._need_header:
+            try:
+                wav = parse_wav(data)
+            except ValueError:
+                if len(data) > self.MAX_HEADER_BYTES:
+                    raise ValueError("Could not find WAV audio data in the stream")
+                self._pending = data
+                return np.zeros(0, dtype=np.int16)
+            if wav.format_tag != WAVE_FORMAT_PCM or wav.bits_per_sample != 16:
+                raise ValueError("Streamed WAV audio must be 16-bit PCM")
+            self.sample_rate, self.channels = wav.sample_rate, wav.channels
+            self._need_header = False
+            data = data[wav.data_offset:]
+
+        # Only whole sample frames can be converted; carry the rest over
+        block_align = 2 * self.channels
+        usable = len(data) - len(data) % block_align
+        self._pending = data[usable:]
+        mono = to_mono(np.frombuffer(data, dtype="<i2", count=usable // 2), self.channels)
+        if self.sample_rate != self.target_rate:
+            # The VAD and the utterances run at target_rate, so unlike an
+            # upload a stream recorded below it is upsampled too
+            if self._resampler is None:
+                self._resampler = StreamResampler(self.sample_rate, self.target_rate)
+            mono = self._resampler.feed(mono)
+        return to_int16(mono)
+
+
+class FFmpegStreamDecoder:
+    """Decodes a compressed audio stream (webm/ogg/...) through an ffmpeg pipe.
+
+    Decoded samples are delivered to ``on_samples`` as ffmpeg produces them,
+    so decoding overlaps with the upload instead of starting after it.
+    """
+
+    READ_SIZE = 8192
+
+    def __init__(self, target_rate: int, on_samples: Callable[[np.ndarray], Awaitable[None]]):
+        self.target_rate = target_rate
+        self.on_samples = on_samples
+        self._process: Optional[asyncio.subprocess.Process] = None
+        self._reader: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._process = await asyncio.create_subprocess_exec(
+            "ffmpeg", "-hide_banner", "-loglevel", "error",
+            # Start decoding as soon as the container header is readable
+            "-fflags", "nobuffer", "-probesize", "32768", "-analyzeduration", "0",
+            "-i", "pipe:0",
+            "-f", "s16le", "-ac", "1", "-ar", str(self.target_rate), "pipe:1",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        self._reader = asyncio.create_task(self._read())
+
+    async def _read(self):
+        pending = b""
+        while True:
+            data = await self._process.stdout.read(self.READ_SIZE)
+            if not data:
+                return
+            data = pending + data
+            usable = len(data) - len(data) % 2
+            pending = data[usable:]
+            if usable:
+                await self.on_samples(np.frombuffer(data, dtype="<i2", count=usable // 2))
+
+    async def feed(self, data: bytes):
+        if self._reader.done():
+            raise ValueError("Audio decoder stopped unexpectedly")
+        self._process.stdin.write(data)
+        # Waits while ffmpeg is behind, pushing backpressure to the socket
+        await self._process.stdin.drain()
+
+    async def finish(self):
+        """Close the input and wait for ffmpeg to emit the remaining audio."""
+        if self._process.stdin.can_write_eof():
+            self._process.stdin.write_eof()
+        await self._reader
+        await self._process.wait()
+
+    async def close(self):
+        if self._process and self._process.returncode is None:
+            self._process.kill()
+            await self._process.wait()
+        if self._reader and not self._reader.done():
+            self._reader.cancel()
+
+
+class SpeechStreamSession:
+    """Turns a live stream of audio chunks into complete utterances.
+
+    The container format is sniffed from the first chunk: WAV and raw 16-bit
+    PCM are converted in-process, anything else is piped through ffmpeg.
+    Finished utterances are put on ``utterances``; ``None`` marks the end of
+    the stream. Once ``max_pending`` utterances are waiting, feeding waits for
+    the consumer, pushing backpressure back to the socket.
+    """
+
+    def __init__(
+        self,
+        settings: VADSettings,
+        target_rate: int,
+        audio_format: str = "auto",
+        sample_rate: int = 16000,
+        channels: int = 1,
+        max_pending: int = 2,
+    ):
+        self.target_rate = target_rate
+        self.audio_format = audio_format
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.vad = StreamingVAD(settings, target_rate)
+        self.utterances: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self._abandoned = False
+        self._pcm: Optional[PCMStreamDecoder] = None
+        self._ffmpeg: Optional[FFmpegStreamDecoder] = None
+
+    async def _open(self, first_chunk: bytes):
+        audio_format = self.audio_format
+        if audio_format == "auto":
+            audio_format = sniff_format(first_chunk)
+            if audio_format == "unknown":
+                audio_format = "pcm"
+        self.audio_format = audio_format
+        if audio_format in ("wav", "pcm"):
+            self._pcm = PCMStreamDecoder(
+                self.target_rate, self.sample_rate, self.channels, wav=audio_format == "wav"
+            )
+        else:
+            self._ffmpeg = FFmpegStreamDecoder(self.target_rate, self._on_samples)
+            await self._ffmpeg.start()
+
+    async def _on_samples(self, samples: np.ndarray):
+        for utterance in self.vad.feed(samples):
+            await self._emit(utterance)
+
+    async def _emit(self, utterance: Optional[PCMAudio]):
+        # Waits while the consumer is still busy with earlier utterances
+        if not self._abandoned:
+            await self.utterances.put(utterance)
+
+    def abandon(self):
+        """The consumer has stopped: discard queued and later utterances instead of waiting for it."""
+        self._abandoned = True
+        while not self.utterances.empty():
+            self.utterances.get_nowait()
+
+    async def feed(self, data: bytes):
+        if self._pcm is None and self._ffmpeg is None:
+            await self._open(data)
+        if self._pcm is not None:
+            await self._on_samples(self._pcm.feed(data))
+        else:
+            await self._ffmpeg.feed(data)
+
+    async def finish(self):
+        """Flush buffered audio and signal the end of the stream."""
+        if self._ffmpeg is not None:
+            await self._ffmpeg.finish()
+        final = self.vad.flush()
+        if final is not None:
+            await self._emit(final)
+        await self._emit(None)
+
+    async def close(self):
+        if self._ffmpeg is not None:
+            await self._ffmpeg.close()
@@ -0,0 +1,182 @@
+"""
+Batch execution for PandaLora's offline chat jobs.
+
+``BatchRunner`` works through a stream of items with a cap on how many run at
+once. Items that share a key (a conversation) run one after another in input
+order, while different keys run in parallel. Results come back as soon as
+each item finishes, and only a bounded number of items is read ahead of the
+ones already reported, so memory stays flat however long the input is, as
+long as the input itself is read incrementally (``read_lines``).
+"""
+
+import asyncio
+import logging
+import os
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, AsyncGenerator, AsyncIterator, Awaitable, Callable, Generic, Hashable, Optional, TypeVar, Union
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class PreviousItemFailed(RuntimeError):
+    """Reported for an item that was not run because an earlier item with its key failed."""
+
+    def __init__(self, index: int):
+        super().__init__(f"Skipped because item {index} of the same conversation failed")
+        self.index = index
+
+
+@dataclass
+class BatchResult(Generic[T, R]):
+    """The outcome of one item: ``value`` on success, ``error`` otherwise."""
+
+    index: int
+    item: T
+    value: Optional[R] = None
+    error: Optional[BaseException] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class BatchRunner:
+    """Runs items concurrently, in order within a key, streaming results out."""
+
+    def __init__(
+        self,
+        concurrency: int = 4,
+        read_ahead: int = 64,
+        max_concurrency: int = 32,
+        max_document_bytes: int = 10 * 1024 * 1024,
+    ):
+        self.concurrency = max(1, concurrency)
+        self.max_concurrency = max(self.concurrency, max_concurrency)
+        self.read_ahead = max(1, read_ahead)
+        # Largest JSON document held in memory at once: a whole JSON batch, or one NDJSON line
+        self.max_document_bytes = max(1, max_document_bytes)
+
+    @classmethod
+    def from_env(cls) -> "BatchRunner":
+        return cls(
+            concurrency=int(os.getenv("BATCH_CONCURRENCY", "4")),
+            read_ahead=int(os.getenv("BATCH_READ_AHEAD", "64")),
+            max_concurrency=int(os.getenv("BATCH_MAX_CONCURRENCY", "32")),
+            max_document_bytes=int(os.getenv("BATCH_MAX_DOCUMENT_BYTES", str(10 * 1024 * 1024))),
+        )
+
+    def limit(self, requested: Optional[int]) -> int:
+        """The concurrency to use for a batch that asked for ``requested``."""
+        if not requested:
+            return self.concurrency
+        return max(1, min(requested, self.max_concurrency))
+
+    async def run(
+        self,
+        items: AsyncIterator[T],
+        handle: Callable[[T], Awaitable[R]],
+        key: Callable[[T], Optional[Hashable]] = lambda item: None,
+        concurrency: Optional[int] = None,
+    ) -> AsyncGenerator[BatchResult, None]:
+        """Yield a ``BatchResult`` for every item of ``items`` as it completes.
+
+        Items whose ``key`` is None are independent of each other. Once an
+        item fails, later items with its key are reported as
+        ``PreviousItemFailed`` without running. Closing the generator early
+        cancels everything still running.
+        """
+        slots = asyncio.Semaphore(self.limit(concurrency))
+        # Items read but not yet reported
+        room = asyncio.Semaphore(self.read_ahead)
+        results: asyncio.Queue = asyncio.Queue()
+        # key -> (index, item) pairs waiting their turn; the head is running
+        chains: dict[Any, deque] = {}
+        # key -> index of the item that failed first
+        failed: dict[Any, int] = {}
+        workers: set[asyncio.Task] = set()
+
+        async def work(chain_key):
+            chain = chains[chain_key]
+            while chain:
+                index, item = chain[0]
+                if chain_key in failed:
+                    result = BatchResult(index, item, error=PreviousItemFailed(failed[chain_key]))
+                else:
+                    async with slots:
+                        try:
+                            result = BatchResult(index, item, value=await handle(item))
+                        except Exception as e:
+                            result = BatchResult(index, item, error=e)
+                            failed[chain_key] = index
+                chain.popleft()
+                results.put_nowait(result)
+            del chains[chain_key]
+
+        async def read():
+            index = 0
+            try:
+                async for item in items:
+                    await room.acquire()
+                    chain_key = key(item)
+                    # Independent items get a chain of their own
+                    chain_key = ("item", index) if chain_key is None else ("key", chain_key)
+                    if chain_key in chains:
+                        chains[chain_key].append((index, item))
+                    else:
+                        chains[chain_key] = deque([(index, item)])
+                        task = asyncio.ensure_future(work(chain_key))
+                        workers.add(task)
+                        task.add_done_callback(workers.discard)
+                    index += 1
+                if workers:
+                    await asyncio.gather(*workers)
+            finally:
+                results.put_nowait(None)
+
+        reader = asyncio.ensure_future(read())
+        try:
+            while True:
+                result = await results.get()
+                if result is None:
+                    break
+                room.release()
+                yield result
+            # Surfaces a failure to read the input
+            await reader
+        finally:
+            for task in [reader, *workers]:
+                task.cancel()
+            await asyncio.gather(reader, *workers, return_exceptions=True)
+
+
+async def read_lines(chunks: AsyncIterator[bytes], max_length: int) -> AsyncGenerator[Union[bytes, ValueError], None]:
+    """Split a byte stream into lines as it arrives, holding at most one line in memory.
+
+    A line longer than ``max_length`` bytes is skipped and a ``ValueError``
+    is yielded in its place.
+    """
+    line = bytearray()
+    too_long = False
+    async for chunk in chunks:
+        start = 0
+        while True:
+            end = chunk.find(b"\n", start)
+            if not too_long:
+                line += chunk[start:] if end < 0 else chunk[start:end]
+                if len(line) > max_length:
+                    too_long = True
+                    line.clear()
+            if end < 0:
+                break
+            yield ValueError(f"Line is longer than {max_length} bytes") if too_long else bytes(line)
+            line.clear()
+            too_long = False
+            start = end + 1
+    if too_long:
+        yield ValueError(f"Line is longer than {max_length} bytes")
+    elif line:
+        yield bytes(line)
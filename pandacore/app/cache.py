@@ -0,0 +1,256 @@
+"""
+Caching primitives for PandaLora.
+"""
+
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Optional, Union
+
+Value = Union[str, bytes]
+
+
+class LRUCache:
+    """Thread-safe LRU mapping with an optional sliding TTL per entry."""
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.maxsize = max(1, maxsize)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data: "OrderedDict[Hashable, tuple[Any, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expiry(self, now: float) -> float:
+        return now + self.ttl if self.ttl else float("inf")
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the cached value, refreshing its recency and TTL."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at <= now:
+                del self._data[key]
+                self.evictions += 1
+                self.misses += 1
+                return default
+            self._data[key] = (value, self._expiry(now))
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        """Insert or replace a value, evicting expired and least recent entries."""
+        now = time.monotonic()
+        with self._lock:
+            self._data[key] = (value, self._expiry(now))
+            self._data.move_to_end(key)
+            self._purge(now)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def _purge(self, now: float):
+        # Sliding TTLs keep the LRU order equal to expiry order, so expired
+        # entries are always at the front
+        while self._data:
+            key, (_, expires_at) = next(iter(self._data.items()))
+            if expires_at > now and len(self._data) <= self.maxsize:
+                break
+            del self._data[key]
+            self.evictions += 1
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            entry = self._data.get(key)
+            return entry is not None and entry[1] > time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class DiskCache:
+    """Content-addressed files on disk, expired by modification time.
+
+    Keys are hex digests; each value is stored in ``<dir>/<key[:2]>/<key>``.
+    All methods block on file I/O and should be called from a worker thread.
+    """
+
+    def __init__(self, directory: str, ttl: Optional[float] = None, max_entries: int = 10000):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            if self.ttl and time.time() - os.path.getmtime(path) > self.ttl:
+                os.unlink(path)
+                return None
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def set(self, key: str, value: bytes):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename so readers never see a partial file
+        temp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp, "wb") as f:
+            f.write(value)
+        os.replace(temp, path)
+
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self.prune()
+
+    def prune(self):
+        """Drop expired entries and the oldest ones beyond ``max_entries``."""
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    entries.append((os.path.getmtime(path), path))
+                except FileNotFoundError:
+                    continue
+        entries.sort()
+        cutoff = time.time() - self.ttl if self.ttl else None
+        excess = len(entries) - self.max_entries
+        for index, (mtime, path) in enumerate(entries):
+            if index >= excess and (cutoff is None or mtime >= cutoff):
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+
+class ResponseCache:
+    """Two-tier (memory, then optional disk) cache of generated replies.
+
+    Also coalesces concurrent misses for the same key into one computation
+    ("single flight") so a burst of identical prompts costs one upstream call.
+    Values are strings, or bytes with ``binary=True``.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        ttl: Optional[float] = None,
+        directory: Optional[str] = None,
+        binary: bool = False,
+    ):
+        self.memory = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.disk = DiskCache(directory, ttl=ttl) if directory else None
+        self.binary = binary
+        self._in_flight: dict[str, asyncio.Future] = {}
+        # In-flight computation -> callers still waiting for it
+        self._waiters: dict[asyncio.Future, int] = {}
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def key(*parts: str) -> str:
+        """Stable digest of the parts that determine a reply."""
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    async def get(self, key: str) -> Optional[Value]:
+        value = self.memory.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        if self.disk is not None:
+            data = await asyncio.get_running_loop().run_in_executor(None, self.disk.get, key)
+            if data is not None:
+                value = data if self.binary else data.decode("utf-8")
+                self.memory.set(key, value)
+                self.hits += 1
+                self.disk_hits += 1
+                return value
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: Value):
+        self.memory.set(key, value)
+        if self.disk is not None:
+            data = value if self.binary else value.encode("utf-8")
+            await asyncio.get_running_loop().run_in_executor(None, self.disk.set, key, data)
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Value]]) -> Value:
+        """Return the cached value or compute it once, sharing it with concurrent callers.
+
+        The computation runs as its own task, so a caller that gives up (for
+        example a disconnected client) does not cancel it for the others. It
+        is cancelled once the last caller waiting for it gives up, so an
+        abandoned reply (a superseded turn) stops costing upstream calls.
+        """
+        value = await self.get(key)
+        if value is not None:
+            return value
+
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._compute_and_store(key, compute))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._finish_flight(key, done))
+        else:
+            self.coalesced += 1
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiters[task] == 1:
+                task.cancel()
+            raise
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+
+    async def _compute_and_store(self, key: str, compute: Callable[[], Awaitable[Value]]) -> Value:
+        value = await compute()
+        await self.set(key, value)
+        return value
+
+    def _finish_flight(self, key: str, task: asyncio.Future):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        # Mark failures as retrieved even if every caller already gave up
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self.memory),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+        }
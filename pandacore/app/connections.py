@@ -0,0 +1,305 @@
+"""
+WebSocket connection management for PandaLora.
+
+Every connection gets an ID, a bounded outbound queue and a writer task that
+only exists while there is something to send, so a slow client never blocks
+the generation feeding it and idle connections cost no task at all. A single
+heartbeat task pings quiet clients and closes the ones that stopped answering,
+leaving alone connections that are in the middle of a turn.
+
+Every frame is a JSON object; the writer stamps each one with a per-connection
+``seq`` number as it goes out, so clients can order and de-duplicate frames.
+"""
+
+import asyncio
+import logging
+import os
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from enum import Enum
+from typing import Optional, Union
+from fastapi import WebSocket
+from .framing import dumps
+
+logger = logging.getLogger(__name__)
+
+Message = Union[str, dict]
+
+# Close code for clients dropped by the server (RFC 6455 "try again later")
+CLOSE_TRY_AGAIN_LATER = 1013
+# Close code for clients that stopped answering pings
+CLOSE_GOING_AWAY = 1001
+
+
+class SlowClientPolicy(str, Enum):
+    # Merge pending chunks into one frame; nothing is lost
+    COALESCE = "coalesce"
+    # Drop chunks and events; control frames are always sent
+    DROP = "drop"
+    # Close the connection
+    DISCONNECT = "disconnect"
+
+
+class FrameKind(str, Enum):
+    # Part of a streamed reply; may be merged with the previous chunk
+    CHUNK = "chunk"
+    # Broadcast notification; may be dropped
+    EVENT = "event"
+    # Must be delivered (transcripts, end and error frames)
+    CONTROL = "control"
+
+
+class Connection:
+    """One WebSocket with its outbound queue."""
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        conversation_id: Optional[str],
+        max_queue: int,
+        policy: SlowClientPolicy,
+    ):
+        self.id = uuid.uuid4().hex
+        self.websocket = websocket
+        self.conversation_id = conversation_id
+        self.max_queue = max(1, max_queue)
+        self.policy = policy
+        self.closed = False
+        self.last_seen = time.monotonic()
+        # Turns in progress; the handler is not reading the client's frames meanwhile
+        self.in_turn = 0
+        self.seq = 0
+        self.dropped = 0
+        self.coalesced = 0
+        # Pending [kind, message] pairs; a list so a chunk can be merged in place
+        self._queue: deque = deque()
+        self._writer: Optional[asyncio.Task] = None
+        self._drained = asyncio.Event()
+        self._drained.set()
+
+    def touch(self):
+        """Record that the client is alive (it sent us something)."""
+        self.last_seen = time.monotonic()
+
+    @contextmanager
+    def turn(self):
+        """Mark the block as a turn, which the heartbeat never times out.
+
+        Frames the client sends during a turn, pongs included, are only read
+        after it, so its silence says nothing about whether it is alive.
+        """
+        self.in_turn += 1
+        try:
+            yield
+        finally:
+            self.in_turn -= 1
+            self.touch()
+
+    def send(self, message: Message, kind: FrameKind = FrameKind.CONTROL) -> bool:
+        """Queue a frame without waiting; returns False once the connection is gone.
+
+        ``message`` is a dict or an already serialized JSON object.
+        """
+        if self.closed:
+            return False
+
+        if len(self._queue) >= self.max_queue and kind != FrameKind.CONTROL:
+            if self.policy == SlowClientPolicy.DISCONNECT:
+                logger.warning(f"WebSocket {self.id} fell {len(self._queue)} frames behind, disconnecting")
+                self._closing(CLOSE_TRY_AGAIN_LATER)
+                return False
+            if self.policy == SlowClientPolicy.COALESCE and kind == FrameKind.CHUNK:
+                tail = self._queue[-1]
+                if tail[0] == FrameKind.CHUNK and self._merge(tail, message):
+                    self.coalesced += 1
+                    return True
+            if kind == FrameKind.EVENT or self.policy == SlowClientPolicy.DROP:
+                self.dropped += 1
+                return True
+            # A chunk that cannot be merged (the tail is a control frame) is
+            # queued anyway; the queue exceeds its bound by at most one
+            # frame per control frame
+
+        self._queue.append([kind, message])
+        self._drained.clear()
+        if self._writer is None:
+            self._writer = asyncio.ensure_future(self._write())
+        return True
+
+    @staticmethod
+    def _merge(tail: list, message: Message) -> bool:
+        previous = tail[1]
+        if isinstance(previous, dict) and isinstance(message, dict) and "text" in previous and "text" in message:
+            tail[1] = {**previous, "text": previous["text"] + message["text"]}
+            return True
+        return False
+
+    async def _write(self):
+        """Drain the queue, then exit; the next send starts a new writer."""
+        try:
+            while self._queue:
+                _, message = self._queue.popleft()
+                if isinstance(message, dict):
+                    message = dumps(message)
+                self.seq += 1
+                await self.websocket.send_text(f'{{"seq":{self.seq},{message[1:]}')
+        except Exception as e:
+            logger.info(f"WebSocket {self.id} send failed, closing: {e}")
+            self.closed = True
+            self._queue.clear()
+        finally:
+            self._writer = None
+            self._drained.set()
+
+    async def drain(self, timeout: Optional[float] = None):
+        """Wait until everything queued so far has been written."""
+        await asyncio.wait_for(self._drained.wait(), timeout)
+
+    def _closing(self, code: int) -> Optional[asyncio.Future]:
+        """Stop sending and close the socket in the background."""
+        if self.closed:
+            return None
+        self.closed = True
+        self._queue.clear()
+        return asyncio.ensure_future(self._close_socket(code))
+
+    async def _close_socket(self, code: int):
+        try:
+            await self.websocket.close(code)
+        except Exception:
+            pass
+
+    async def close(self, code: int = 1000):
+        closing = self._closing(code)
+        if closing is not None:
+            await closing
+
+    @property
+    def pending(self) -> int:
+        return len(self._queue)
+
+
+class ConnectionManager:
+    """Manages WebSocket connections for real-time streaming, keyed by connection ID."""
+
+    def __init__(
+        self,
+        max_queue: int = 64,
+        policy: SlowClientPolicy = SlowClientPolicy.COALESCE,
+        ping_interval: float = 20.0,
+        ping_timeout: float = 20.0,
+    ):
+        self.max_queue = max_queue
+        self.policy = policy
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout
+        self.connections: dict[str, Connection] = {}
+        # conversation_id -> IDs of the connections following it
+        self.conversations: dict[str, set[str]] = {}
+        self._heartbeat: Optional[asyncio.Task] = None
+        self.timed_out = 0
+        # Totals from connections that have already gone
+        self._dropped = 0
+        self._coalesced = 0
+
+    @classmethod
+    def from_env(cls) -> "ConnectionManager":
+        return cls(
+            max_queue=int(os.getenv("WS_SEND_QUEUE", "64")),
+            policy=SlowClientPolicy(os.getenv("WS_SLOW_CLIENT_POLICY", "coalesce").lower()),
+            ping_interval=float(os.getenv("WS_PING_INTERVAL", "20")),
+            ping_timeout=float(os.getenv("WS_PING_TIMEOUT", "20")),
+        )
+
+    async def connect(
+        self,
+        websocket: WebSocket,
+        conversation_id: Optional[str] = None,
+    ) -> Connection:
+        await websocket.accept()
+        connection = Connection(websocket, conversation_id, self.max_queue, self.policy)
+        self.connections[connection.id] = connection
+        if conversation_id is not None:
+            self.conversations.setdefault(conversation_id, set()).add(connection.id)
+        logger.debug(f"WebSocket {connection.id} connected. Total connections: {len(self.connections)}")
+        return connection
+
+    def disconnect(self, connection: Connection):
+        connection.closed = True
+        if self.connections.pop(connection.id, None) is None:
+            return
+        self._dropped += connection.dropped
+        self._coalesced += connection.coalesced
+        followers = self.conversations.get(connection.conversation_id)
+        if followers is not None:
+            followers.discard(connection.id)
+            if not followers:
+                del self.conversations[connection.conversation_id]
+        logger.debug(f"WebSocket {connection.id} disconnected. Total connections: {len(self.connections)}")
+
+    def broadcast(self, conversation_id: str, message: Message, exclude: Optional[str] = None) -> int:
+        """Queue a frame to every socket following the conversation."""
+        followers = self.conversations.get(conversation_id)
+        if not followers:
+            return 0
+        # Serialize once for every recipient
+        if isinstance(message, dict):
+            message = dumps(message)
+        delivered = 0
+        for connection_id in followers:
+            connection = self.connections.get(connection_id)
+            if connection is None or connection_id == exclude:
+                continue
+            if connection.send(message, FrameKind.EVENT):
+                delivered += 1
+        return delivered
+
+    async def deliver(self, event: dict):
+        """Forward a conversation event published by any worker to local followers."""
+        # The connection that produced the message has already seen it
+        self.broadcast(
+            event.get("conversation_id"),
+            {key: value for key, value in event.items() if key != "origin"},
+            exclude=event.get("origin")
+        )
+
+    def start(self):
+        if self._heartbeat is None and self.ping_interval > 0:
+            self._heartbeat = asyncio.create_task(self._run_heartbeat())
+
+    async def _run_heartbeat(self):
+        """Ping quiet sockets and close the ones that stopped answering."""
+        ping = dumps({"type": "ping"})
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            now = time.monotonic()
+            for connection in list(self.connections.values()):
+                if connection.in_turn:
+                    continue
+                quiet = now - connection.last_seen
+                if quiet > self.ping_interval + self.ping_timeout:
+                    self.timed_out += 1
+                    logger.info(f"WebSocket {connection.id} stopped answering pings, closing")
+                    connection._closing(CLOSE_GOING_AWAY)
+                    self.disconnect(connection)
+                elif quiet >= self.ping_interval:
+                    connection.send(ping)
+
+    async def close(self):
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            await asyncio.gather(self._heartbeat, return_exceptions=True)
+            self._heartbeat = None
+
+    def stats(self) -> dict:
+        connections = list(self.connections.values())
+        return {
+            "connections": len(connections),
+            "conversations": len(self.conversations),
+            "pending_frames": sum(c.pending for c in connections),
+            "dropped_frames": self._dropped + sum(c.dropped for c in connections),
+            "coalesced_frames": self._coalesced + sum(c.coalesced for c in connections),
+            "timed_out": self.timed_out,
+        }
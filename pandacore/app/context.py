@@ -0,0 +1,186 @@
+"""
+Prompt assembly for PandaLora.
+
+Builds the context sent to Gemini within a token budget: recent turns are
+included newest first until the budget is spent, and the turns that no longer
+fit are folded into a rolling per-conversation summary that is refreshed in
+the background instead of on the request path.
+"""
+
+import asyncio
+import logging
+import math
+import os
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional
+from .cache import LRUCache
+from .models import ChatMessage
+
+logger = logging.getLogger(__name__)
+
+# Rough size of a token for English text; close enough to budget prompts
+# without calling the tokenizer for every message
+CHARS_PER_TOKEN = 4
+
+TRUNCATION_MARKER = " [...]"
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap approximation of how many tokens ``text`` costs."""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def truncate_to_tokens(text: str, tokens: int) -> str:
+    """Cut ``text`` down to roughly ``tokens`` tokens."""
+    limit = tokens * CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    return text[:max(0, limit - len(TRUNCATION_MARKER))].rstrip() + TRUNCATION_MARKER
+
+
+@dataclass(frozen=True)
+class RenderedMessage:
+    text: str
+    tokens: int
+
+
+@dataclass(frozen=True)
+class ConversationSummary:
+    text: str
+    tokens: int
+    # Timestamp of the newest message folded into the summary
+    folded_through: str
+
+
+Summarizer = Callable[[str, list], Awaitable[str]]
+
+
+class ContextBuilder:
+    """Assembles token-budgeted prompts from cached per-message renders.
+
+    ``summarize(previous_summary, messages)`` is called in the background to
+    fold turns that fell out of the budget into the conversation's summary;
+    until it finishes, prompts use the previous summary.
+    """
+
+    def __init__(
+        self,
+        system_prompt: str,
+        budget: int = 1500,
+        message_tokens: int = 512,
+        summary_tokens: int = 256,
+        summary_batch: int = 4,
+        summarize: Optional[Summarizer] = None,
+        cache_size: int = 4096,
+        summary_cache_size: int = 1000,
+        summary_ttl: Optional[float] = None,
+    ):
+        self.header = system_prompt + "\n\n"
+        self.budget = budget
+        self.message_tokens = message_tokens
+        self.summary_tokens = summary_tokens
+        self.summary_batch = max(1, summary_batch)
+        self.summarize = summarize
+        self._rendered = LRUCache(maxsize=cache_size)
+        self._summaries = LRUCache(maxsize=summary_cache_size, ttl=summary_ttl)
+        self._summarizing: dict[str, asyncio.Task] = {}
+        self.summaries_built = 0
+        self.summary_failures = 0
+
+    @classmethod
+    def from_env(cls, system_prompt: str, summarize: Optional[Summarizer] = None) -> "ContextBuilder":
+        enabled = os.getenv("CONTEXT_SUMMARY_ENABLED", "true").lower() in ("1", "true", "yes")
+        return cls(
+            system_prompt,
+            budget=int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500")),
+            message_tokens=int(os.getenv("CONTEXT_MESSAGE_TOKENS", "512")),
+            summary_tokens=int(os.getenv("CONTEXT_SUMMARY_TOKENS", "256")),
+            summary_batch=int(os.getenv("CONTEXT_SUMMARY_BATCH", "4")),
+            summarize=summarize if enabled else None,
+            summary_cache_size=int(os.getenv("CONVERSATION_CACHE_SIZE", "1000")),
+            summary_ttl=float(os.getenv("CONVERSATION_CACHE_TTL", "1800")),
+        )
+
+    def render(self, message: ChatMessage) -> RenderedMessage:
+        """Render one history line, reusing the cached render when possible."""
+        key = (message.role, message.content)
+        rendered = self._rendered.get(key)
+        if rendered is None:
+            role_prefix = "Human: " if message.role == "user" else "PandaLora: "
+            text = role_prefix + truncate_to_tokens(message.content, self.message_tokens) + "\n"
+            rendered = RenderedMessage(text, estimate_tokens(text))
+            self._rendered.set(key, rendered)
+        return rendered
+
+    def build(self, message: str, history: Optional[list] = None, conversation_id: Optional[str] = None) -> str:
+        """Render the prompt for ``message`` following ``history``."""
+        history = history or []
+        summary = self._summaries.get(conversation_id) if conversation_id else None
+        remaining = self.budget - (summary.tokens if summary else 0)
+
+        # Walk back from the newest turn until the budget is spent
+        lines = []
+        start = len(history)
+        while start > 0:
+            rendered = self.render(history[start - 1])
+            if rendered.tokens > remaining:
+                break
+            lines.append(rendered.text)
+            remaining -= rendered.tokens
+            start -= 1
+        lines.reverse()
+
+        if start > 0 and conversation_id and self.summarize is not None:
+            self._schedule_summary(conversation_id, history[:start], summary)
+
+        parts = [self.header]
+        if summary:
+            parts.append(f"Summary of the earlier conversation: {summary.text}\n\n")
+        parts.extend(lines)
+        parts.append(f"Human: {message}\nPandaLora: ")
+        return "".join(parts)
+
+    def _schedule_summary(self, conversation_id: str, evicted: list, summary: Optional[ConversationSummary]):
+        """Fold turns that fell out of the window into the summary, off the request path."""
+        if conversation_id in self._summarizing:
+            return
+        folded_through = summary.folded_through if summary else None
+        pending = [m for m in evicted if folded_through is None or (m.timestamp or "") > folded_through]
+        # Wait for a few turns to pile up so the summary isn't rebuilt every request
+        if len(pending) < self.summary_batch:
+            return
+        try:
+            task = asyncio.get_running_loop().create_task(self._fold(conversation_id, summary, pending))
+        except RuntimeError:
+            return
+        self._summarizing[conversation_id] = task
+        task.add_done_callback(lambda _: self._summarizing.pop(conversation_id, None))
+
+    async def _fold(self, conversation_id: str, summary: Optional[ConversationSummary], messages: list):
+        try:
+            text = await self.summarize(summary.text if summary else "", messages)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.summary_failures += 1
+            logger.warning(f"Could not summarize conversation {conversation_id}: {e}")
+            return
+        text = truncate_to_tokens(text.strip(), self.summary_tokens)
+        folded_through = max((m.timestamp or "" for m in messages), default="")
+        self._summaries.set(conversation_id, ConversationSummary(text, estimate_tokens(text), folded_through))
+        self.summaries_built += 1
+        logger.debug(f"Folded {len(messages)} messages into the summary of conversation {conversation_id}")
+
+    def stats(self) -> dict:
+        return {
+            "rendered_cached": len(self._rendered),
+            "summaries": len(self._summaries),
+            "summarizing": len(self._summarizing),
+            "summaries_built": self.summaries_built,
+            "summary_failures": self.summary_failures,
+        }
+
+    def close(self):
+        """Cancel summaries still in progress."""
+        for task in list(self._summarizing.values()):
+            task.cancel()
@@ -0,0 +1,133 @@
+"""
+Output framing for PandaLora's streamed replies.
+
+Gemini can emit many tiny chunks; sending each as its own SSE event or
+WebSocket frame costs a serialization and a write apiece. ``ChunkCoalescer``
+batches them by size and time, ``Envelope`` serializes the constant part of a
+frame once per stream, and ``dumps`` uses orjson when it is installed.
+"""
+
+import asyncio
+import json
+import os
+from typing import AsyncGenerator, AsyncIterator, Optional
+
+try:
+    import orjson
+except ImportError:  # optional dependency, the standard library encoder is the fallback
+    orjson = None
+
+
+def dumps(value) -> str:
+    """Serialize to compact JSON."""
+    if orjson is not None:
+        return orjson.dumps(value).decode()
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+
+class Envelope:
+    """A JSON frame with one string field left open, serialized once.
+
+    ``fill(text)`` only has to encode ``text``; everything around it is
+    reused, optionally wrapped (for example in ``data: ...\\n\\n`` for SSE).
+    """
+
+    # Placeholder that no encoder leaves unescaped inside the template
+    _MARKER = "\x00"
+
+    def __init__(self, template: dict, field: str, before: str = "", after: str = ""):
+        document = dumps({**template, field: self._MARKER})
+        head, tail = document.split(dumps(self._MARKER), 1)
+        self.prefix = before + head
+        self.suffix = tail + after
+
+    def fill(self, text: str) -> str:
+        return self.prefix + dumps(text) + self.suffix
+
+
+class ChunkCoalescer:
+    """Merges streamed chunks into fewer, larger ones.
+
+    The first chunk passes through immediately so time to first chunk is
+    unaffected. After that, chunks are held until ``max_chars`` characters
+    have built up or ``max_delay`` seconds have passed since the oldest one
+    held, whichever comes first.
+    """
+
+    def __init__(self, max_chars: int = 64, max_delay: float = 0.03):
+        self.max_chars = max_chars
+        self.max_delay = max_delay
+
+    @classmethod
+    def from_env(cls) -> "ChunkCoalescer":
+        return cls(
+            max_chars=int(os.getenv("STREAM_COALESCE_CHARS", "64")),
+            max_delay=float(os.getenv("STREAM_COALESCE_MS", "30")) / 1000,
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_chars > 1 and self.max_delay > 0
+
+    async def coalesce(self, source: AsyncIterator[str]) -> AsyncGenerator[str, None]:
+        """Yield the text of ``source`` in coalesced chunks, closing it when done."""
+        if not self.enabled:
+            try:
+                async for chunk in source:
+                    yield chunk
+            finally:
+                await _aclose(source)
+            return
+
+        loop = asyncio.get_running_loop()
+        iterator = source.__aiter__()
+        pending: list[str] = []
+        size = 0
+        deadline = 0.0
+        first = True
+        upcoming: Optional[asyncio.Future] = None
+        try:
+            while True:
+                if upcoming is None:
+                    upcoming = asyncio.ensure_future(iterator.__anext__())
+                if pending:
+                    done, _ = await asyncio.wait({upcoming}, timeout=max(0.0, deadline - loop.time()))
+                    if not done:
+                        # Window expired before the next chunk arrived
+                        text, pending, size = "".join(pending), [], 0
+                        yield text
+                        continue
+                try:
+                    chunk = await upcoming
+                except StopAsyncIteration:
+                    break
+                finally:
+                    if upcoming.done():
+                        upcoming = None
+
+                if first:
+                    first = False
+                    yield chunk
+                    continue
+                if not pending:
+                    deadline = loop.time() + self.max_delay
+                pending.append(chunk)
+                size += len(chunk)
+                if size >= self.max_chars:
+                    text, pending, size = "".join(pending), [], 0
+                    yield text
+
+            if pending:
+                yield "".join(pending)
+        finally:
+            if upcoming is not None and not upcoming.done():
+                upcoming.cancel()
+                # The generator must stop running before it can be closed
+                await asyncio.gather(upcoming, return_exceptions=True)
+            await _aclose(source)
+
+
+async def _aclose(source):
+    close = getattr(source, "aclose", None)
+    if close is not None:
+        await close()
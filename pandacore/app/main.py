@@ -11,18 +11,26 @@ It is responsible for:
 '''
 
 import os
+import asyncio
 import logging
 
-from fastapi import FastAPI, HTTPException, status
+from fastapi import FastAPI, HTTPException, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 from dotenv import load_dotenv
 
 # Load environment variables FIRST
 load_dotenv()
 
 # Import our custom modules AFTER loading environment
-from .api import router
+from .api import manager, router
+from .metrics import MetricsMiddleware, registry
 from .models import TextInput
+from .ratelimit import RateLimited
+from .services import get_ai_service, get_conversation_service, get_speech_service, get_tts_service, services
+from .turns import ConversationBusy, TurnSuperseded
+from .warmup import WarmUp
+from .workers import ExecutorOverloaded
 
 # Configure logging
 logging.basicConfig(
@@ -49,15 +57,84 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Time every request until its last byte is sent
+app.add_middleware(MetricsMiddleware)
+
 # Include API routes
 app.include_router(router, prefix="/api/v1")
 
-# Basic health check
+# Shed load with a retryable status instead of queueing without bound
+@app.exception_handler(ExecutorOverloaded)
+async def overloaded_handler(request: Request, exc: ExecutorOverloaded):
+    """Turn a rejected job into 503 Service Unavailable with a Retry-After hint."""
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+# Overlapping turns on one conversation
+@app.exception_handler(ConversationBusy)
+async def conversation_busy_handler(request: Request, exc: ConversationBusy):
+    """Another message on the conversation is still being answered."""
+    return JSONResponse(
+        status_code=status.HTTP_409_CONFLICT,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+@app.exception_handler(TurnSuperseded)
+async def turn_superseded_handler(request: Request, exc: TurnSuperseded):
+    """A newer message on the conversation cancelled this one."""
+    return JSONResponse(status_code=status.HTTP_409_CONFLICT, content={"detail": str(exc)})
+
+# Clients over their token bucket
+@app.exception_handler(RateLimited)
+async def rate_limited_handler(request: Request, exc: RateLimited):
+    """Turn a refused turn into 429 Too Many Requests with a Retry-After hint."""
+    return JSONResponse(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+# Optional warm-up run in the background after startup (see WARMUP)
+async def _warm_up_gemini():
+    # Built in a thread: importing the Gemini client takes a while
+    ai_service = await asyncio.to_thread(get_ai_service)
+    await ai_service.warm_up()
+
+async def _warm_up_audio():
+    speech_service = await asyncio.to_thread(get_speech_service)
+    await speech_service.warm_up()
+
+async def _warm_up_tts():
+    await asyncio.to_thread(get_tts_service)
+
+warmup = WarmUp.from_env({
+    "gemini": _warm_up_gemini,
+    "audio": _warm_up_audio,
+    "tts": _warm_up_tts,
+})
+
+# Basic health check, doubling as the readiness probe
 @app.get("/health", status_code=status.HTTP_200_OK)
-async def health_check():
-    """Health check endpoint to verify API is running."""
+async def health_check(response: Response):
+    """Health check endpoint to verify API is running.
+
+    Answers 503 until the startup warm-up has finished, so a load balancer
+    only sends traffic to warm workers. A failed warm-up step is reported
+    as ``degraded`` but still counts as ready.
+    """
+    if not warmup.ready:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        health = "starting"
+    else:
+        health = "degraded" if warmup.degraded else "healthy"
     return {
-        "status": "healthy",
+        "status": health,
+        "ready": warmup.ready,
+        "warmup": warmup.state,
         "service": "PandaLora Backend API",
         "version": "1.0.0",
         "features": [
@@ -70,6 +147,67 @@ async def health_check():
         ]
     }
 
+# Worker pool and cache state, read at scrape time. Scrapes never build a
+# service; one that has not been used yet has nothing to report
+def _worker_pools():
+    pools = []
+    if services["ai"].instance is not None:
+        pools.extend(services["ai"].instance.pools.values())
+    if services["speech"].instance is not None:
+        pools.extend([services["speech"].instance.decode_pool, services["speech"].instance.recognizer_pool])
+    if services["tts"].instance is not None:
+        pools.append(services["tts"].instance.pool)
+    return pools
+
+def _built(name: str, read):
+    """Collector reading one value from a service, if it has been built."""
+    def collect():
+        service = services[name].instance
+        return [] if service is None else [((), read(service))]
+    return collect
+
+for _field, _kind, _help in [
+    ("active", "gauge", "Jobs currently running in the pool."),
+    ("waiting", "gauge", "Jobs queued for a pool slot."),
+    ("completed", "counter", "Jobs the pool has finished."),
+    ("rejected", "counter", "Jobs turned away because the queue was full."),
+    ("timed_out", "counter", "Jobs that gave up waiting for a slot."),
+]:
+    registry.callback(
+        f"pandalora_executor_{_field}" + ("_total" if _kind == "counter" else ""),
+        _help,
+        lambda field=_field: [((pool.name,), getattr(pool, field)) for pool in _worker_pools()],
+        labelnames=["pool"],
+        kind=_kind
+    )
+
+for _field in ["hits", "disk_hits", "misses", "coalesced"]:
+    registry.callback(
+        f"pandalora_response_cache_{_field}_total",
+        f"Response cache {_field.replace('_', ' ')}.",
+        _built("ai", lambda service, field=_field: getattr(service.response_cache, field)),
+        kind="counter"
+    )
+    registry.callback(
+        f"pandalora_tts_cache_{_field}_total",
+        f"Speech synthesis cache {_field.replace('_', ' ')}.",
+        _built("tts", lambda service, field=_field: getattr(service.cache, field)),
+        kind="counter"
+    )
+
+# 0 closed, 1 half open, 2 open
+registry.callback(
+    "pandalora_llm_circuit_state",
+    "Gemini circuit breaker state: 0 closed, 1 half open, 2 open.",
+    _built("ai", lambda service: ["closed", "half_open", "open"].index(service.resilience.breaker.state)),
+)
+
+# Prometheus scrape endpoint
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Latency histograms, pool and connection gauges in Prometheus text format."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 # Legacy endpoint for backward compatibility
 @app.post("/chat")
 async def chat_with_panda_legacy(input_data: TextInput):
@@ -92,12 +230,29 @@ async def startup_event():
     logger.info("✅ API routes loaded")
     logger.info("✅ WebSocket support enabled")
     
+    # Ping quiet WebSocket clients and close the dead ones
+    manager.start()
+    
+    # Listen for conversation events from other workers
+    conversation_service = get_conversation_service()
+    conversation_service.state.subscribe("conversation", manager.deliver)
+    await conversation_service.start()
+    logger.info(f"✅ Shared state: {type(conversation_service.state).__name__}")
+    
     # Check if Gemini API key is configured
     if os.getenv("GEMINI_API_KEY"):
         logger.info("✅ Gemini API key found")
     else:
         logger.warning("⚠️  GEMINI_API_KEY not found - AI features will use fallback responses")
     
+    if os.getenv("TTS_ENGINE", "none").lower() != "none":
+        logger.info(f"✅ Speech output: {os.getenv('TTS_ENGINE')}")
+    
+    # Build services and open connections ahead of the first requests
+    if warmup.steps:
+        warmup.start()
+        logger.info(f"⏳ Warming up: {', '.join(warmup.steps)}")
+    
     logger.info("🐼 PandaLora is ready to chat!")
 
 # Shutdown event
@@ -105,6 +260,20 @@ async def startup_event():
 async def shutdown_event():
     """Cleanup on shutdown."""
     logger.info("Shutting down PandaLora Backend API...")
+    
+    await manager.close()
+    await warmup.close()
+    
+    # Persist any conversation writes still waiting for the next batch
+    if services["conversation"].instance is not None:
+        await services["conversation"].instance.close()
+        logger.info("✅ Conversation store flushed")
+    
+    # Only services that were used have pools to stop
+    for name in ("speech", "ai", "tts"):
+        if services[name].instance is not None:
+            services[name].instance.close()
+    logger.info("✅ Worker pools stopped")
     logger.info("👋 Goodbye!")
 
 if __name__ == "__main__":
@@ -0,0 +1,358 @@
+"""
+Latency instrumentation for PandaLora.
+
+A small, dependency-free metrics registry rendered in the Prometheus text
+exposition format, plus helpers to time the stages of a request (upload,
+decode, recognition, Gemini, serialization) and the progress of streamed
+replies.
+"""
+
+import contextvars
+import math
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import AsyncIterator, Callable, Dict, Iterable, Iterator, Optional, Sequence
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+RATIO_BUCKETS = (0.0, 0.1, 0.25, 0.5, 0.75, 0.9, 1.0)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [per-bucket counts..., +Inf count], sum
+        self._values: Dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(float(bound))}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class CallbackMetric(Metric):
+    """A gauge or counter whose samples are read from live objects at scrape time.
+
+    ``collect`` returns ``(label_values, value)`` pairs.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        collect: Callable[[], Iterable[tuple]],
+        labelnames: Sequence[str] = (),
+        kind: str = "gauge",
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.kind = kind
+        self.collect = collect
+
+    def samples(self) -> Iterable[str]:
+        for key, value in self.collect():
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Registry:
+    """Named metrics rendered together on ``/metrics``."""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        # Re-registering a name replaces the old metric, e.g. on app reload
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(
+        self,
+        name: str,
+        documentation: str,
+        collect: Callable[[], Iterable[tuple]],
+        labelnames: Sequence[str] = (),
+        kind: str = "gauge",
+    ) -> CallbackMetric:
+        return self.register(CallbackMetric(name, documentation, collect, labelnames, kind))
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+registry = Registry()
+
+HTTP_REQUEST_SECONDS = registry.histogram(
+    "pandalora_http_request_duration_seconds",
+    "Time from request start until the last byte of the response was sent.",
+    ["method", "route", "status"],
+)
+STAGE_SECONDS = registry.histogram(
+    "pandalora_stage_duration_seconds",
+    "Time spent in each stage of handling a chat turn.",
+    ["route", "stage"],
+)
+EXECUTOR_WAIT_SECONDS = registry.histogram(
+    "pandalora_executor_wait_seconds",
+    "Time jobs waited for a worker pool slot.",
+    ["pool"],
+)
+STREAM_TTFT_SECONDS = registry.histogram(
+    "pandalora_stream_time_to_first_chunk_seconds",
+    "Time from starting a streamed reply until its first chunk was ready.",
+    ["route"],
+)
+STREAM_CHUNK_RATE = registry.histogram(
+    "pandalora_stream_chunks_per_second",
+    "Chunks per second delivered after the first chunk of a streamed reply.",
+    ["route"],
+    buckets=RATE_BUCKETS,
+)
+STREAM_CHUNKS = registry.counter(
+    "pandalora_stream_chunks_total",
+    "Chunks delivered on streamed replies.",
+    ["route"],
+)
+BATCH_ITEMS = registry.counter(
+    "pandalora_batch_items_total",
+    "Items processed by /chat/batch, by outcome.",
+    ["outcome"],
+)
+LLM_EVENTS = registry.counter(
+    "pandalora_llm_events_total",
+    "Decisions taken around Gemini calls: attempts, retries, hedges, timeouts, circuit breaker and fallbacks.",
+    ["event"],
+)
+RATE_LIMIT_DECISIONS = registry.counter(
+    "pandalora_rate_limit_decisions_total",
+    "Rate limiter decisions by kind of turn, bucket scope and outcome.",
+    ["kind", "scope", "decision"],
+)
+RATE_LIMIT_FILL = registry.histogram(
+    "pandalora_rate_limit_bucket_fill_ratio",
+    "How full a bucket was after each rate limiter decision (1 is full).",
+    ["scope"],
+    buckets=RATIO_BUCKETS,
+)
+
+
+class RequestTimings:
+    """Collects the stage durations of one request and mirrors them into histograms."""
+
+    def __init__(self, route: str):
+        self.route = route
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+
+    def add(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        STAGE_SECONDS.observe(seconds, route=self.route, stage=stage)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def finish(self) -> Dict[str, float]:
+        """Record the total and return the breakdown, rounded for responses."""
+        self.add("total", time.perf_counter() - self.started)
+        return {stage: round(seconds, 6) for stage, seconds in self.stages.items()}
+
+
+_current_timings: contextvars.ContextVar[Optional[RequestTimings]] = contextvars.ContextVar(
+    "pandalora_request_timings", default=None
+)
+
+
+def begin_request(route: str) -> RequestTimings:
+    """Start timing a request and make it current so services can attribute stages to it.
+
+    Every request (and every WebSocket message loop) runs in its own task, so
+    the timings never leak into unrelated requests.
+    """
+    timings = RequestTimings(route)
+    _current_timings.set(timings)
+    return timings
+
+
+@contextmanager
+def stage(name: str, route: Optional[str] = None) -> Iterator[None]:
+    """Time a stage of the current request, or of ``route`` outside of one."""
+    timings = _current_timings.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        if timings is not None:
+            timings.add(name, elapsed)
+        else:
+            STAGE_SECONDS.observe(elapsed, route=route or "background", stage=name)
+
+
+async def observe_stream(stream: AsyncIterator[str], route: str) -> AsyncIterator[str]:
+    """Pass a reply stream through, recording time to first chunk and chunk rate."""
+    timings = _current_timings.get()
+    started = time.perf_counter()
+    first = None
+    chunks = 0
+    try:
+        async for chunk in stream:
+            if first is None:
+                first = time.perf_counter()
+                STREAM_TTFT_SECONDS.observe(first - started, route=route)
+                if timings is not None:
+                    timings.stages["ttft"] = first - started
+            chunks += 1
+            yield chunk
+    finally:
+        close = getattr(stream, "aclose", None)
+        if close is not None:
+            await close()
+        STREAM_CHUNKS.inc(chunks, route=route)
+        if first is not None and chunks > 1:
+            elapsed = time.perf_counter() - first
+            if elapsed > 0:
+                STREAM_CHUNK_RATE.observe((chunks - 1) / elapsed, route=route)
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request until its last body byte is sent.
+
+    Requests are labelled with the matched route template (not the raw path),
+    so conversation IDs do not explode the label cardinality.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - started,
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=status["code"],
+            )
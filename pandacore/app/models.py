@@ -3,7 +3,7 @@ Data models for the PandaLora application.
 """
 
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Optional, List, Dict
 from enum import Enum
 
 class InputType(str, Enum):
@@ -19,24 +19,86 @@ class SpeechInput(BaseModel):
     input_type: InputType = InputType.SPEECH
     language: str = "en-US"
 
+class SpeechTranscription(BaseModel):
+    text: str
+    audio_format: str
+    audio_duration: float
+    silence_removed: float = 0.0
+    timings: Dict[str, float] = {}
+
 class ChatMessage(BaseModel):
     role: str  # "user" or "assistant"
     content: str
+    # Set by the server when the message is added
     timestamp: Optional[str] = None
+    # Position in the conversation, starting at 1
+    seq: Optional[int] = None
 
 class ChatResponse(BaseModel):
     response: str
     input_type: InputType
     processing_time: float
     conversation_id: Optional[str] = None
+    silence_removed: Optional[float] = None
+    timings: Optional[Dict[str, float]] = None
+    # Base64 encoded spoken reply, when speech output is enabled
+    audio_data: Optional[str] = None
+    audio_format: Optional[str] = None
 
 class StreamResponse(BaseModel):
     chunk: str
     is_complete: bool
     conversation_id: Optional[str] = None
+    timings: Optional[Dict[str, float]] = None
+
+class BatchItem(BaseModel):
+    text: str
+    conversation_id: Optional[str] = None
+    # Echoed back on the item's result line
+    id: Optional[str] = None
+
+class BatchChatRequest(BaseModel):
+    items: List[BatchItem]
+    concurrency: Optional[int] = None
+
+class BatchItemResult(BaseModel):
+    type: str = "result"
+    # Position of the item in the request
+    index: int
+    id: Optional[str] = None
+    conversation_id: Optional[str] = None
+    ok: bool
+    response: Optional[str] = None
+    processing_time: Optional[float] = None
+    # HTTP status the item would have got on its own, and why it failed
+    status: Optional[int] = None
+    error: Optional[str] = None
+
+class BatchSummary(BaseModel):
+    type: str = "summary"
+    total: int
+    succeeded: int
+    failed: int
+    processing_time: float
+
+class TTSRequest(BaseModel):
+    text: str
+    voice: Optional[str] = None
 
 class ConversationHistory(BaseModel):
     conversation_id: str
     messages: List[ChatMessage]
     created_at: str
     updated_at: str
+
+class ConversationPage(BaseModel):
+    conversation_id: str
+    messages: List[ChatMessage]
+    created_at: Optional[str] = None
+    updated_at: Optional[str] = None
+    # Sequence number of the conversation's latest message, 0 if it has none
+    last_seq: int = 0
+    # Pass as ``after`` to continue from this page
+    next_after: int = 0
+    # More messages follow ``next_after``
+    has_more: bool = False
@@ -0,0 +1,202 @@
+"""
+Per-client rate limiting for PandaLora.
+
+Every client (an API key, or the IP address of a client without one) and
+every conversation has a token bucket. A turn takes tokens from both, more
+for a voice or streamed turn than for a text message, and is refused with
+429 Too Many Requests once either bucket runs dry. Buckets live in a shared
+state backend: with ``RATE_LIMIT_STATE=shared`` every worker draws from the
+same buckets, otherwise each worker keeps its own.
+"""
+
+import asyncio
+import hashlib
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Optional
+from starlette.requests import HTTPConnection
+from .metrics import RATE_LIMIT_DECISIONS, RATE_LIMIT_FILL
+from .shared import BucketLevel, LocalSharedState, SharedState
+from .workers import current_client
+
+logger = logging.getLogger(__name__)
+
+# Kinds of turn, each with its own cost
+TEXT = "text"
+VOICE = "voice"
+STREAM = "stream"
+
+SCOPES = ("client", "conversation")
+
+
+class RateLimited(RuntimeError):
+    """Raised when a turn would overdraw a bucket; ``retry_after`` is a hint in seconds."""
+
+    def __init__(self, scope: str, wait: float):
+        self.scope = scope
+        self.wait = wait
+        self.retry_after = max(1, math.ceil(wait)) if math.isfinite(wait) else 60
+        super().__init__(f"Too many requests for this {scope}, please retry in {self.retry_after}s")
+
+
+@dataclass(frozen=True)
+class BucketLimit:
+    """A bucket holding up to ``capacity`` tokens, refilled at ``rate`` tokens per second."""
+
+    capacity: float
+    rate: float
+
+    @classmethod
+    def from_env(cls, prefix: str, burst: float, per_minute: float) -> Optional["BucketLimit"]:
+        """Read ``<prefix>_BURST`` and ``<prefix>_PER_MINUTE``; a rate of 0 turns the bucket off."""
+        rate = float(os.getenv(f"{prefix}_PER_MINUTE", str(per_minute))) / 60
+        if rate <= 0:
+            return None
+        return cls(capacity=float(os.getenv(f"{prefix}_BURST", str(burst))), rate=rate)
+
+
+class RateLimiter:
+    """Token buckets per client and per conversation, with a cost per kind of turn."""
+
+    # Buckets remembered for the level gauges, per scope
+    TRACKED_BUCKETS = 10000
+
+    def __init__(
+        self,
+        state: Callable[[], SharedState] = LocalSharedState,
+        enabled: bool = True,
+        client: Optional[BucketLimit] = BucketLimit(20, 1.0),
+        conversation: Optional[BucketLimit] = BucketLimit(10, 0.5),
+        costs: Optional[dict[str, float]] = None,
+        trust_proxy: bool = False,
+        max_wait: float = 30.0,
+    ):
+        self.enabled = enabled
+        self.limits = {"client": client, "conversation": conversation}
+        self.costs = costs or {TEXT: 1.0, VOICE: 3.0, STREAM: 2.0}
+        self.trust_proxy = trust_proxy
+        self.max_wait = max_wait
+        self._state_factory = state
+        self._state: Optional[SharedState] = None
+        # scope -> bucket key -> (tokens, monotonic time), for the level gauges
+        self._levels: dict[str, OrderedDict] = {scope: OrderedDict() for scope in SCOPES}
+
+    @classmethod
+    def from_env(cls, shared: Callable[[], SharedState]) -> "RateLimiter":
+        """Configure from ``RATE_LIMIT_*``; ``shared`` returns the workers' shared state."""
+        backend = os.getenv("RATE_LIMIT_STATE", "local").lower()
+        if backend not in ("local", "shared"):
+            raise ValueError(f"Unknown RATE_LIMIT_STATE: {backend}")
+        return cls(
+            state=shared if backend == "shared" else LocalSharedState,
+            enabled=os.getenv("RATE_LIMIT_ENABLED", "false").lower() == "true",
+            client=BucketLimit.from_env("RATE_LIMIT_CLIENT", burst=20, per_minute=60),
+            conversation=BucketLimit.from_env("RATE_LIMIT_CONVERSATION", burst=10, per_minute=30),
+            costs={
+                TEXT: float(os.getenv("RATE_LIMIT_COST_TEXT", "1")),
+                VOICE: float(os.getenv("RATE_LIMIT_COST_VOICE", "3")),
+                STREAM: float(os.getenv("RATE_LIMIT_COST_STREAM", "2")),
+            },
+            trust_proxy=os.getenv("RATE_LIMIT_TRUST_PROXY", "false").lower() == "true",
+            max_wait=float(os.getenv("RATE_LIMIT_MAX_WAIT", "30")),
+        )
+
+    @property
+    def state(self) -> SharedState:
+        # Built on first use, so the shared state is only reached once the services exist
+        if self._state is None:
+            self._state = self._state_factory()
+        return self._state
+
+    def identify(self, connection: HTTPConnection) -> str:
+        """The client a request or WebSocket belongs to: its API key, else its address."""
+        key = connection.headers.get("x-api-key")
+        if not key:
+            scheme, _, credentials = connection.headers.get("authorization", "").partition(" ")
+            if scheme.lower() == "bearer":
+                key = credentials.strip()
+        if key:
+            # Hashed, so bucket keys never hold the key itself
+            return "key:" + hashlib.sha256(key.encode()).hexdigest()[:16]
+        if self.trust_proxy:
+            forwarded = connection.headers.get("x-forwarded-for")
+            if forwarded:
+                return "ip:" + forwarded.split(",")[0].strip()
+        return "ip:" + (connection.client.host if connection.client else "unknown")
+
+    async def admit(self, connection: HTTPConnection, kind: str, conversation_id: Optional[str] = None) -> str:
+        """Identify the client, make it current for the worker pools and charge it for one turn.
+
+        Returns the client; raises ``RateLimited`` when it is over its limit.
+        """
+        client = self.identify(connection)
+        current_client.set(client)
+        await self.check(client, kind, conversation_id)
+        return client
+
+    async def check(self, client: str, kind: str, conversation_id: Optional[str] = None):
+        """Take a ``kind`` turn's tokens from the client's and the conversation's buckets.
+
+        Raises ``RateLimited`` if either bucket is short; nothing is taken then.
+        """
+        if not self.enabled:
+            return
+        level = await self._take("client", client, kind)
+        if not level.allowed:
+            raise RateLimited("client", level.wait)
+        if conversation_id:
+            level = await self._take("conversation", conversation_id, kind)
+            if not level.allowed:
+                # The turn is not happening; give the client its tokens back
+                await self._take("client", client, kind, refund=True)
+                raise RateLimited("conversation", level.wait)
+
+    async def pace(self, client: str, kind: str, conversation_id: Optional[str] = None):
+        """Like ``check``, but wait up to ``max_wait`` seconds for the tokens instead of failing."""
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            try:
+                return await self.check(client, kind, conversation_id)
+            except RateLimited as e:
+                if time.monotonic() + e.wait > deadline:
+                    raise
+                await asyncio.sleep(e.wait)
+
+    async def _take(self, scope: str, key: str, kind: str, refund: bool = False) -> BucketLevel:
+        limit = self.limits[scope]
+        if limit is None:
+            return BucketLevel(True, 0.0, 0.0)
+        # A turn dearer than the whole bucket could never run otherwise
+        cost = min(self.costs[kind], limit.capacity)
+        level = await self.state.take_tokens(
+            f"ratelimit:{scope}:{key}", -cost if refund else cost, limit.capacity, limit.rate
+        )
+        if not refund:
+            RATE_LIMIT_DECISIONS.inc(kind=kind, scope=scope, decision="allowed" if level.allowed else "limited")
+            RATE_LIMIT_FILL.observe(level.tokens / limit.capacity, scope=scope)
+        levels = self._levels[scope]
+        levels[key] = (level.tokens, time.monotonic())
+        levels.move_to_end(key)
+        if len(levels) > self.TRACKED_BUCKETS:
+            levels.popitem(last=False)
+        return level
+
+    def bucket_levels(self) -> dict[str, dict]:
+        """Per scope: buckets seen recently by this worker, and how many cannot afford the cheapest turn now."""
+        now = time.monotonic()
+        cheapest = min(self.costs.values())
+        levels = {}
+        for scope, seen in self._levels.items():
+            limit = self.limits[scope]
+            if limit is None:
+                continue
+            empty = 0
+            for tokens, updated in list(seen.values()):
+                if min(limit.capacity, tokens + (now - updated) * limit.rate) < min(cheapest, limit.capacity):
+                    empty += 1
+            levels[scope] = {"tracked": len(seen), "empty": empty}
+        return levels
@@ -0,0 +1,343 @@
+"""
+Resilience around upstream (Gemini) calls.
+
+``ResilientCaller`` wraps one kind of call with a deadline per attempt,
+jittered retries on transient errors, an optional hedged duplicate when an
+attempt runs slower than usual, and a circuit breaker that fails fast while
+the upstream keeps failing. Every decision is counted in
+``pandalora_llm_events_total``.
+"""
+
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import deque
+from typing import AsyncGenerator, Awaitable, Callable, Optional, TypeVar
+
+from .metrics import LLM_EVENTS
+from .workers import ExecutorOverloaded
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# HTTP statuses that are worth retrying: rate limited or a server-side failure
+RETRYABLE_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class UpstreamTimeout(TimeoutError):
+    """Raised when an upstream attempt runs past its deadline."""
+
+
+class CircuitOpen(ExecutorOverloaded):
+    """Raised without calling the upstream while its circuit breaker is open."""
+
+    def __init__(self, name: str, retry_after: int = 1):
+        super().__init__(name, retry_after, reason="unavailable")
+        self.args = (f"The {name} upstream is unavailable, please retry in {retry_after}s",)
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether a failed attempt might succeed if tried again."""
+    if isinstance(error, (UpstreamTimeout, asyncio.TimeoutError, ConnectionError)):
+        return True
+    # Imported on the first failure; the client library is slow to load
+    from google.api_core import exceptions as google_exceptions
+    if isinstance(error, google_exceptions.GoogleAPICallError):
+        return error.code in RETRYABLE_CODES
+    return False
+
+
+class CircuitBreaker:
+    """Opens after ``failure_threshold`` consecutive failed calls.
+
+    While open every call is refused for ``reset_timeout`` seconds; then a
+    single probe is let through (half open) and its outcome closes the
+    circuit again or re-opens it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    def allow(self) -> bool:
+        """Raise ``CircuitOpen`` unless a call may go upstream now.
+
+        Returns True when the caller is the half-open probe; it must report
+        an outcome or call ``end_probe``.
+        """
+        if self.state == self.CLOSED:
+            return False
+        remaining = self.opened_at + self.reset_timeout - time.monotonic()
+        if remaining > 0 or self._probing:
+            LLM_EVENTS.inc(event="short_circuit")
+            raise CircuitOpen(self.name, max(1, int(remaining + 0.999)))
+        self.state = self.HALF_OPEN
+        self._probing = True
+        return True
+
+    def end_probe(self):
+        """Let another probe through after one ended without an outcome (e.g. cancelled)."""
+        self._probing = False
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info(f"{self.name} circuit closed, upstream recovered")
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+            if self.state == self.CLOSED:
+                logger.warning(f"{self.name} circuit opened after {self.failures} consecutive failures")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            LLM_EVENTS.inc(event="circuit_open")
+
+
+class LatencyTracker:
+    """Recent successful attempt latencies, for choosing when to hedge."""
+
+    def __init__(self, window: int = 200):
+        self._samples: deque = deque(maxlen=window)
+
+    def record(self, seconds: float):
+        self._samples.append(seconds)
+
+    def percentile(self, p: float, minimum_samples: int = 20) -> Optional[float]:
+        if len(self._samples) < minimum_samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+class ResilientCaller:
+    """Deadlines, retries, hedging and a circuit breaker for one upstream."""
+
+    def __init__(
+        self,
+        name: str,
+        timeout: float = 30.0,
+        retries: int = 2,
+        backoff: float = 0.25,
+        max_backoff: float = 4.0,
+        hedge_percentile: Optional[float] = 95.0,
+        idle_timeout: float = 15.0,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.name = name
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.retries = max(0, retries)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge_percentile = hedge_percentile
+        self.breaker = breaker or CircuitBreaker(name)
+        self.latency = LatencyTracker()
+
+    @classmethod
+    def from_env(cls, name: str, prefix: str = "LLM") -> "ResilientCaller":
+        """Configure from ``<prefix>_TIMEOUT``, ``_RETRIES``, ``_HEDGE_PERCENTILE`` and friends."""
+        hedge = float(os.getenv(f"{prefix}_HEDGE_PERCENTILE", "95"))
+        return cls(
+            name,
+            timeout=float(os.getenv(f"{prefix}_TIMEOUT", "30")),
+            retries=int(os.getenv(f"{prefix}_RETRIES", "2")),
+            backoff=float(os.getenv(f"{prefix}_RETRY_BACKOFF", "0.25")),
+            max_backoff=float(os.getenv(f"{prefix}_RETRY_MAX_BACKOFF", "4")),
+            hedge_percentile=hedge if hedge > 0 else None,
+            idle_timeout=float(os.getenv(f"{prefix}_STREAM_IDLE_TIMEOUT", "15")),
+            breaker=CircuitBreaker(
+                name,
+                failure_threshold=int(os.getenv(f"{prefix}_CIRCUIT_FAILURES", "5")),
+                reset_timeout=float(os.getenv(f"{prefix}_CIRCUIT_RESET", "30")),
+            ),
+        )
+
+    def backoff_delay(self, attempt: int) -> float:
+        """Full jitter: anywhere between zero and the exponential cap."""
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def hedge_delay(self) -> Optional[float]:
+        if self.hedge_percentile is None:
+            return None
+        return self.latency.percentile(self.hedge_percentile)
+
+    async def call(
+        self,
+        attempt: Callable[[float], Awaitable[T]],
+        can_hedge: Callable[[], bool] = lambda: True,
+    ) -> T:
+        """Run ``attempt(timeout)`` until it succeeds, retrying transient failures.
+
+        ``attempt`` receives the seconds it has left, so it can pass the
+        deadline on to the upstream client. ``can_hedge`` is asked before a
+        duplicate attempt is started, so hedging never adds load to a
+        saturated pool.
+        """
+        probe = self.breaker.allow()
+        try:
+            for number in range(self.retries + 1):
+                LLM_EVENTS.inc(event="attempt")
+                started = time.monotonic()
+                try:
+                    result = await self._hedged(attempt, can_hedge)
+                except ExecutorOverloaded:
+                    # Our own pools are full; says nothing about the upstream
+                    raise
+                except Exception as e:
+                    if not self._may_retry(e, number):
+                        raise
+                    delay = self.backoff_delay(number)
+                    LLM_EVENTS.inc(event="retry")
+                    logger.warning(f"{self.name} attempt {number + 1} failed ({e!r}), retrying in {delay:.2f}s")
+                    await asyncio.sleep(delay)
+                    if not probe:
+                        # The circuit may have opened while we waited
+                        probe = self.breaker.allow()
+                    continue
+                self.breaker.record_success()
+                self.latency.record(time.monotonic() - started)
+                LLM_EVENTS.inc(event="success")
+                return result
+        finally:
+            if probe:
+                self.breaker.end_probe()
+
+    def _may_retry(self, error: Exception, number: int) -> bool:
+        """Whether a failed attempt should be retried; otherwise the call has failed.
+
+        The breaker counts one failure per call, once its retries are used
+        up, and only for errors that say the upstream is unhealthy: a
+        rejected request (bad prompt, invalid argument) must not open the
+        circuit for everyone.
+        """
+        retryable = is_retryable(error)
+        if retryable and number < self.retries:
+            return True
+        if retryable:
+            self.breaker.record_failure()
+        LLM_EVENTS.inc(event="failure")
+        return False
+
+    async def _hedged(self, attempt: Callable[[float], Awaitable[T]], can_hedge: Callable[[], bool]) -> T:
+        """One attempt, plus a duplicate if it is slower than usual; the first success wins."""
+        deadline = time.monotonic() + self.timeout
+        primary = asyncio.ensure_future(attempt(self.timeout))
+        running = {primary}
+        hedged = None
+        errors = []
+        try:
+            delay = self.hedge_delay()
+            while running:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    LLM_EVENTS.inc(event="timeout")
+                    raise UpstreamTimeout(f"{self.name} did not answer within {self.timeout:.1f}s")
+                wait = remaining if hedged is not None or delay is None else min(remaining, delay)
+                done, running = await asyncio.wait(running, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedged:
+                            LLM_EVENTS.inc(event="hedge_won")
+                        return task.result()
+                    errors.append(task.exception())
+                if running and hedged is None and delay is not None and can_hedge():
+                    # Slower than the usual percentile: race a duplicate
+                    LLM_EVENTS.inc(event="hedge")
+                    hedged = asyncio.ensure_future(attempt(max(0.0, deadline - time.monotonic())))
+                    running = running | {hedged}
+            raise errors[0]
+        finally:
+            for task in (primary, hedged):
+                if task is not None and not task.done():
+                    task.cancel()
+                    task.add_done_callback(_retrieve)
+
+    async def stream(self, open_stream: Callable[[float], AsyncGenerator[T, None]]) -> AsyncGenerator[T, None]:
+        """Yield from ``open_stream(timeout)`` with a deadline on the first item and on every gap after it.
+
+        Attempts that fail before their first item are retried like ``call``;
+        once something has been yielded a failure ends the stream, since the
+        consumer has already seen part of it. Streams are not hedged: a
+        duplicate would hold a second worker for the whole reply.
+        """
+        probe = self.breaker.allow()
+        try:
+            for number in range(self.retries + 1):
+                LLM_EVENTS.inc(event="attempt")
+                source = open_stream(self.timeout)
+                try:
+                    first = await self._next(source, self.timeout, "first chunk")
+                except StopAsyncIteration:
+                    self.breaker.record_success()
+                    LLM_EVENTS.inc(event="success")
+                    return
+                except ExecutorOverloaded:
+                    raise
+                except Exception as e:
+                    await source.aclose()
+                    if not self._may_retry(e, number):
+                        raise
+                    delay = self.backoff_delay(number)
+                    LLM_EVENTS.inc(event="retry")
+                    logger.warning(f"{self.name} stream attempt {number + 1} failed ({e!r}), retrying in {delay:.2f}s")
+                    await asyncio.sleep(delay)
+                    if not probe:
+                        probe = self.breaker.allow()
+                    continue
+
+                self.breaker.record_success()
+                LLM_EVENTS.inc(event="success")
+                try:
+                    yield first
+                    while True:
+                        try:
+                            item = await self._next(source, self.idle_timeout, "chunk")
+                        except StopAsyncIteration:
+                            return
+                        except Exception as e:
+                            if is_retryable(e):
+                                self.breaker.record_failure()
+                            LLM_EVENTS.inc(event="failure")
+                            raise
+                        yield item
+                finally:
+                    await source.aclose()
+        finally:
+            if probe:
+                self.breaker.end_probe()
+
+    async def _next(self, source: AsyncGenerator[T, None], timeout: float, waiting_for: str) -> T:
+        try:
+            return await asyncio.wait_for(source.__anext__(), timeout)
+        except asyncio.TimeoutError:
+            LLM_EVENTS.inc(event="timeout")
+            raise UpstreamTimeout(f"{self.name} sent no {waiting_for} within {timeout:.1f}s") from None
+
+    def stats(self) -> dict:
+        return {
+            "state": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "hedge_delay": self.hedge_delay(),
+        }
+
+
+def _retrieve(task: asyncio.Future):
+    # A cancelled duplicate may still fail; nobody is waiting for it
+    if not task.cancelled():
+        task.exception()
@@ -1,170 +1,675 @@
 """
 AI and Speech processing services for PandaLora.
+
+Services are built on first use through the ``get_*_service()`` accessors,
+and the heavy client libraries (speech_recognition, google.generativeai) and
+the NumPy audio stack are only imported when their service is built, so
+importing this module is cheap and a text-only deployment never loads them.
 """
 
 import os
 import logging
 import asyncio
-import io
+import threading
 import time
-from typing import AsyncGenerator, Optional
-import speech_recognition as sr
-import google.generativeai as genai
-from pydub import AudioSegment
-from .models import ChatMessage, InputType
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING, AsyncGenerator, Callable, Generic, Optional, TypeVar
+from .models import ChatMessage, ConversationHistory, ConversationPage, InputType, SpeechTranscription
+from .cache import ResponseCache
+from .context import ContextBuilder
+from .metrics import LLM_EVENTS, stage
+from .resilience import CircuitOpen, ResilientCaller
+from .shared import SharedState, create_shared_state
+from .store import ConversationStore, create_conversation_store, utc_now
+from .turns import TurnCoordinator
+from .tts import SentenceSplitter, SpeechPipeline, TTSEngine, create_tts_engine, split_sentences
+from .streaming import BroadcastStream, iterate_in_thread, split_for_replay
+from .workers import BoundedExecutor, ExecutorOverloaded
+
+if TYPE_CHECKING:
+    from .audio import PCMAudio, SpeechStreamSession, VADSettings
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
 class SpeechService:
     """Service for handling speech-to-text conversion."""
     
     def __init__(self):
+        import speech_recognition as sr
+        from .audio import VADSettings
         self.recognizer = sr.Recognizer()
-        # Optimize recognizer settings
-        self.recognizer.energy_threshold = 300
-        self.recognizer.dynamic_energy_threshold = True
-        self.recognizer.pause_threshold = 0.8
         
-    async def speech_to_text(self, audio_data: bytes, language: str = "en-US") -> str:
-        """Convert speech audio to text."""
+        # Default silence trimming, overridable per request
+        self.vad = VADSettings.from_env()
+        
+        # Audio is decoded to this rate before recognition
+        self.sample_rate = int(os.getenv("AUDIO_SAMPLE_RATE", "16000"))
+        
+        # ffmpeg decoding is CPU bound, so it runs in separate processes
+        audio_workers = int(os.getenv("AUDIO_WORKERS", str(min(4, os.cpu_count() or 1))))
+        self.decode_pool = BoundedExecutor(
+            "audio",
+            ProcessPoolExecutor(
+                max_workers=audio_workers,
+                mp_context=multiprocessing.get_context(os.getenv("AUDIO_START_METHOD", "spawn"))
+            ),
+            max_workers=audio_workers,
+            max_queue=int(os.getenv("AUDIO_QUEUE_SIZE", "16")),
+            queue_timeout=float(os.getenv("AUDIO_QUEUE_TIMEOUT", "10"))
+        )
+        
+        # recognize_google is a blocking HTTP call to Google
+        self.recognizer_pool = BoundedExecutor.threads("recognizer", "RECOGNIZER", workers=8, queue=32, queue_timeout=10)
+        
+    async def transcribe(
+        self,
+        audio_data: bytes,
+        language: str = "en-US",
+        vad: Optional["VADSettings"] = None
+    ) -> SpeechTranscription:
+        """Convert speech audio to text, reporting how long each stage took."""
+        from .audio import sniff_format, trim_silence
+        vad = vad or self.vad
         try:
-            # Convert bytes to AudioFile format that speech_recognition can use
-            audio_segment = AudioSegment.from_file(io.BytesIO(audio_data))
+            # Decode and normalize to mono 16-bit PCM
+            audio_format = sniff_format(audio_data)
+            pcm, timings = await self._decode(audio_data, audio_format)
+            audio_duration = pcm.duration
             
-            # Convert to wav format for better compatibility
-            wav_data = io.BytesIO()
-            audio_segment.export(wav_data, format="wav")
-            wav_data.seek(0)
+            # Trim silence so less audio is uploaded to the recognizer
+            silence_removed = 0.0
+            if vad.enabled:
+                started = time.perf_counter()
+                pcm, silence_removed = await asyncio.get_event_loop().run_in_executor(
+                    None,
+                    lambda: trim_silence(pcm, vad)
+                )
+                timings["vad"] = time.perf_counter() - started
             
-            # Use speech recognition
-            with sr.AudioFile(wav_data) as source:
-                audio = self.recognizer.record(source)
-                
             # Perform recognition
-            text = await asyncio.get_event_loop().run_in_executor(
-                None, 
-                lambda: self.recognizer.recognize_google(audio, language=language)
-            )
+            started = time.perf_counter()
+            text = await self.recognize(pcm, language)
+            timings["recognize"] = time.perf_counter() - started
             
-            logger.info(f"Speech-to-text successful: {text[:50]}...")
-            return text
+            logger.info(f"Speech-to-text successful: {text[:50]}... "
+                        f"(trimmed {silence_removed:.2f}s of {audio_duration:.2f}s; "
+                        f"{', '.join(f'{stage}={seconds:.3f}s' for stage, seconds in timings.items())})")
+            return SpeechTranscription(
+                text=text,
+                audio_format=audio_format,
+                audio_duration=audio_duration,
+                silence_removed=silence_removed,
+                timings=timings
+            )
             
+        except (ValueError, RuntimeError):
+            raise
+        except Exception as e:
+            logger.error(f"Error in speech-to-text conversion: {e}")
+            raise RuntimeError(f"Error processing audio: {e}")
+    
+    async def recognize(self, pcm: "PCMAudio", language: str = "en-US") -> str:
+        """Recognize already decoded PCM audio."""
+        import speech_recognition as sr
+        # Hand the PCM straight to the recognizer without re-encoding a WAV file
+        audio = sr.AudioData(pcm.data, pcm.sample_rate, pcm.sample_width)
+        try:
+            return await self.recognizer_pool.run(
+                lambda: self.recognizer.recognize_google(audio, language=language)
+            )
         except sr.UnknownValueError:
             logger.warning("Could not understand the audio")
             raise ValueError("Could not understand the audio")
         except sr.RequestError as e:
             logger.error(f"Speech recognition service error: {e}")
             raise RuntimeError(f"Speech recognition service error: {e}")
-        except Exception as e:
-            logger.error(f"Error in speech-to-text conversion: {e}")
-            raise RuntimeError(f"Error processing audio: {e}")
+    
+    def open_stream(
+        self,
+        audio_format: str = "auto",
+        sample_rate: int = 16000,
+        channels: int = 1,
+        vad: Optional["VADSettings"] = None
+    ) -> "SpeechStreamSession":
+        """Start segmenting a live audio stream into utterances."""
+        from .audio import SpeechStreamSession
+        return SpeechStreamSession(
+            vad or self.vad,
+            self.sample_rate,
+            audio_format=audio_format,
+            sample_rate=sample_rate,
+            channels=channels
+        )
+    
+    async def _decode(self, audio_data: bytes, audio_format: str) -> tuple["PCMAudio", dict]:
+        """Decode an upload, only paying for ffmpeg when the container needs it."""
+        from .audio import decode_audio, load_wav
+        if audio_format == "wav":
+            try:
+                pcm, timings = await asyncio.get_event_loop().run_in_executor(
+                    None,
+                    lambda: load_wav(audio_data, self.sample_rate)
+                )
+                return pcm, timings
+            except ValueError as e:
+                # Compressed or exotic WAV encodings still go through ffmpeg
+                logger.info(f"WAV fast path not applicable ({e}), falling back to ffmpeg")
+        
+        # Compressed containers are decoded by ffmpeg in the audio worker pool
+        started = time.perf_counter()
+        pcm, timings = await self.decode_pool.run(decode_audio, audio_data, self.sample_rate)
+        timings["decode_wait"] = time.perf_counter() - started - sum(timings.values())
+        return pcm, timings
+    
+    async def speech_to_text(
+        self,
+        audio_data: bytes,
+        language: str = "en-US",
+        vad: Optional["VADSettings"] = None
+    ) -> str:
+        """Convert speech audio to text."""
+        transcription = await self.transcribe(audio_data, language, vad)
+        return transcription.text
+    
+    async def warm_up(self):
+        """Start every audio worker process now instead of on the first uploads."""
+        from .audio import warm_up_worker
+        loop = asyncio.get_running_loop()
+        # Submitted together, so no worker is idle yet and each job spawns a process
+        await asyncio.gather(*(
+            loop.run_in_executor(self.decode_pool.executor, warm_up_worker)
+            for _ in range(self.decode_pool.max_workers)
+        ))
+    
+    def close(self):
+        """Stop the audio and recognizer worker pools."""
+        self.decode_pool.shutdown()
+        self.recognizer_pool.shutdown()
 
 class GeminiAIService:
     """Service for integrating with Google's Gemini AI model."""
     
+    NOT_CONFIGURED_MESSAGE = "I'm sorry, but I'm not properly configured to connect to my AI brain right now. Please check that the GEMINI_API_KEY is set up correctly."
+    FALLBACK_MESSAGE = "Oops! I had a little brain hiccup there. As a panda, sometimes I get distracted by thoughts of bamboo! Could you try asking me again?"
+    
     def __init__(self):
+        self.model_name = os.getenv("GEMINI_MODEL", "gemini-2.0-flash-lite")
         self.api_key = os.getenv("GEMINI_API_KEY")
         if not self.api_key:
             logger.warning("GEMINI_API_KEY not found in environment variables")
         else:
+            import google.generativeai as genai
             genai.configure(api_key=self.api_key)
-            self.model = genai.GenerativeModel('gemini-2.0-flash-lite')
+            self.model = genai.GenerativeModel(self.model_name)
+        
+        # Max chunks buffered between the Gemini stream thread and the client
+        self.stream_queue_size = int(os.getenv("STREAM_QUEUE_SIZE", "32"))
+        
+        # Separate Gemini pools per route so a burst on one cannot starve the others.
+        # Streaming calls hold their slot for the whole stream.
+        self.pools = {
+            "text": BoundedExecutor.threads("llm-text", "LLM_TEXT", workers=8, queue=32, queue_timeout=10),
+            "voice": BoundedExecutor.threads("llm-voice", "LLM_VOICE", workers=8, queue=16, queue_timeout=5),
+            "stream": BoundedExecutor.threads("llm-stream", "LLM_STREAM", workers=16, queue=32, queue_timeout=10),
+            "summary": BoundedExecutor.threads("llm-summary", "LLM_SUMMARY", workers=2, queue=16, queue_timeout=30),
+            # Offline batch jobs; they wait for a slot rather than being shed
+            "batch": BoundedExecutor.threads("llm-batch", "LLM_BATCH", workers=4, queue=64),
+        }
+        
+        # Replies to identical contexts are reused, and identical in-flight
+        # requests share a single upstream call
+        self.cache_enabled = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+        self.response_cache = ResponseCache(
+            maxsize=int(os.getenv("RESPONSE_CACHE_SIZE", "1024")),
+            ttl=float(os.getenv("RESPONSE_CACHE_TTL", "3600")),
+            directory=os.getenv("RESPONSE_CACHE_DIR") or None
+        )
+        self._stream_flights: dict[str, BroadcastStream] = {}
+        self.replay_chunk_size = int(os.getenv("RESPONSE_CACHE_REPLAY_CHUNK", "64"))
+        
+        # Deadlines, retries, hedging and a circuit breaker around every reply.
+        # While the circuit is open replies fail fast with 503, or get the
+        # fallback message when LLM_CIRCUIT_FALLBACK is on
+        self.resilience = ResilientCaller.from_env("gemini")
+        self.circuit_fallback = os.getenv("LLM_CIRCUIT_FALLBACK", "true").lower() in ("1", "true", "yes")
         
         # Panda personality prompt
         self.system_prompt = """
             Act as a personal assistant with the personality of a goth panda. Be helpful, organized, and efficient in all tasks. Your style should be calm, a bit reserved, and subtly goth—showing a quiet appreciation for the mysterious or unconventional. Use dry humor and introspection when appropriate. Stay in character as a goth panda in all interactions, balancing professionalism with your unique personality.
         """
+        
+        # Prompts stay within a token budget; older turns are summarized in the background
+        self.context_builder = ContextBuilder.from_env(
+            self.system_prompt,
+            summarize=self.summarize if self.api_key else None
+        )
+    
+    def admit(self, pool: str):
+        """Fail fast with ExecutorOverloaded if the pool cannot take more work."""
+        self.pools[pool].admit()
     
-    async def generate_response(self, message: str, conversation_history: list = None) -> str:
-        """Generate a single response from Gemini."""
+    def build_context(self, message: str, conversation_history: list = None, conversation_id: Optional[str] = None) -> str:
+        """Render the prompt sent to Gemini."""
+        return self.context_builder.build(message, conversation_history, conversation_id)
+    
+    async def summarize(self, previous_summary: str, messages: list) -> str:
+        """Fold older turns into a conversation's running summary."""
+        transcript = "\n".join(
+            f"{'Human' if msg.role == 'user' else 'PandaLora'}: {msg.content}" for msg in messages
+        )
+        prompt = (
+            "Update the summary of a conversation between a human and PandaLora with the new turns below. "
+            "Keep names, facts, preferences and open questions; drop small talk. "
+            f"Answer with the summary only, in at most {self.context_builder.summary_tokens * 3 // 4} words.\n\n"
+            f"Current summary: {previous_summary or '(none)'}\n\n"
+            f"New turns:\n{transcript}"
+        )
+        # Summaries run in the background, so they get a deadline but no retries
+        response = await self.pools["summary"].run(
+            lambda: self.model.generate_content(prompt, request_options={"timeout": self.resilience.timeout})
+        )
+        return response.text
+    
+    def cache_key(self, context: str) -> str:
+        return ResponseCache.key(self.model_name, context)
+    
+    async def generate_response(
+        self,
+        message: str,
+        conversation_history: list = None,
+        pool: str = "text",
+        conversation_id: Optional[str] = None,
+        fallback: bool = True
+    ) -> str:
+        """Generate a single response from Gemini using the given worker pool.
+
+        Upstream failures are answered with ``FALLBACK_MESSAGE``, or raised
+        when ``fallback`` is False.
+        """
         if not self.api_key:
-            return "I'm sorry, but I'm not properly configured to connect to my AI brain right now. Please check that the GEMINI_API_KEY is set up correctly."
+            return self.NOT_CONFIGURED_MESSAGE
         
         try:
             # Prepare the full conversation context
-            context = self.system_prompt + "\n\n"
+            with stage("context"):
+                context = self.build_context(message, conversation_history, conversation_id)
             
-            if conversation_history:
-                for msg in conversation_history[-10:]:  # Keep last 10 messages for context
-                    role_prefix = "Human: " if msg.role == "user" else "PandaLora: "
-                    context += f"{role_prefix}{msg.content}\n"
+            workers = self.pools[pool]
             
-            context += f"Human: {message}\nPandaLora: "
+            def attempt(timeout: float):
+                return workers.run(
+                    lambda: self.model.generate_content(context, request_options={"timeout": timeout}),
+                    deadline=time.monotonic() + timeout
+                )
             
-            # Generate response
-            response = await asyncio.get_event_loop().run_in_executor(
-                None,
-                lambda: self.model.generate_content(context)
-            )
+            async def generate() -> str:
+                with stage("llm"):
+                    # Never hedge into a saturated pool; the duplicate would only queue
+                    response = await self.resilience.call(attempt, can_hedge=lambda: not workers.saturated)
+                return response.text.strip()
             
-            return response.text.strip()
+            if not self.cache_enabled:
+                return await generate()
+            return await self.response_cache.get_or_compute(self.cache_key(context), generate)
             
+        except CircuitOpen:
+            if not (fallback and self.circuit_fallback):
+                raise
+            LLM_EVENTS.inc(event="fallback")
+            return self.FALLBACK_MESSAGE
+        except ExecutorOverloaded:
+            raise
         except Exception as e:
             logger.error(f"Error generating AI response: {e}")
-            return f"Oops! I had a little brain hiccup there. As a panda, sometimes I get distracted by thoughts of bamboo! Could you try asking me again?"
+            if not fallback:
+                raise
+            LLM_EVENTS.inc(event="fallback")
+            return self.FALLBACK_MESSAGE
+    
+    def _stream_upstream(self, context: str, pool: str) -> AsyncGenerator[str, None]:
+        """Stream a reply from Gemini, retried until its first chunk arrives."""
+        return self.resilience.stream(lambda timeout: self._stream_attempt(context, pool, timeout))
+    
+    async def _stream_attempt(self, context: str, pool: str, timeout: float) -> AsyncGenerator[str, None]:
+        """One streamed Gemini call."""
+        # Open and drain the blocking Gemini stream in a worker thread so
+        # slow chunk fetches never stall the event loop
+        def open_stream():
+            response = self.model.generate_content(context, stream=True, request_options={"timeout": timeout})
+            for chunk in response:
+                if chunk.text:
+                    yield chunk.text
+        
+        stream_pool = self.pools[pool]
+        # The slot is held until the producer thread exits, which can be after
+        # the stream was abandoned if it is stuck waiting on Gemini
+        release = await stream_pool.claim(deadline=time.monotonic() + timeout)
+        stream = iterate_in_thread(
+            open_stream,
+            maxsize=self.stream_queue_size,
+            executor=stream_pool.executor,
+            on_exit=release
+        )
+        try:
+            async for text in stream:
+                yield text
+        finally:
+            # Stops the producer thread promptly if the client went away
+            await stream.aclose()
+    
+    async def _stream_and_cache(self, key: str, context: str, pool: str) -> AsyncGenerator[str, None]:
+        """Stream from Gemini, caching the complete reply once it finishes."""
+        chunks = []
+        try:
+            async for text in self._stream_upstream(context, pool):
+                chunks.append(text)
+                yield text
+            await self.response_cache.set(key, "".join(chunks))
+        finally:
+            self._stream_flights.pop(key, None)
     
-    async def generate_streaming_response(self, message: str, conversation_history: list = None) -> AsyncGenerator[str, None]:
-        """Generate a streaming response from Gemini."""
+    async def generate_streaming_response(
+        self,
+        message: str,
+        conversation_history: list = None,
+        pool: str = "stream",
+        conversation_id: Optional[str] = None
+    ) -> AsyncGenerator[str, None]:
+        """Generate a streaming response from Gemini using the given worker pool."""
         if not self.api_key:
-            yield "I'm sorry, but I'm not properly configured to connect to my AI brain right now. Please check that the GEMINI_API_KEY is set up correctly."
+            yield self.NOT_CONFIGURED_MESSAGE
             return
         
         try:
             # Prepare the full conversation context
-            context = self.system_prompt + "\n\n"
+            with stage("context"):
+                context = self.build_context(message, conversation_history, conversation_id)
             
-            if conversation_history:
-                for msg in conversation_history[-10:]:  # Keep last 10 messages for context
-                    role_prefix = "Human: " if msg.role == "user" else "PandaLora: "
-                    context += f"{role_prefix}{msg.content}\n"
-            
-            context += f"Human: {message}\nPandaLora: "
-            
-            # Generate streaming response
-            response = await asyncio.get_event_loop().run_in_executor(
-                None,
-                lambda: self.model.generate_content(
-                    context,
-                    stream=True
-                )
-            )
+            if not self.cache_enabled:
+                stream = self._stream_upstream(context, pool)
+            else:
+                key = self.cache_key(context)
+                cached = await self.response_cache.get(key)
+                if cached is not None:
+                    # Replay the cached reply in chunks, like a live stream
+                    for text in split_for_replay(cached, self.replay_chunk_size):
+                        yield text
+                    return
+                
+                # Join an identical stream that is already in flight, or start one
+                flight = self._stream_flights.get(key)
+                if flight is None:
+                    flight = BroadcastStream(self._stream_and_cache(key, context, pool))
+                    self._stream_flights[key] = flight
+                else:
+                    self.response_cache.coalesced += 1
+                stream = flight.subscribe()
             
-            for chunk in response:
-                if chunk.text:
-                    yield chunk.text
-                    await asyncio.sleep(0.01)  # Small delay for better streaming effect
-                    
+            try:
+                async for text in stream:
+                    yield text
+            finally:
+                await stream.aclose()
+        
+        except CircuitOpen:
+            if not self.circuit_fallback:
+                raise
+            LLM_EVENTS.inc(event="fallback")
+            yield self.FALLBACK_MESSAGE
+        except ExecutorOverloaded:
+            raise
         except Exception as e:
             logger.error(f"Error generating streaming AI response: {e}")
-            yield f"Oops! I had a little brain hiccup there. As a panda, sometimes I get distracted by thoughts of bamboo! Could you try asking me again?"
+            LLM_EVENTS.inc(event="fallback")
+            yield self.FALLBACK_MESSAGE
+    
+    async def warm_up(self):
+        """Open the connection to Gemini before the first request needs it."""
+        if not self.api_key:
+            return
+        # Counting tokens is the cheapest call that goes all the way to the model
+        await self.pools["text"].run(
+            lambda: self.model.count_tokens("ping", request_options={"timeout": self.resilience.timeout})
+        )
+    
+    def close(self):
+        """Stop background summaries and the Gemini worker pools."""
+        self.context_builder.close()
+        for pool in self.pools.values():
+            pool.shutdown(wait=False)
 
 class ConversationService:
     """Service for managing conversation history and context."""
     
-    def __init__(self):
-        self.conversations = {}  # In production, this would be a database
+    def __init__(self, store: Optional[ConversationStore] = None, state: Optional[SharedState] = None):
+        self.max_messages = int(os.getenv("MAX_CONVERSATION_HISTORY", "50"))
+        # Messages per page of GET /conversation/{id}?after=...
+        self.page_size = int(os.getenv("CONVERSATION_PAGE_SIZE", "100"))
+        self.max_page_size = int(os.getenv("CONVERSATION_MAX_PAGE_SIZE", "1000"))
+        self.store = store or create_conversation_store()
+        # Hot copy of recently active conversations, shared by every worker;
+        # everything else lives in the store
+        self.state = state or create_shared_state()
+        # Turns on the same conversation run one at a time
+        self.turns = TurnCoordinator.from_env(self.state)
+    
+    async def get_conversation(self, conversation_id: str) -> Optional[ConversationHistory]:
+        """Get a conversation from the shared state, falling back to the store."""
+        conversation = await self.state.load_conversation(conversation_id)
+        if conversation is None:
+            # A blocking SQLite read; keep it off the event loop
+            conversation = await asyncio.to_thread(self.store.load, conversation_id, self.max_messages)
+            if conversation is not None:
+                await self.state.save_conversation(conversation, self.max_messages)
+        return conversation
+    
+    async def last_seq(self, conversation_id: str, conversation: Optional[ConversationHistory]) -> int:
+        """Sequence number of the conversation's latest message, 0 if it has none.
+
+        Read from the hot copy, so polling a conversation does not touch the store.
+        """
+        if conversation is None or not conversation.messages:
+            return 0
+        if conversation.messages[-1].seq is not None:
+            return conversation.messages[-1].seq
+        # A hot copy written before messages were numbered
+        return await asyncio.to_thread(self.store.last_seq, conversation_id)
+    
+    async def page(
+        self,
+        conversation_id: str,
+        conversation: Optional[ConversationHistory],
+        after: Optional[int] = None,
+        limit: Optional[int] = None
+    ) -> ConversationPage:
+        """Messages of a conversation with a sequence number above ``after``, oldest first.
+
+        Without ``after`` the latest ``limit`` messages are returned (the hot
+        copy by default). Pages the hot copy does not cover are read from the
+        store.
+        """
+        if conversation is None:
+            return ConversationPage(conversation_id=conversation_id, messages=[])
+        hot = conversation.messages
+        last_seq = await self.last_seq(conversation_id, conversation)
+        # The hot copy is numbered and reaches back far enough
+        first = hot[0].seq if hot and hot[0].seq is not None else None
+        if limit is not None:
+            limit = max(1, min(limit, self.max_page_size))
+        if after is None:
+            if limit is None or (first is not None and (limit <= len(hot) or first == 1)):
+                messages = hot[-limit:] if limit else list(hot)
+            else:
+                stored = await asyncio.to_thread(self.store.load, conversation_id, limit)
+                messages = stored.messages if stored else []
+        else:
+            limit = limit or self.page_size
+            if first is not None and first <= after + 1:
+                messages = [message for message in hot if message.seq > after][:limit]
+            else:
+                messages = await asyncio.to_thread(self.store.load_after, conversation_id, after, limit)
+        next_after = messages[-1].seq if messages else (after or last_seq)
+        return ConversationPage(
+            conversation_id=conversation_id,
+            messages=messages,
+            created_at=conversation.created_at,
+            updated_at=conversation.updated_at,
+            last_seq=last_seq,
+            next_after=next_after,
+            has_more=next_after < last_seq
+        )
     
-    def get_conversation_history(self, conversation_id: str) -> list:
+    async def get_conversation_history(self, conversation_id: str) -> list:
         """Get conversation history by ID."""
-        return self.conversations.get(conversation_id, [])
+        conversation = await self.get_conversation(conversation_id)
+        return list(conversation.messages) if conversation else []
     
-    def add_message(self, conversation_id: str, message: ChatMessage):
-        """Add a message to conversation history."""
-        if conversation_id not in self.conversations:
-            self.conversations[conversation_id] = []
-        
-        self.conversations[conversation_id].append(message)
+    async def add_message(self, conversation_id: str, message: ChatMessage, origin: Optional[str] = None):
+        """Add a message to conversation history and announce it to every worker.
+
+        ``origin`` identifies the subscriber that produced the message, so it
+        is not sent back to it. The message gets the next sequence number of
+        the conversation; callers hold its turn, so numbers are handed out
+        one at a time.
+        """
+        # Make sure the hot copy holds the stored history before appending to it
+        conversation = await self.get_conversation(conversation_id)
+        now = utc_now()
+        if message.timestamp is None:
+            message.timestamp = now
+        message.seq = await self.last_seq(conversation_id, conversation) + 1
         
-        # Keep only last 50 messages to prevent memory issues
-        if len(self.conversations[conversation_id]) > 50:
-            self.conversations[conversation_id] = self.conversations[conversation_id][-50:]
+        # Keep only the most recent messages hot; the store keeps them all
+        await self.state.append_message(conversation_id, message, self.max_messages, now)
+        self.store.append(conversation_id, message)
+        await self.state.publish("conversation", {
+            "type": "message",
+            "conversation_id": conversation_id,
+            "role": message.role,
+            "content": message.content,
+            "timestamp": message.timestamp,
+            # "seq" on a WebSocket frame is the connection's frame counter
+            "message_seq": message.seq,
+            "origin": origin,
+        })
+    
+    def lock(self, conversation_id: str, timeout: Optional[float] = None):
+        """Hold a conversation exclusively, across every worker."""
+        return self.state.lock(f"conversation:{conversation_id}", timeout)
     
     def create_conversation_id(self) -> str:
         """Create a new conversation ID."""
         import uuid
         return str(uuid.uuid4())
+    
+    async def start(self):
+        await self.state.start()
+    
+    async def close(self):
+        """Flush pending writes and close the store and shared state."""
+        self.store.close()
+        await self.state.close()
+
+class TTSService:
+    """Service for speaking replies, one sentence at a time."""
+    
+    def __init__(self, engine: Optional[TTSEngine] = None):
+        self.engine = engine or create_tts_engine()
+        self.voice = os.getenv("TTS_VOICE", "en")
+        self.min_sentence_chars = int(os.getenv("TTS_MIN_SENTENCE_CHARS", "24"))
+        self.pool = BoundedExecutor.threads("tts", "TTS", workers=4, queue=32, queue_timeout=10)
+        
+        # Audio is cached by engine, voice and text, so recurring phrases
+        # (greetings, the fallback message) are only synthesized once
+        self.cache = ResponseCache(
+            maxsize=int(os.getenv("TTS_CACHE_SIZE", "512")),
+            ttl=float(os.getenv("TTS_CACHE_TTL", "604800")),
+            directory=os.getenv("TTS_CACHE_DIR") or None,
+            binary=True
+        )
+    
+    @property
+    def enabled(self) -> bool:
+        return self.engine is not None
+    
+    def wants_audio(self, speak: Optional[bool], input_type: InputType) -> bool:
+        """Replies to speech are spoken unless the client opts out; text replies on request."""
+        if not self.enabled:
+            return False
+        return speak if speak is not None else input_type == InputType.SPEECH
+    
+    async def synthesize(self, text: str, voice: Optional[str] = None) -> bytes:
+        """Audio for one phrase, from the cache when it has been spoken before."""
+        voice = voice or self.voice
+        key = self.cache.key(self.engine.name, voice, " ".join(text.split()))
+        return await self.cache.get_or_compute(key, lambda: self.pool.run(self.engine.synthesize, text, voice))
+    
+    async def speak(self, text: str, voice: Optional[str] = None) -> bytes:
+        """Audio for a whole reply, synthesized per sentence and joined."""
+        sentences = split_sentences(text, self.min_sentence_chars) or [text]
+        with stage("tts"):
+            segments = await asyncio.gather(*(self.synthesize(sentence, voice) for sentence in sentences))
+        return self.engine.join(list(segments))
+    
+    def pipeline(self, voice: Optional[str] = None) -> SpeechPipeline:
+        """Speak a streamed reply as its sentences complete."""
+        return SpeechPipeline(
+            lambda sentence: self.synthesize(sentence, voice),
+            self.engine.audio_format,
+            SentenceSplitter(self.min_sentence_chars)
+        )
+    
+    def close(self):
+        """Stop the synthesis worker pool."""
+        self.pool.shutdown(wait=False)
+
+class LazyService(Generic[T]):
+    """Builds a service the first time it is asked for."""
+    
+    def __init__(self, factory: Callable[[], T]):
+        self._factory = factory
+        self._instance: Optional[T] = None
+        self._lock = threading.Lock()
+    
+    def get(self) -> T:
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    started = time.perf_counter()
+                    self._instance = self._factory()
+                    logger.info(f"{self._factory.__name__} ready in {time.perf_counter() - started:.2f}s")
+        return self._instance
+    
+    @property
+    def instance(self) -> Optional[T]:
+        """The service if it has been built, without building it."""
+        return self._instance
+
+# Global service instances, built on first use
+services = {
+    "speech": LazyService(SpeechService),
+    "ai": LazyService(GeminiAIService),
+    "conversation": LazyService(ConversationService),
+    "tts": LazyService(TTSService),
+}
+
+def get_speech_service() -> SpeechService:
+    return services["speech"].get()
+
+def get_ai_service() -> GeminiAIService:
+    return services["ai"].get()
+
+def get_conversation_service() -> ConversationService:
+    return services["conversation"].get()
+
+def get_tts_service() -> TTSService:
+    return services["tts"].get()
 
-# Global service instances
-speech_service = SpeechService()
-ai_service = GeminiAIService()
-conversation_service = ConversationService()
+def __getattr__(name: str):
+    # The old module-level names (``from app.services import ai_service``) still work
+    if name.endswith("_service") and name[:-len("_service")] in services:
+        return services[name[:-len("_service")]].get()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
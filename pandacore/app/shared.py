@@ -0,0 +1,698 @@
+"""
+State shared between worker processes.
+
+Holds the hot copy of each conversation's recent history, per-name locks,
+rate limit token buckets and a pub/sub channel, so several uvicorn workers
+(or replicas) can serve the same conversation. Three backends are available:
+
+- ``local``: in-process only, for a single worker (the default)
+- ``redis``: any Redis-protocol server (needs the ``redis`` package)
+- ``sqlite``: a SQLite file shared by the workers of one host
+"""
+
+import asyncio
+import json
+import logging
+import math
+import os
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, NamedTuple, Optional
+from .cache import LRUCache
+from .models import ChatMessage, ConversationHistory
+
+try:
+    import redis.asyncio as aioredis
+    from redis.exceptions import WatchError
+except ImportError:  # optional dependency, only needed for SHARED_STATE=redis
+    aioredis = None
+
+    class WatchError(Exception):
+        """A key watched by a transaction changed before it ran (stand-in clients raise this)."""
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[dict], Awaitable[None]]
+
+
+class LockTimeout(TimeoutError):
+    """Raised when a lock could not be acquired in time."""
+
+    def __init__(self, name: str, timeout: float):
+        super().__init__(f"Timed out after {timeout:.1f}s waiting for lock {name!r}")
+        self.name = name
+        self.timeout = timeout
+
+
+class BucketLevel(NamedTuple):
+    """Outcome of taking tokens from a bucket."""
+
+    allowed: bool
+    # Tokens left once the decision was applied
+    tokens: float
+    # Seconds until the tokens asked for will be there; 0 when allowed
+    wait: float
+
+
+def take_from_bucket(tokens: Optional[float], updated: Optional[float], now: float,
+                     cost: float, capacity: float, rate: float) -> BucketLevel:
+    """Refill a bucket last seen at ``updated`` up to ``now`` and take ``cost`` from it.
+
+    A bucket that does not exist yet is full. A negative ``cost`` gives
+    tokens back and is always allowed.
+    """
+    if tokens is None or updated is None:
+        tokens = capacity
+    else:
+        tokens = min(capacity, tokens + max(0.0, now - updated) * rate)
+    if cost <= tokens:
+        return BucketLevel(True, min(capacity, tokens - cost), 0.0)
+    return BucketLevel(False, tokens, (cost - tokens) / rate if rate > 0 else math.inf)
+
+
+class KeyedLock:
+    """asyncio locks created per key on demand and dropped as soon as they are idle.
+
+    Only keys that are currently held or waited on take memory, so this scales
+    to any number of conversations without a global lock.
+    """
+
+    def __init__(self):
+        # key -> [lock, holders and waiters]
+        self._locks: dict[str, list] = {}
+
+    @asynccontextmanager
+    async def hold(self, key: str, timeout: Optional[float] = None) -> AsyncIterator[None]:
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            try:
+                if timeout is None or not entry[0].locked():
+                    await entry[0].acquire()
+                else:
+                    await asyncio.wait_for(entry[0].acquire(), timeout)
+            except asyncio.TimeoutError:
+                raise LockTimeout(key, timeout)
+            try:
+                yield
+            finally:
+                entry[0].release()
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    def locked(self, key: str) -> bool:
+        entry = self._locks.get(key)
+        return entry is not None and entry[0].locked()
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+
+class SharedState:
+    """Base class for shared state backends."""
+
+    def __init__(self, lock_ttl: float = 30.0):
+        self.lock_ttl = lock_ttl
+        self._local_locks = KeyedLock()
+        self._handlers: dict[str, list[Handler]] = {}
+
+    async def start(self):
+        """Start background listeners; called once the event loop is running."""
+
+    async def close(self):
+        """Stop listeners and release connections."""
+
+    # Conversations
+
+    async def load_conversation(self, conversation_id: str) -> Optional[ConversationHistory]:
+        """Return the hot copy of a conversation, if present."""
+        raise NotImplementedError
+
+    async def save_conversation(self, conversation: ConversationHistory, max_messages: int):
+        """Populate the hot copy of a conversation (after loading it from the store)."""
+        raise NotImplementedError
+
+    async def append_message(self, conversation_id: str, message: ChatMessage, max_messages: int, now: str):
+        """Append a message to the hot copy, keeping at most ``max_messages``."""
+        raise NotImplementedError
+
+    # Rate limits
+
+    async def take_tokens(self, key: str, cost: float, capacity: float, rate: float) -> BucketLevel:
+        """Take ``cost`` tokens from the bucket ``key``, refilling at ``rate`` per second.
+
+        Nothing is taken when the bucket holds fewer than ``cost`` tokens.
+        """
+        raise NotImplementedError
+
+    # Locks
+
+    @asynccontextmanager
+    async def lock(self, name: str, timeout: Optional[float] = None) -> AsyncIterator[None]:
+        """Hold ``name`` exclusively across every worker sharing this state.
+
+        Waiters in the same process queue on a local lock first, so only one
+        of them at a time contends for the shared one.
+        """
+        started = time.monotonic()
+        async with self._local_locks.hold(name, timeout):
+            remaining = None if timeout is None else max(0.0, timeout - (time.monotonic() - started))
+            token = await self._acquire(name, remaining)
+            try:
+                yield
+            finally:
+                await self._release(name, token)
+
+    def locked(self, name: str) -> bool:
+        """Whether this process currently holds or waits for ``name``."""
+        return self._local_locks.locked(name)
+
+    async def _acquire(self, name: str, timeout: Optional[float]) -> Optional[str]:
+        return None
+
+    async def _release(self, name: str, token: Optional[str]):
+        pass
+
+    # Pub/sub
+
+    def subscribe(self, channel: str, handler: Handler):
+        """Call ``handler`` for every message published on ``channel`` by any worker."""
+        self._handlers.setdefault(channel, []).append(handler)
+
+    async def publish(self, channel: str, message: dict):
+        raise NotImplementedError
+
+    async def _dispatch(self, channel: str, message: dict):
+        for handler in self._handlers.get(channel, ()):
+            try:
+                await handler(message)
+            except Exception as e:
+                logger.error(f"Error handling {channel} message: {e}")
+
+    def stats(self) -> dict:
+        return {"backend": type(self).__name__, "local_locks": len(self._local_locks)}
+
+
+class LocalSharedState(SharedState):
+    """Single-process backend: an LRU of conversations and in-process pub/sub."""
+
+    def __init__(self, cache_size: int = 1000, ttl: Optional[float] = 1800, lock_ttl: float = 30.0,
+                 bucket_size: int = 10000):
+        super().__init__(lock_ttl)
+        self.cache = LRUCache(maxsize=cache_size, ttl=ttl)
+        # Buckets idle for longest are dropped first; by then they have usually refilled
+        self.buckets = LRUCache(maxsize=bucket_size)
+
+    async def load_conversation(self, conversation_id: str) -> Optional[ConversationHistory]:
+        return self.cache.get(conversation_id)
+
+    async def save_conversation(self, conversation: ConversationHistory, max_messages: int):
+        self.cache.set(conversation.conversation_id, conversation)
+
+    async def append_message(self, conversation_id: str, message: ChatMessage, max_messages: int, now: str):
+        conversation = self.cache.get(conversation_id)
+        if conversation is None:
+            conversation = ConversationHistory(
+                conversation_id=conversation_id,
+                messages=[],
+                created_at=now,
+                updated_at=now
+            )
+        conversation.messages.append(message)
+        conversation.updated_at = now
+        if len(conversation.messages) > max_messages:
+            del conversation.messages[:-max_messages]
+        self.cache.set(conversation_id, conversation)
+
+    async def take_tokens(self, key: str, cost: float, capacity: float, rate: float) -> BucketLevel:
+        now = time.monotonic()
+        tokens, updated = self.buckets.get(key, (None, None))
+        level = take_from_bucket(tokens, updated, now, cost, capacity, rate)
+        if level.allowed:
+            self.buckets.set(key, (level.tokens, now))
+        return level
+
+    async def publish(self, channel: str, message: dict):
+        await self._dispatch(channel, message)
+
+
+class RedisSharedState(SharedState):
+    """Backend for any Redis-protocol server.
+
+    Each conversation is a list of JSON messages plus a hash with its
+    timestamps, both expiring after ``ttl`` seconds of inactivity. Locks are
+    ``SET NX PX`` keys with a random token that are refreshed while held.
+    Only plain commands and ``WATCH`` transactions are used (no Lua), so
+    lightweight Redis-compatible servers work too.
+    """
+
+    def __init__(self, url: str = "redis://localhost:6379/0", prefix: str = "pandalora", ttl: float = 1800,
+                 lock_ttl: float = 30.0, client=None):
+        super().__init__(lock_ttl)
+        if client is None:
+            if aioredis is None:
+                raise RuntimeError("SHARED_STATE=redis requires the redis package (pip install redis)")
+            client = aioredis.from_url(url, decode_responses=True)
+        self.redis = client
+        self.prefix = prefix
+        self.ttl = int(ttl)
+        self._renewals: dict[str, asyncio.Task] = {}
+        self._listener: Optional[asyncio.Task] = None
+        self._pubsub = None
+
+    def _key(self, *parts: str) -> str:
+        return ":".join((self.prefix,) + parts)
+
+    def subscribe(self, channel: str, handler: Handler):
+        super().subscribe(channel, handler)
+        if self._pubsub is not None:
+            asyncio.ensure_future(self._pubsub.subscribe(self._key("channel", channel)))
+
+    async def start(self):
+        if self._handlers and self._listener is None:
+            self._pubsub = self.redis.pubsub()
+            await self._pubsub.subscribe(*(self._key("channel", channel) for channel in self._handlers))
+            self._listener = asyncio.create_task(self._listen())
+
+    async def _listen(self):
+        prefix = self._key("channel", "")
+        while True:
+            try:
+                async for item in self._pubsub.listen():
+                    if item.get("type") != "message":
+                        continue
+                    channel = item["channel"]
+                    if isinstance(channel, bytes):
+                        channel = channel.decode()
+                    await self._dispatch(channel[len(prefix):], json.loads(item["data"]))
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Redis subscription failed, resubscribing: {e}")
+                await asyncio.sleep(1)
+
+    async def close(self):
+        for task in list(self._renewals.values()):
+            task.cancel()
+        if self._listener is not None:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+        await self.redis.aclose()
+
+    async def load_conversation(self, conversation_id: str) -> Optional[ConversationHistory]:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hgetall(self._key("conversation", conversation_id))
+            pipe.lrange(self._key("messages", conversation_id), 0, -1)
+            meta, messages = await pipe.execute()
+        if not meta:
+            return None
+        return ConversationHistory(
+            conversation_id=conversation_id,
+            messages=[ChatMessage.model_validate_json(raw) for raw in messages],
+            created_at=meta["created_at"],
+            updated_at=meta["updated_at"]
+        )
+
+    async def save_conversation(self, conversation: ConversationHistory, max_messages: int):
+        meta_key = self._key("conversation", conversation.conversation_id)
+        messages_key = self._key("messages", conversation.conversation_id)
+        # Only the first worker to load a conversation populates it
+        if not await self.redis.hsetnx(meta_key, "created_at", conversation.created_at):
+            return
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(meta_key, "updated_at", conversation.updated_at)
+            pipe.delete(messages_key)
+            if conversation.messages:
+                pipe.rpush(messages_key, *(m.model_dump_json() for m in conversation.messages[-max_messages:]))
+            pipe.expire(meta_key, self.ttl)
+            pipe.expire(messages_key, self.ttl)
+            await pipe.execute()
+
+    async def append_message(self, conversation_id: str, message: ChatMessage, max_messages: int, now: str):
+        meta_key = self._key("conversation", conversation_id)
+        messages_key = self._key("messages", conversation_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hsetnx(meta_key, "created_at", now)
+            pipe.hset(meta_key, "updated_at", now)
+            pipe.rpush(messages_key, message.model_dump_json())
+            pipe.ltrim(messages_key, -max_messages, -1)
+            pipe.expire(meta_key, self.ttl)
+            pipe.expire(messages_key, self.ttl)
+            await pipe.execute()
+
+    async def take_tokens(self, key: str, cost: float, capacity: float, rate: float) -> BucketLevel:
+        bucket_key = self._key("bucket", key)
+        # An idle bucket is full again after this long, so it can simply expire
+        ttl_ms = int(capacity / rate * 1000) + 1000 if rate > 0 else self.ttl * 1000
+        async with self.redis.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(bucket_key)
+                    tokens, updated = await pipe.hmget(bucket_key, "tokens", "updated")
+                    # The server clock, so every worker refills buckets the same way
+                    seconds, micros = await pipe.time()
+                    now = seconds + micros / 1e6
+                    level = take_from_bucket(
+                        None if tokens is None else float(tokens),
+                        None if updated is None else float(updated),
+                        now, cost, capacity, rate,
+                    )
+                    if not level.allowed:
+                        return level
+                    pipe.multi()
+                    pipe.hset(bucket_key, mapping={"tokens": level.tokens, "updated": now})
+                    pipe.pexpire(bucket_key, ttl_ms)
+                    await pipe.execute()
+                    return level
+                except WatchError:
+                    # Another worker took tokens in between; try again with its result
+                    continue
+
+    async def _acquire(self, name: str, timeout: Optional[float]) -> str:
+        key = self._key("lock", name)
+        token = uuid.uuid4().hex
+        deadline = None if timeout is None else time.monotonic() + timeout
+        delay = 0.005
+        while not await self.redis.set(key, token, nx=True, px=int(self.lock_ttl * 1000)):
+            if deadline is not None and time.monotonic() >= deadline:
+                raise LockTimeout(name, timeout)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.1)
+        # Keep the lock alive while it is held, e.g. for a long streamed reply
+        self._renewals[token] = asyncio.create_task(self._renew(key, token))
+        return token
+
+    async def _if_owner(self, key: str, token: str, action: Callable) -> bool:
+        """Apply ``action`` to a transaction only if ``key`` still holds ``token``."""
+        async with self.redis.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(key)
+                if await pipe.get(key) != token:
+                    return False
+                pipe.multi()
+                action(pipe)
+                await pipe.execute()
+                return True
+            except WatchError:
+                return False
+
+    async def _renew(self, key: str, token: str):
+        while True:
+            await asyncio.sleep(self.lock_ttl / 3)
+            await self._if_owner(key, token, lambda pipe: pipe.pexpire(key, int(self.lock_ttl * 1000)))
+
+    async def _release(self, name: str, token: Optional[str]):
+        renewal = self._renewals.pop(token, None)
+        if renewal is not None:
+            renewal.cancel()
+        key = self._key("lock", name)
+        await self._if_owner(key, token, lambda pipe: pipe.delete(key))
+
+    async def publish(self, channel: str, message: dict):
+        await self.redis.publish(self._key("channel", channel), json.dumps(message))
+
+
+class SQLiteSharedState(SharedState):
+    """Backend for several workers on one host, using a shared SQLite file.
+
+    Writes commit immediately so other processes see them on their next read.
+    Published messages go to an ``events`` table that every worker polls.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS hot_conversations (
+            conversation_id TEXT PRIMARY KEY,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS hot_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            conversation_id TEXT NOT NULL,
+            payload TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_hot_messages_conversation
+            ON hot_messages (conversation_id, id);
+        CREATE TABLE IF NOT EXISTS locks (
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS buckets (
+            key TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated REAL NOT NULL,
+            expires_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            channel TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            created_at REAL NOT NULL
+        );
+    """
+
+    # Published messages older than this are deleted
+    EVENT_RETENTION = 60.0
+    # Seconds between sweeps of expired conversations and old events
+    SWEEP_INTERVAL = 10.0
+
+    def __init__(self, path: str = "shared_state.db", ttl: float = 1800, lock_ttl: float = 30.0,
+                 poll_interval: float = 0.05):
+        super().__init__(lock_ttl)
+        self.path = path
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        # One connection, used from one thread; other processes coordinate through file locks
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shared-state")
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("PRAGMA busy_timeout=5000")
+        self._db.executescript(self.SCHEMA)
+        self._poller: Optional[asyncio.Task] = None
+        self._renewals: dict[str, asyncio.Task] = {}
+        logger.info(f"SQLite shared state opened at {path}")
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _transaction(self, fn, *args):
+        db = self._db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(db, *args)
+            db.execute("COMMIT")
+            return result
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+    async def start(self):
+        if self._poller is None:
+            self._poller = asyncio.create_task(self._poll())
+
+    async def close(self):
+        for task in list(self._renewals.values()):
+            task.cancel()
+        if self._poller is not None:
+            self._poller.cancel()
+            await asyncio.gather(self._poller, return_exceptions=True)
+        await self._run(self._db.close)
+        self._executor.shutdown(wait=True)
+        logger.info("SQLite shared state closed")
+
+    async def load_conversation(self, conversation_id: str) -> Optional[ConversationHistory]:
+        def load():
+            meta = self._db.execute(
+                "SELECT created_at, updated_at FROM hot_conversations WHERE conversation_id = ? AND expires_at > ?",
+                (conversation_id, time.time()),
+            ).fetchone()
+            if meta is None:
+                return None
+            rows = self._db.execute(
+                "SELECT payload FROM hot_messages WHERE conversation_id = ? ORDER BY id", (conversation_id,)
+            ).fetchall()
+            return meta, rows
+
+        result = await self._run(load)
+        if result is None:
+            return None
+        (created_at, updated_at), rows = result
+        return ConversationHistory(
+            conversation_id=conversation_id,
+            messages=[ChatMessage.model_validate_json(payload) for payload, in rows],
+            created_at=created_at,
+            updated_at=updated_at
+        )
+
+    async def save_conversation(self, conversation: ConversationHistory, max_messages: int):
+        payloads = [(conversation.conversation_id, m.model_dump_json()) for m in conversation.messages[-max_messages:]]
+
+        def save(db):
+            db.execute("DELETE FROM hot_conversations WHERE conversation_id = ? AND expires_at <= ?",
+                       (conversation.conversation_id, time.time()))
+            inserted = db.execute(
+                "INSERT OR IGNORE INTO hot_conversations (conversation_id, created_at, updated_at, expires_at) "
+                "VALUES (?, ?, ?, ?)",
+                (conversation.conversation_id, conversation.created_at, conversation.updated_at, time.time() + self.ttl),
+            ).rowcount
+            # Only the first worker to load a conversation populates it
+            if inserted:
+                db.execute("DELETE FROM hot_messages WHERE conversation_id = ?", (conversation.conversation_id,))
+                db.executemany("INSERT INTO hot_messages (conversation_id, payload) VALUES (?, ?)", payloads)
+
+        await self._run(self._transaction, save)
+
+    async def append_message(self, conversation_id: str, message: ChatMessage, max_messages: int, now: str):
+        payload = message.model_dump_json()
+
+        def append(db):
+            db.execute(
+                "INSERT INTO hot_conversations (conversation_id, created_at, updated_at, expires_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (conversation_id) DO UPDATE SET updated_at = excluded.updated_at, expires_at = excluded.expires_at",
+                (conversation_id, now, now, time.time() + self.ttl),
+            )
+            db.execute("INSERT INTO hot_messages (conversation_id, payload) VALUES (?, ?)", (conversation_id, payload))
+            db.execute(
+                "DELETE FROM hot_messages WHERE conversation_id = ? AND id <= ("
+                "  SELECT id FROM hot_messages WHERE conversation_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?"
+                ")",
+                (conversation_id, conversation_id, max_messages),
+            )
+
+        await self._run(self._transaction, append)
+
+    async def take_tokens(self, key: str, cost: float, capacity: float, rate: float) -> BucketLevel:
+        # An idle bucket is full again after this long, so it can be swept
+        refill = capacity / rate if rate > 0 else self.ttl
+
+        def take(db) -> BucketLevel:
+            now = time.time()
+            row = db.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            level = take_from_bucket(*(row or (None, None)), now, cost, capacity, rate)
+            if level.allowed:
+                db.execute(
+                    "INSERT INTO buckets (key, tokens, updated, expires_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated, "
+                    "expires_at = excluded.expires_at",
+                    (key, level.tokens, now, now + refill),
+                )
+            return level
+
+        return await self._run(self._transaction, take)
+
+    async def _acquire(self, name: str, timeout: Optional[float]) -> str:
+        token = uuid.uuid4().hex
+
+        def try_acquire(db) -> bool:
+            now = time.time()
+            db.execute("DELETE FROM locks WHERE name = ? AND expires_at <= ?", (name, now))
+            return db.execute(
+                "INSERT OR IGNORE INTO locks (name, owner, expires_at) VALUES (?, ?, ?)",
+                (name, token, now + self.lock_ttl),
+            ).rowcount == 1
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        delay = 0.005
+        while not await self._run(self._transaction, try_acquire):
+            if deadline is not None and time.monotonic() >= deadline:
+                raise LockTimeout(name, timeout)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.1)
+        self._renewals[token] = asyncio.create_task(self._renew(name, token))
+        return token
+
+    async def _renew(self, name: str, token: str):
+        while True:
+            await asyncio.sleep(self.lock_ttl / 3)
+            await self._run(lambda: self._db.execute(
+                "UPDATE locks SET expires_at = ? WHERE name = ? AND owner = ?",
+                (time.time() + self.lock_ttl, name, token),
+            ))
+
+    async def _release(self, name: str, token: Optional[str]):
+        renewal = self._renewals.pop(token, None)
+        if renewal is not None:
+            renewal.cancel()
+        await self._run(lambda: self._db.execute("DELETE FROM locks WHERE name = ? AND owner = ?", (name, token)))
+
+    async def publish(self, channel: str, message: dict):
+        payload = json.dumps(message)
+        await self._run(lambda: self._db.execute(
+            "INSERT INTO events (channel, payload, created_at) VALUES (?, ?, ?)", (channel, payload, time.time())
+        ))
+
+    async def _poll(self):
+        row = await self._run(lambda: self._db.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone())
+        last_id = row[0]
+        last_sweep = time.monotonic()
+        while True:
+            rows = []
+            try:
+                rows = await self._run(lambda: self._db.execute(
+                    "SELECT id, channel, payload FROM events WHERE id > ? ORDER BY id LIMIT 500", (last_id,)
+                ).fetchall())
+                for event_id, channel, payload in rows:
+                    last_id = event_id
+                    await self._dispatch(channel, json.loads(payload))
+
+                if time.monotonic() - last_sweep > self.SWEEP_INTERVAL:
+                    last_sweep = time.monotonic()
+                    await self._run(self._transaction, self._sweep)
+            except asyncio.CancelledError:
+                raise
+            except sqlite3.Error as e:
+                logger.error(f"Shared state poll failed: {e}")
+            if not rows:
+                await asyncio.sleep(self.poll_interval)
+
+    def _sweep(self, db):
+        now = time.time()
+        db.execute("DELETE FROM events WHERE created_at < ?", (now - self.EVENT_RETENTION,))
+        db.execute(
+            "DELETE FROM hot_messages WHERE conversation_id IN ("
+            "  SELECT conversation_id FROM hot_conversations WHERE expires_at <= ?"
+            ")",
+            (now,),
+        )
+        db.execute("DELETE FROM hot_conversations WHERE expires_at <= ?", (now,))
+        db.execute("DELETE FROM buckets WHERE expires_at <= ?", (now,))
+
+
+def create_shared_state() -> SharedState:
+    """Build the shared state backend selected by the environment."""
+    backend = os.getenv("SHARED_STATE", "local").lower()
+    ttl = float(os.getenv("CONVERSATION_CACHE_TTL", "1800"))
+    lock_ttl = float(os.getenv("SHARED_LOCK_TTL", "30"))
+    if backend == "local":
+        return LocalSharedState(
+            cache_size=int(os.getenv("CONVERSATION_CACHE_SIZE", "1000")),
+            ttl=ttl,
+            lock_ttl=lock_ttl,
+        )
+    if backend == "redis":
+        return RedisSharedState(
+            os.getenv("REDIS_URL", "redis://localhost:6379/0"),
+            prefix=os.getenv("REDIS_PREFIX", "pandalora"),
+            ttl=ttl,
+            lock_ttl=lock_ttl,
+        )
+    if backend == "sqlite":
+        return SQLiteSharedState(
+            os.getenv("SHARED_STATE_PATH", "shared_state.db"),
+            ttl=ttl,
+            lock_ttl=lock_ttl,
+            poll_interval=float(os.getenv("SHARED_STATE_POLL_INTERVAL", "0.05")),
+        )
+    raise ValueError(f"Unknown SHARED_STATE backend: {backend}")
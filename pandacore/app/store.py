@@ -0,0 +1,287 @@
+"""
+Conversation persistence backends for PandaLora.
+"""
+
+import os
+import logging
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Optional
+from .models import ChatMessage, ConversationHistory
+
+logger = logging.getLogger(__name__)
+
+
+def utc_now() -> str:
+    """Current UTC time as an ISO 8601 string."""
+    return datetime.now(timezone.utc).isoformat()
+
+
+class ConversationStore:
+    """Base class for conversation storage backends."""
+
+    def append(self, conversation_id: str, message: ChatMessage):
+        """Persist a message. Implementations must not block on disk I/O."""
+        raise NotImplementedError
+
+    def load(self, conversation_id: str, limit: int) -> Optional[ConversationHistory]:
+        """Load the most recent ``limit`` messages of a conversation, if it exists."""
+        raise NotImplementedError
+
+    def load_after(self, conversation_id: str, after: int, limit: int) -> list[ChatMessage]:
+        """Load up to ``limit`` messages with a sequence number above ``after``, oldest first."""
+        raise NotImplementedError
+
+    def last_seq(self, conversation_id: str) -> int:
+        """Sequence number of the latest message of a conversation, 0 if it has none."""
+        raise NotImplementedError
+
+    def flush(self):
+        """Block until every appended message is durable."""
+
+    def close(self):
+        """Flush and release backend resources."""
+        self.flush()
+
+
+class SQLiteConversationStore(ConversationStore):
+    """Append-only SQLite store with batched, group-committed writes.
+
+    Messages are queued in memory and written by a background thread that
+    commits them in batches, so request handlers never wait on the disk.
+    Reads consult the pending and the committing batch as well, so a message
+    is visible as soon as ``append`` returns. Reads are blocking SQLite
+    queries: call them from a worker thread, not the event loop. They never
+    wait for a commit, since WAL lets them run alongside the writer.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS conversations (
+            conversation_id TEXT PRIMARY KEY,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            conversation_id TEXT NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            timestamp TEXT,
+            created_at TEXT NOT NULL,
+            seq INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS idx_messages_conversation
+            ON messages (conversation_id, id);
+    """
+
+    def __init__(self, path: str, flush_interval: float = 0.05, batch_size: int = 256):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = max(1, batch_size)
+
+        self._pending: list[tuple] = []
+        # The batch the writer is committing, still read from memory until it is durable
+        self._writing: list[tuple] = []
+        # Guards the pending and committing batches; held only briefly, never across a commit
+        self._lock = threading.Lock()
+        # One reader connection, used by one thread at a time
+        self._read_lock = threading.Lock()
+        self._wakeup = threading.Condition(threading.Lock())
+        self._flushed = threading.Condition(self._lock)
+        self._closed = False
+
+        self._writer_db = self._connect()
+        self._writer_db.executescript(self.SCHEMA)
+        self._migrate(self._writer_db)
+        self._reader_db = self._connect()
+
+        self._writer = threading.Thread(target=self._write_loop, name="conversation-writer", daemon=True)
+        self._writer.start()
+        logger.info(f"SQLite conversation store opened at {path}")
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        # With WAL, NORMAL only syncs at checkpoints: commits survive a crash
+        # of the process without paying an fsync per batch
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("PRAGMA busy_timeout=5000")
+        return db
+
+    def _migrate(self, db: sqlite3.Connection):
+        columns = {row[1] for row in db.execute("PRAGMA table_info(messages)")}
+        if "seq" not in columns:
+            # Number the messages of databases created before sequence numbers, in insertion order
+            logger.info("Adding sequence numbers to stored messages")
+            db.execute("BEGIN")
+            db.execute("ALTER TABLE messages ADD COLUMN seq INTEGER")
+            db.execute(
+                "UPDATE messages SET seq = ("
+                "  SELECT COUNT(*) FROM messages AS earlier"
+                "  WHERE earlier.conversation_id = messages.conversation_id AND earlier.id <= messages.id"
+                ")"
+            )
+            db.execute("COMMIT")
+        db.execute("CREATE INDEX IF NOT EXISTS idx_messages_conversation_seq ON messages (conversation_id, seq)")
+
+    def append(self, conversation_id: str, message: ChatMessage):
+        row = (conversation_id, message.role, message.content, message.timestamp, utc_now(), message.seq)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Conversation store is closed")
+            self._pending.append(row)
+            pending = len(self._pending)
+        if pending >= self.batch_size:
+            with self._wakeup:
+                self._wakeup.notify()
+
+    def _unwritten(self, conversation_id: str) -> list[tuple]:
+        """Rows of a conversation not yet known to be committed.
+
+        Taken before querying, so a batch committed in between shows up in
+        both; ``_merge`` drops the duplicates.
+        """
+        with self._lock:
+            return [row[1:] for row in self._writing + self._pending if row[0] == conversation_id]
+
+    @staticmethod
+    def _merge(rows: list[tuple], unwritten: list[tuple]) -> list[tuple]:
+        """Stored and unwritten rows, each message once, in sequence order."""
+        if not unwritten:
+            return rows
+        merged = {row[4]: row for row in rows}
+        merged.update((row[4], row) for row in unwritten)
+        return [merged[seq] for seq in sorted(merged)]
+
+    def load(self, conversation_id: str, limit: int) -> Optional[ConversationHistory]:
+        unwritten = self._unwritten(conversation_id)
+        with self._read_lock:
+            meta = self._reader_db.execute(
+                "SELECT created_at, updated_at FROM conversations WHERE conversation_id = ?",
+                (conversation_id,),
+            ).fetchone()
+            rows = self._reader_db.execute(
+                "SELECT role, content, timestamp, created_at, seq FROM ("
+                "  SELECT id, role, content, timestamp, created_at, seq FROM messages"
+                "  WHERE conversation_id = ? ORDER BY id DESC LIMIT ?"
+                ") ORDER BY id",
+                (conversation_id, limit),
+            ).fetchall()
+
+        rows = self._merge(rows, unwritten)[-limit:]
+        if not rows:
+            return None
+
+        created_at = meta[0] if meta else rows[0][3]
+        updated_at = rows[-1][3]
+        return ConversationHistory(
+            conversation_id=conversation_id,
+            messages=[ChatMessage(role=role, content=content, timestamp=timestamp, seq=seq)
+                      for role, content, timestamp, _, seq in rows],
+            created_at=created_at,
+            updated_at=updated_at,
+        )
+
+    def load_after(self, conversation_id: str, after: int, limit: int) -> list[ChatMessage]:
+        unwritten = [row for row in self._unwritten(conversation_id) if row[4] > after]
+        with self._read_lock:
+            rows = self._reader_db.execute(
+                "SELECT role, content, timestamp, created_at, seq FROM messages"
+                " WHERE conversation_id = ? AND seq > ? ORDER BY seq LIMIT ?",
+                (conversation_id, after, limit),
+            ).fetchall()
+        return [ChatMessage(role=role, content=content, timestamp=timestamp, seq=seq)
+                for role, content, timestamp, _, seq in self._merge(rows, unwritten)[:limit]]
+
+    def last_seq(self, conversation_id: str) -> int:
+        unwritten = self._unwritten(conversation_id)
+        if unwritten:
+            return unwritten[-1][4]
+        with self._read_lock:
+            row = self._reader_db.execute(
+                "SELECT MAX(seq) FROM messages WHERE conversation_id = ?", (conversation_id,)
+            ).fetchone()
+        return row[0] or 0
+
+    def _write_loop(self):
+        while True:
+            with self._wakeup:
+                self._wakeup.wait(timeout=self.flush_interval)
+            failed = False
+            with self._lock:
+                batch, self._pending = self._pending, []
+                self._writing = batch
+                closed = self._closed
+            # Committed without the lock, so appends and reads never wait for the disk
+            if batch:
+                try:
+                    self._write_batch(batch)
+                except sqlite3.Error as e:
+                    if closed:
+                        logger.error(f"Dropping {len(batch)} unpersisted messages on close: {e}")
+                    else:
+                        logger.error(f"Failed to persist {len(batch)} messages, will retry: {e}")
+                        failed = True
+            with self._lock:
+                if failed:
+                    self._pending = batch + self._pending
+                self._writing = []
+                self._flushed.notify_all()
+            if closed:
+                return
+            if failed:
+                time.sleep(self.flush_interval)
+
+    def _write_batch(self, batch: list[tuple]):
+        # Group commit: one transaction for the whole batch
+        db = self._writer_db
+        db.execute("BEGIN")
+        try:
+            db.executemany(
+                "INSERT INTO messages (conversation_id, role, content, timestamp, created_at, seq) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                batch,
+            )
+            db.executemany(
+                "INSERT INTO conversations (conversation_id, created_at, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (conversation_id) DO UPDATE SET updated_at = excluded.updated_at",
+                [(row[0], row[4], row[4]) for row in batch],
+            )
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+    def flush(self):
+        with self._lock:
+            while (self._pending or self._writing) and self._writer.is_alive():
+                with self._wakeup:
+                    self._wakeup.notify()
+                self._flushed.wait(timeout=self.flush_interval)
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        with self._wakeup:
+            self._wakeup.notify()
+        self._writer.join()
+        self._writer_db.close()
+        with self._read_lock:
+            self._reader_db.close()
+        logger.info("SQLite conversation store closed")
+
+
+def create_conversation_store() -> ConversationStore:
+    """Build the conversation store selected by the environment."""
+    backend = os.getenv("CONVERSATION_STORE", "sqlite").lower()
+    if backend == "sqlite":
+        return SQLiteConversationStore(
+            os.getenv("CONVERSATION_DB_PATH", "conversations.db"),
+            flush_interval=float(os.getenv("CONVERSATION_FLUSH_INTERVAL", "0.05")),
+            batch_size=int(os.getenv("CONVERSATION_FLUSH_BATCH", "256")),
+        )
+    raise ValueError(f"Unknown CONVERSATION_STORE backend: {backend}")
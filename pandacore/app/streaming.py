@@ -0,0 +1,277 @@
+"""
+Streaming helpers for PandaLora.
+
+Bridges blocking, synchronous iterators (such as Gemini's streamed
+``generate_content`` response) onto the asyncio event loop without stalling it,
+and fans a single stream out to several consumers, including consumers that
+reconnect later and resume where they left off.
+"""
+
+import asyncio
+import concurrent.futures
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import Executor
+from typing import AsyncGenerator, AsyncIterator, Callable, Iterable, Optional, TypeVar
+from .cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Queue message kinds passed from the producer thread to the consumer
+_ITEM = 0
+_ERROR = 1
+_DONE = 2
+
+# How often a blocked producer re-checks whether the consumer went away
+_PRODUCER_POLL_INTERVAL = 0.1
+
+
+async def iterate_in_thread(
+    factory: Callable[[], Iterable[T]],
+    maxsize: int = 32,
+    executor: Optional[Executor] = None,
+    on_exit: Optional[Callable[[], None]] = None,
+) -> AsyncGenerator[T, None]:
+    """Consume a blocking iterable from a worker thread as an async generator.
+
+    ``factory`` is called inside the worker thread, so any blocking setup (for
+    example opening the upstream stream) never runs on the event loop. Items
+    are handed over through a bounded queue: when the consumer falls behind the
+    producer blocks, which propagates backpressure upstream instead of
+    buffering an unbounded response in memory. If the consumer stops early
+    (client disconnect, cancellation) the producer is told to stop and exits
+    after its current item. ``on_exit`` is called on the event loop once the
+    producer thread has finished.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, maxsize))
+    stopped = threading.Event()
+
+    def put(kind: int, payload=None) -> bool:
+        """Hand an item to the event loop, blocking while the queue is full."""
+        try:
+            future = asyncio.run_coroutine_threadsafe(queue.put((kind, payload)), loop)
+        except RuntimeError:
+            # Event loop is closed; nobody is listening anymore
+            return False
+        while True:
+            try:
+                future.result(timeout=_PRODUCER_POLL_INTERVAL)
+                return True
+            except concurrent.futures.TimeoutError:
+                if stopped.is_set():
+                    future.cancel()
+                    return False
+            except concurrent.futures.CancelledError:
+                return False
+
+    def produce():
+        iterator = None
+        try:
+            iterator = iter(factory())
+            for item in iterator:
+                if stopped.is_set() or not put(_ITEM, item):
+                    return
+        except BaseException as e:
+            if not stopped.is_set():
+                put(_ERROR, e)
+            return
+        finally:
+            close = getattr(iterator, "close", None)
+            if stopped.is_set() and close is not None:
+                try:
+                    close()
+                except Exception as e:
+                    logger.debug(f"Error closing abandoned stream: {e}")
+        if not stopped.is_set():
+            put(_DONE)
+
+    producer = loop.run_in_executor(executor, produce)
+    if on_exit is not None:
+        producer.add_done_callback(lambda _: on_exit())
+
+    try:
+        while True:
+            kind, payload = await queue.get()
+            if kind == _ITEM:
+                yield payload
+            elif kind == _ERROR:
+                raise payload
+            else:
+                break
+    finally:
+        stopped.set()
+        # Unblock a producer waiting on a full queue so its thread is released
+        while not queue.empty():
+            queue.get_nowait()
+        if not producer.done():
+            producer.add_done_callback(_log_producer_error)
+        else:
+            _log_producer_error(producer)
+
+
+def _log_producer_error(future: "asyncio.Future"):
+    """Retrieve the producer's result so failures are never silently dropped."""
+    if future.cancelled():
+        return
+    error = future.exception()
+    if error is not None:
+        logger.error(f"Stream producer failed: {error}")
+
+
+class BroadcastStream:
+    """Runs one async producer and lets any number of consumers follow it.
+
+    Every subscriber sees the full sequence of chunks from the beginning,
+    whether it joined before the first chunk or halfway through. The producer
+    is cancelled once the last subscriber leaves before it has finished, or
+    ``linger`` seconds later if nobody subscribes again in the meantime.
+    """
+
+    def __init__(self, source: AsyncIterator[str], linger: float = 0.0):
+        self.chunks: list[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.linger = linger
+        self._abandon_timer: Optional[asyncio.TimerHandle] = None
+        self._changed = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run(source))
+
+    async def _run(self, source: AsyncIterator[str]):
+        try:
+            async for chunk in source:
+                self.chunks.append(chunk)
+                self._notify()
+        except asyncio.CancelledError:
+            self.error = asyncio.CancelledError()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+            close = getattr(source, "aclose", None)
+            if close is not None:
+                await close()
+
+    def _notify(self):
+        # Wake everyone waiting on the current event, then arm a fresh one
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    @property
+    def text(self) -> str:
+        return "".join(self.chunks)
+
+    async def wait(self):
+        """Wait until the producer has finished."""
+        await asyncio.shield(self._task)
+
+    async def subscribe(self, start: int = 0) -> AsyncGenerator[str, None]:
+        """Yield every chunk from index ``start`` on, raising the producer's error if any."""
+        self.subscribers += 1
+        if self._abandon_timer is not None:
+            self._abandon_timer.cancel()
+            self._abandon_timer = None
+        try:
+            index = start
+            while True:
+                changed = self._changed
+                while index < len(self.chunks):
+                    yield self.chunks[index]
+                    index += 1
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await changed.wait()
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.done:
+                if self.linger > 0:
+                    self._abandon_timer = asyncio.get_running_loop().call_later(self.linger, self._abandon)
+                else:
+                    self._task.cancel()
+
+    def _abandon(self):
+        self._abandon_timer = None
+        if self.subscribers == 0 and not self.done:
+            self._task.cancel()
+
+
+class ResumableStreams:
+    """Keeps recent event streams replayable so a client that drops can resume.
+
+    Each stream gets an ID; its events are numbered and sent with SSE ``id:``
+    lines of the form ``<stream id>:<index>``. A client that reconnects with
+    that value as ``Last-Event-ID`` picks up from the next event, served from
+    the buffer without running the producer again. The producer keeps running
+    for ``linger`` seconds after its last client leaves. Streams are kept for
+    ``ttl`` seconds after they were last touched, up to ``maxsize`` of them.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0, linger: float = 15.0):
+        self.linger = linger
+        self._streams = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.started = 0
+        self.resumed = 0
+
+    @classmethod
+    def from_env(cls) -> "ResumableStreams":
+        return cls(
+            maxsize=int(os.getenv("STREAM_RESUME_MAX_STREAMS", "1024")),
+            ttl=float(os.getenv("STREAM_RESUME_TTL", "60")),
+            linger=float(os.getenv("STREAM_RESUME_LINGER", "15")),
+        )
+
+    def start(self, source: AsyncIterator[str]) -> tuple[str, BroadcastStream]:
+        """Run ``source`` as a new resumable stream."""
+        stream_id = uuid.uuid4().hex
+        stream = BroadcastStream(source, linger=self.linger)
+        self._streams.set(stream_id, stream)
+        # Restart the TTL when the stream finishes, so a long reply stays resumable
+        stream._task.add_done_callback(lambda _: self._streams.set(stream_id, stream))
+        self.started += 1
+        return stream_id, stream
+
+    def resume(self, last_event_id: str) -> Optional[tuple[str, BroadcastStream, int]]:
+        """Find the stream behind ``last_event_id``; returns (ID, stream, next index)."""
+        stream_id, _, index = last_event_id.strip().rpartition(":")
+        if not stream_id or not index.isdigit():
+            return None
+        stream = self._streams.get(stream_id)
+        # A stream abandoned past its linger has lost its producer
+        if stream is None or (stream.done and stream.error is not None):
+            return None
+        self.resumed += 1
+        return stream_id, stream, int(index) + 1
+
+    @staticmethod
+    async def events(stream_id: str, stream: BroadcastStream, start: int = 0) -> AsyncGenerator[str, None]:
+        """Yield the stream's SSE frames from ``start`` on, each prefixed with its ID."""
+        index = start
+        async for frame in stream.subscribe(start):
+            yield f"id: {stream_id}:{index}\n{frame}"
+            index += 1
+
+    def stats(self) -> dict:
+        return {"streams": len(self._streams), "started": self.started, "resumed": self.resumed}
+
+
+def split_for_replay(text: str, size: int = 64) -> list[str]:
+    """Split text into chunks of roughly ``size`` characters at word boundaries."""
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(len(text), start + size)
+        if end < len(text):
+            space = text.rfind(" ", start + 1, end + 1)
+            if space > start:
+                end = space + 1
+        chunks.append(text[start:end])
+        start = end
+    return chunks
@@ -0,0 +1,246 @@
+"""
+Text-to-speech building blocks for PandaLora replies.
+
+Replies are spoken one sentence at a time: ``SentenceSplitter`` cuts streamed
+text into sentences as they complete and ``SpeechPipeline`` synthesizes them
+concurrently while handing the audio back in order, so playback can start
+long before the whole answer exists. Engines are pluggable; ``ToneEngine``
+needs nothing beyond NumPy and stands in for a real voice offline and in
+load tests.
+"""
+
+import asyncio
+import base64
+import io
+import logging
+import os
+import re
+import wave
+import zlib
+from collections import deque
+from dataclasses import dataclass
+from typing import AsyncGenerator, Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Sentence punctuation, optionally followed by closing quotes or brackets, then whitespace
+SENTENCE_END = re.compile(r"[.!?…]+[\"')\]]*\s+|\n+")
+
+
+class SentenceSplitter:
+    """Incrementally splits streamed text into sentences.
+
+    Sentences shorter than ``min_chars`` are held back and joined with the
+    next one, so "Hi!" does not become its own synthesis call; text that runs
+    past ``max_chars`` without punctuation is cut at the last space.
+    """
+
+    def __init__(self, min_chars: int = 24, max_chars: int = 240):
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self._buffer = ""
+
+    def feed(self, text: str) -> list[str]:
+        """Add streamed text; returns the sentences it completed."""
+        self._buffer += text
+        sentences = []
+        start = 0
+        for match in SENTENCE_END.finditer(self._buffer):
+            if match.end() - start >= self.min_chars:
+                sentences.append(self._buffer[start:match.end()].strip())
+                start = match.end()
+        while len(self._buffer) - start > self.max_chars:
+            cut = self._buffer.rfind(" ", start, start + self.max_chars)
+            end = cut + 1 if cut > start else start + self.max_chars
+            sentences.append(self._buffer[start:end].strip())
+            start = end
+        self._buffer = self._buffer[start:]
+        return [sentence for sentence in sentences if sentence]
+
+    def flush(self) -> Optional[str]:
+        """Return whatever is left once the stream has ended."""
+        rest, self._buffer = self._buffer.strip(), ""
+        return rest or None
+
+
+def split_sentences(text: str, min_chars: int = 24, max_chars: int = 240) -> list[str]:
+    splitter = SentenceSplitter(min_chars, max_chars)
+    sentences = splitter.feed(text)
+    rest = splitter.flush()
+    return sentences + [rest] if rest else sentences
+
+
+class TTSEngine:
+    """Turns text into audio bytes. ``synthesize`` blocks and runs in a worker thread."""
+
+    name = "base"
+    audio_format = "wav"
+    media_type = "audio/wav"
+
+    def synthesize(self, text: str, voice: str) -> bytes:
+        raise NotImplementedError
+
+    def join(self, segments: list[bytes]) -> bytes:
+        """Combine sentence segments into one playable file."""
+        return b"".join(segments)
+
+
+class ToneEngine(TTSEngine):
+    """Offline stand-in voice: one short tone per word, pitched by the word.
+
+    Output is deterministic and its length follows the text, which is all
+    tests and benchmarks need from a voice.
+    """
+
+    name = "tone"
+
+    def __init__(self, sample_rate: int = 16000):
+        self.sample_rate = sample_rate
+
+    def synthesize(self, text: str, voice: str) -> bytes:
+        import numpy as np
+
+        pieces = []
+        gap = np.zeros(int(self.sample_rate * 0.05), dtype=np.float32)
+        for word in text.split():
+            pitch = 140 + zlib.crc32(f"{voice}:{word.lower()}".encode()) % 160
+            seconds = min(0.05 + 0.06 * len(word), 0.6)
+            t = np.arange(int(self.sample_rate * seconds), dtype=np.float32) / self.sample_rate
+            envelope = np.minimum(1.0, np.minimum(t, seconds - t) * 40)
+            pieces.extend([0.3 * envelope * np.sin(2 * np.pi * pitch * t), gap])
+        samples = np.concatenate(pieces) if pieces else gap
+        return self._wav((samples * 32767).astype("<i2").tobytes())
+
+    def join(self, segments: list[bytes]) -> bytes:
+        from .audio import parse_wav
+
+        return self._wav(b"".join(bytes(parse_wav(segment).data) for segment in segments))
+
+    def _wav(self, frames: bytes) -> bytes:
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as out:
+            out.setnchannels(1)
+            out.setsampwidth(2)
+            out.setframerate(self.sample_rate)
+            out.writeframes(frames)
+        return buffer.getvalue()
+
+
+class GTTSEngine(TTSEngine):
+    """Google Translate's TTS through gTTS; ``voice`` is the language code."""
+
+    name = "gtts"
+    audio_format = "mp3"
+    media_type = "audio/mpeg"
+
+    def __init__(self):
+        # Optional dependency, only needed for TTS_ENGINE=gtts; importing it
+        # here keeps it off the startup path of every other configuration.
+        from gtts import gTTS
+
+        self._gtts = gTTS
+
+    def synthesize(self, text: str, voice: str) -> bytes:
+        buffer = io.BytesIO()
+        self._gtts(text=text, lang=voice or "en").write_to_fp(buffer)
+        return buffer.getvalue()
+
+
+def create_tts_engine() -> Optional[TTSEngine]:
+    """Build the engine named by ``TTS_ENGINE`` (none, tone or gtts)."""
+    engine = os.getenv("TTS_ENGINE", "none").lower()
+    if engine == "tone":
+        return ToneEngine()
+    if engine == "gtts":
+        try:
+            return GTTSEngine()
+        except ImportError:
+            logger.warning("TTS_ENGINE=gtts requires `pip install gTTS`; speech output is disabled")
+            return None
+    if engine != "none":
+        raise ValueError(f"Unknown TTS_ENGINE {engine!r}")
+    return None
+
+
+@dataclass
+class SpokenSentence:
+    """Audio for one sentence of a reply."""
+
+    index: int
+    text: str
+    audio: bytes
+    audio_format: str
+
+    @property
+    def audio_base64(self) -> str:
+        return base64.b64encode(self.audio).decode("ascii")
+
+    def frame(self) -> dict:
+        return {
+            "type": "audio",
+            "index": self.index,
+            "text": self.text,
+            "audio_format": self.audio_format,
+            "audio_data": self.audio_base64,
+        }
+
+
+class SpeechPipeline:
+    """Synthesizes a streamed reply sentence by sentence.
+
+    ``feed`` starts synthesis for every sentence the text completes; ``ready``
+    returns finished audio in sentence order without waiting, and ``rest``
+    waits for what is left after ``finish``. A sentence whose synthesis fails
+    is skipped; the text still reaches the client.
+    """
+
+    def __init__(
+        self,
+        synthesize: Callable[[str], Awaitable[bytes]],
+        audio_format: str,
+        splitter: SentenceSplitter,
+    ):
+        self._synthesize = synthesize
+        self.audio_format = audio_format
+        self.splitter = splitter
+        self._pending: deque = deque()
+        self._count = 0
+
+    def feed(self, text: str):
+        for sentence in self.splitter.feed(text):
+            self._start(sentence)
+
+    def finish(self):
+        rest = self.splitter.flush()
+        if rest:
+            self._start(rest)
+
+    def _start(self, sentence: str):
+        self._pending.append((self._count, sentence, asyncio.ensure_future(self._synthesize(sentence))))
+        self._count += 1
+
+    def ready(self) -> list[SpokenSentence]:
+        spoken = []
+        while self._pending and self._pending[0][2].done():
+            spoken.extend(self._collect(*self._pending.popleft()))
+        return spoken
+
+    async def rest(self) -> AsyncGenerator[SpokenSentence, None]:
+        while self._pending:
+            index, sentence, task = self._pending[0]
+            await asyncio.wait({task})
+            self._pending.popleft()
+            for spoken in self._collect(index, sentence, task):
+                yield spoken
+
+    def _collect(self, index: int, sentence: str, task: asyncio.Future) -> list[SpokenSentence]:
+        if task.cancelled():
+            return []
+        if task.exception() is not None:
+            logger.warning(f"Speech synthesis failed for sentence {index}: {task.exception()}")
+            return []
+        return [SpokenSentence(index, sentence, task.result(), self.audio_format)]
+
+    def cancel(self):
+        while self._pending:
+            self._pending.popleft()[2].cancel()
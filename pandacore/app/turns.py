@@ -0,0 +1,182 @@
+"""
+Per-conversation turn ordering for PandaLora.
+
+A turn is reading the history, appending the user's message, generating the
+reply and appending it. Turns on the same conversation never overlap; what
+happens to a turn that arrives while another is in flight depends on the
+policy:
+
+- ``queue``: wait for the earlier turns to finish
+- ``reject``: fail immediately with ``ConversationBusy``
+- ``supersede``: cancel the earlier turns and run once they have stopped
+"""
+
+import asyncio
+import logging
+import os
+import uuid
+from contextlib import asynccontextmanager
+from enum import Enum
+from typing import AsyncIterator, Awaitable, Optional, TypeVar
+from .shared import LockTimeout, SharedState
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+CHANNEL = "turns"
+
+
+class TurnPolicy(str, Enum):
+    QUEUE = "queue"
+    REJECT = "reject"
+    SUPERSEDE = "supersede"
+
+
+class ConversationBusy(RuntimeError):
+    """Raised when a turn cannot start because another one is in flight."""
+
+    def __init__(self, conversation_id: str, retry_after: int = 1):
+        super().__init__(f"Conversation {conversation_id} is busy with another message, please retry in {retry_after}s")
+        self.conversation_id = conversation_id
+        self.retry_after = retry_after
+
+
+class TurnSuperseded(RuntimeError):
+    """Raised inside a turn that was cancelled by a newer message."""
+
+    def __init__(self, conversation_id: str):
+        super().__init__(f"Superseded by a newer message in conversation {conversation_id}")
+        self.conversation_id = conversation_id
+
+
+class Turn:
+    """One in-flight turn; ``superseded`` is set when a newer turn cancels it."""
+
+    def __init__(self, conversation_id: str):
+        self.conversation_id = conversation_id
+        self.turn_id = uuid.uuid4().hex
+        self.superseded = asyncio.Event()
+
+    def check(self):
+        if self.superseded.is_set():
+            raise TurnSuperseded(self.conversation_id)
+
+    async def run(self, awaitable: Awaitable[T]) -> T:
+        """Await ``awaitable``, abandoning it as soon as the turn is superseded."""
+        self.check()
+        task = asyncio.ensure_future(awaitable)
+        waiter = asyncio.ensure_future(self.superseded.wait())
+        try:
+            await asyncio.wait({task, waiter}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            waiter.cancel()
+            if not task.done():
+                task.cancel()
+        if not task.done() or task.cancelled():
+            raise TurnSuperseded(self.conversation_id)
+        return task.result()
+
+    async def stream(self, source: AsyncIterator[T]) -> AsyncIterator[T]:
+        """Pass ``source`` through until the turn is superseded, then close it."""
+        try:
+            async for item in source:
+                self.check()
+                yield item
+        finally:
+            close = getattr(source, "aclose", None)
+            if close is not None:
+                await close()
+
+
+class TurnCoordinator:
+    """Serializes turns per conversation across every worker sharing ``state``."""
+
+    def __init__(
+        self,
+        state: SharedState,
+        policy: TurnPolicy = TurnPolicy.QUEUE,
+        queue_timeout: float = 30.0,
+    ):
+        self.state = state
+        self.policy = policy
+        self.queue_timeout = queue_timeout
+        # conversation_id -> local turns that are running or waiting
+        self._turns: dict[str, set[Turn]] = {}
+        self.rejected = 0
+        self.superseded = 0
+        state.subscribe(CHANNEL, self._on_event)
+
+    @classmethod
+    def from_env(cls, state: SharedState) -> "TurnCoordinator":
+        return cls(
+            state,
+            policy=TurnPolicy(os.getenv("CONVERSATION_TURN_POLICY", "queue").lower()),
+            queue_timeout=float(os.getenv("CONVERSATION_TURN_TIMEOUT", "30")),
+        )
+
+    def _lock_name(self, conversation_id: str) -> str:
+        return f"conversation:{conversation_id}"
+
+    def busy(self, conversation_id: str) -> bool:
+        """Whether this worker has a turn in flight for the conversation."""
+        return bool(self._turns.get(conversation_id))
+
+    def check(self, conversation_id: str, policy: Optional[TurnPolicy] = None):
+        """Cheap pre-flight for ``reject``, before committing to a streamed response."""
+        if (policy or self.policy) == TurnPolicy.REJECT and self.busy(conversation_id):
+            self.rejected += 1
+            raise ConversationBusy(conversation_id)
+
+    @asynccontextmanager
+    async def turn(self, conversation_id: str, policy: Optional[TurnPolicy] = None) -> AsyncIterator[Turn]:
+        """Run the block as the conversation's only turn, according to ``policy``."""
+        policy = policy or self.policy
+        turn = Turn(conversation_id)
+
+        if policy == TurnPolicy.REJECT:
+            self.check(conversation_id, policy)
+            timeout = 0.0
+        else:
+            timeout = self.queue_timeout
+            if policy == TurnPolicy.SUPERSEDE:
+                await self.state.publish(CHANNEL, {
+                    "type": "supersede",
+                    "conversation_id": conversation_id,
+                    "turn_id": turn.turn_id,
+                })
+
+        turns = self._turns.setdefault(conversation_id, set())
+        turns.add(turn)
+        try:
+            try:
+                async with self.state.lock(self._lock_name(conversation_id), timeout):
+                    # A turn superseded while it waited gives up without running
+                    turn.check()
+                    yield turn
+            except LockTimeout:
+                if policy == TurnPolicy.REJECT:
+                    self.rejected += 1
+                raise ConversationBusy(conversation_id)
+        except TurnSuperseded:
+            self.superseded += 1
+            logger.info(f"Turn in conversation {conversation_id} superseded by a newer message")
+            raise
+        finally:
+            turns.discard(turn)
+            if not turns and self._turns.get(conversation_id) is turns:
+                del self._turns[conversation_id]
+
+    async def _on_event(self, event: dict):
+        if event.get("type") != "supersede":
+            return
+        for turn in self._turns.get(event.get("conversation_id"), ()):
+            if turn.turn_id != event.get("turn_id"):
+                turn.superseded.set()
+
+    def stats(self) -> dict:
+        return {
+            "conversations": len(self._turns),
+            "rejected": self.rejected,
+            "superseded": self.superseded,
+        }
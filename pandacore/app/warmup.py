@@ -0,0 +1,88 @@
+"""
+Startup warm-up and readiness for PandaLora.
+
+Services are built on first use, so without a warm-up the first requests a
+new worker serves pay for importing client libraries, connecting to Gemini
+and spawning audio processes. ``WarmUp`` does that work in the background
+right after startup and keeps track of it, so /health can tell a load
+balancer or autoscaler when the worker is ready for traffic.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+RUNNING = "running"
+READY = "ready"
+FAILED = "failed"
+
+
+class WarmUp:
+    """Runs named warm-up steps concurrently and records how each one went.
+
+    Steps are enabled with ``WARMUP`` (``all``, ``none`` or a comma separated
+    list of step names). A failed or timed out step is logged and reported,
+    but does not hold readiness back: the service still works, the first
+    requests are just slower.
+    """
+
+    def __init__(self, steps: dict[str, Callable[[], Awaitable]], timeout: float = 60.0):
+        self.steps = steps
+        self.timeout = timeout
+        self.state = {name: {"state": PENDING} for name in steps}
+        self._task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_env(cls, steps: dict[str, Callable[[], Awaitable]]) -> "WarmUp":
+        wanted = os.getenv("WARMUP", "none").lower().replace(" ", "")
+        if wanted == "all":
+            enabled = steps
+        else:
+            names = {name for name in wanted.split(",") if name and name != "none"}
+            unknown = names - steps.keys()
+            if unknown:
+                raise ValueError(f"Unknown WARMUP steps {sorted(unknown)}; choose from {sorted(steps)}")
+            enabled = {name: step for name, step in steps.items() if name in names}
+        return cls(enabled, timeout=float(os.getenv("WARMUP_TIMEOUT", "60")))
+
+    def start(self):
+        if self._task is None and self.steps:
+            self._task = asyncio.create_task(self.run())
+
+    async def run(self):
+        started = time.perf_counter()
+        await asyncio.gather(*(self._run_step(name, step) for name, step in self.steps.items()))
+        outcome = ", ".join(f"{name}={entry['state']}" for name, entry in self.state.items())
+        logger.info(f"Warm-up finished in {time.perf_counter() - started:.2f}s: {outcome}")
+
+    async def _run_step(self, name: str, step: Callable[[], Awaitable]):
+        entry = self.state[name]
+        entry["state"] = RUNNING
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(step(), self.timeout)
+            entry["state"] = READY
+        except Exception as e:
+            logger.warning(f"Warm-up step {name} failed: {e!r}")
+            entry["state"] = FAILED
+            entry["error"] = str(e) or type(e).__name__
+        entry["seconds"] = round(time.perf_counter() - started, 3)
+
+    @property
+    def ready(self) -> bool:
+        """True once every step has finished, successfully or not."""
+        return all(entry["state"] in (READY, FAILED) for entry in self.state.values())
+
+    @property
+    def degraded(self) -> bool:
+        return any(entry["state"] == FAILED for entry in self.state.values())
+
+    async def close(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
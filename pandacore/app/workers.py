@@ -0,0 +1,254 @@
+"""
+Bounded worker pools for blocking and CPU-heavy work.
+
+Every kind of blocking work (Gemini calls per route, speech recognition,
+audio decoding) gets its own pool so a spike in one cannot starve the others,
+and each pool sheds load once its wait queue is full or a caller has waited
+too long for a slot. Callers waiting for a slot are served round robin per
+client, so one busy client cannot starve the others either.
+"""
+
+import asyncio
+import contextvars
+import functools
+import logging
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Optional
+from .metrics import EXECUTOR_WAIT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Who the current request is for (see ratelimit.RateLimiter.admit); pools
+# queue waiters per client. Work without a client shares one queue
+current_client: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "pandalora_current_client", default=None
+)
+
+
+class ExecutorOverloaded(RuntimeError):
+    """Raised when a pool turns work away; ``retry_after`` is a hint in seconds."""
+
+    def __init__(self, name: str, retry_after: int = 1, reason: str = "overloaded"):
+        super().__init__(f"The {name} worker pool is {reason}, please retry in {retry_after}s")
+        self.name = name
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class BoundedExecutor:
+    """Wraps an executor with a concurrency cap and a bounded wait queue.
+
+    At most ``max_workers`` jobs run at once and at most ``max_queue`` more may
+    wait for a slot, each for no longer than ``queue_timeout`` seconds.
+    Anything beyond that is rejected with ``ExecutorOverloaded`` rather than
+    piling up unbounded work. A freed slot goes to the next client in turn
+    (``current_client``), and to that client's longest waiting job.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        executor: Executor,
+        max_workers: int,
+        max_queue: int,
+        queue_timeout: Optional[float] = None,
+    ):
+        self.name = name
+        self.executor = executor
+        self.max_workers = max(1, max_workers)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self._free = self.max_workers
+        # client -> futures of its jobs waiting for a slot, clients in serving order
+        self._waiters: "OrderedDict[Optional[str], deque]" = OrderedDict()
+        self.active = 0
+        self.waiting = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        # Exponentially weighted average time a job holds a slot
+        self._service_time = 1.0
+
+    @classmethod
+    def threads(
+        cls,
+        name: str,
+        env_prefix: str,
+        workers: int,
+        queue: int,
+        queue_timeout: Optional[float] = None,
+    ) -> "BoundedExecutor":
+        """Build a thread pool sized from ``<env_prefix>_WORKERS/_QUEUE/_QUEUE_TIMEOUT``."""
+        workers = int(os.getenv(f"{env_prefix}_WORKERS", str(workers)))
+        timeout = os.getenv(f"{env_prefix}_QUEUE_TIMEOUT")
+        return cls(
+            name,
+            ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name),
+            max_workers=workers,
+            max_queue=int(os.getenv(f"{env_prefix}_QUEUE", str(queue))),
+            queue_timeout=float(timeout) if timeout else queue_timeout,
+        )
+
+    @property
+    def saturated(self) -> bool:
+        """True while every worker is busy; new jobs would have to wait."""
+        return self._free == 0
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely to free up for a new caller."""
+        backlog = (self.waiting + 1) / self.max_workers
+        return max(1, math.ceil(self._service_time * backlog))
+
+    def admit(self):
+        """Fail fast if a new job would be rejected right now."""
+        if self._free == 0 and self.waiting >= self.max_queue:
+            self.rejected += 1
+            logger.warning(f"{self.name} pool full ({self.active} active, {self.waiting} waiting), shedding load")
+            raise ExecutorOverloaded(self.name, self.retry_after())
+
+    @asynccontextmanager
+    async def slot(self, deadline: Optional[float] = None) -> AsyncIterator[None]:
+        """Hold one of the pool's slots for the duration of the block.
+
+        ``deadline`` is an absolute ``time.monotonic()`` value; by default the
+        pool's ``queue_timeout`` applies.
+        """
+        release = await self.claim(deadline)
+        try:
+            yield
+        finally:
+            release()
+
+    async def claim(self, deadline: Optional[float] = None) -> Callable[[], None]:
+        """Wait for a slot and return the function that gives it back.
+
+        For work that may outlive its caller, such as a thread that keeps
+        running after the caller was cancelled: the slot is returned when
+        the work has finished, not when the caller stopped waiting.
+        """
+        self.admit()
+
+        timeout = self.queue_timeout
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            timeout = remaining if timeout is None else min(timeout, remaining)
+
+        self.waiting += 1
+        queued = time.monotonic()
+        try:
+            await self._acquire(timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            logger.warning(f"{self.name} pool: gave up after waiting {timeout:.2f}s for a slot")
+            raise ExecutorOverloaded(self.name, self.retry_after(), reason="busy")
+        finally:
+            self.waiting -= 1
+
+        self.active += 1
+        started = time.monotonic()
+        EXECUTOR_WAIT_SECONDS.observe(started - queued, pool=self.name)
+        released = False
+
+        def release():
+            nonlocal released
+            if released:
+                return
+            released = True
+            self.active -= 1
+            self.completed += 1
+            self._service_time += 0.2 * ((time.monotonic() - started) - self._service_time)
+            self._release()
+
+        return release
+
+    async def _acquire(self, timeout: Optional[float]):
+        if self._free > 0 and not self._waiters:
+            self._free -= 1
+            return
+        client = current_client.get()
+        waiter = asyncio.get_running_loop().create_future()
+        queue = self._waiters.get(client)
+        if queue is None:
+            queue = self._waiters[client] = deque()
+        queue.append(waiter)
+        try:
+            if timeout is None:
+                await waiter
+            else:
+                await asyncio.wait_for(waiter, max(0.0, timeout))
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as we gave up; pass it on
+                self._release()
+            else:
+                waiter.cancel()
+                self._forget(client, waiter)
+            raise
+
+    def _release(self):
+        """Hand the slot to the next waiting client in turn, or free it."""
+        while self._waiters:
+            client, queue = next(iter(self._waiters.items()))
+            waiter = queue.popleft()
+            if queue:
+                # The client goes to the back of the line
+                self._waiters.move_to_end(client)
+            else:
+                del self._waiters[client]
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._free += 1
+
+    def _forget(self, client: Optional[str], waiter: asyncio.Future):
+        queue = self._waiters.get(client)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            if not queue:
+                del self._waiters[client]
+
+    async def run(self, fn: Callable[..., Any], *args, deadline: Optional[float] = None, **kwargs) -> Any:
+        """Run ``fn(*args, **kwargs)`` in the pool once a slot is free.
+
+        Cancelling the caller (a timed out attempt, a losing hedge) cannot
+        stop the thread, so the slot stays taken until ``fn`` returns;
+        otherwise stalled calls would pile up past the pool's limits.
+        """
+        release = await self.claim(deadline)
+        try:
+            future = asyncio.get_running_loop().run_in_executor(
+                self.executor, functools.partial(fn, *args, **kwargs)
+            )
+        except BaseException:
+            release()
+            raise
+        future.add_done_callback(lambda done: _finished(done, release))
+        return await asyncio.shield(future)
+
+    def stats(self) -> dict:
+        return {
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "waiting": self.waiting,
+            "waiting_clients": len(self._waiters),
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+        }
+
+    def shutdown(self, wait: bool = True):
+        self.executor.shutdown(wait=wait)
+        logger.info(f"{self.name} worker pool shut down")
+
+
+def _finished(future: asyncio.Future, release: Callable[[], None]):
+    release()
+    # Nobody may be waiting for the result any more
+    if not future.cancelled():
+        future.exception()
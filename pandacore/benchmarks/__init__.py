@@ -0,0 +1,4 @@
+"""
+Load tests for the PandaLora backend, run against local Gemini and
+speech recognizer stand-ins.
+"""
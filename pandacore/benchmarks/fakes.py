@@ -0,0 +1,358 @@
+"""
+Deterministic stand-ins for Gemini, Google speech recognition and Redis.
+
+The Gemini and recognizer fakes block the calling thread for a configurable
+time, like the real clients do, so the worker pools, streaming bridge and
+event loop are exercised the same way as in production without any network
+traffic. ``FakeRedis`` keeps its data in process, so the Redis shared state
+backend can be tested without a server.
+"""
+
+import asyncio
+import hashlib
+import io
+import random
+import threading
+import time
+import wave
+from dataclasses import dataclass
+
+import numpy as np
+from google.api_core import exceptions as google_exceptions
+
+WORDS = (
+    "the moon hangs low over the bamboo grove and I find the quiet rather "
+    "agreeable tonight so tell me what is on your mind"
+).split()
+
+
+@dataclass
+class FakeLatency:
+    # Seconds until a non-streamed reply is returned
+    llm_latency: float = 0.3
+    # Seconds until the first streamed chunk
+    llm_ttft: float = 0.2
+    # Seconds between streamed chunks
+    chunk_interval: float = 0.02
+    # Chunks per reply
+    chunks: int = 20
+    # Seconds one recognize_google call takes
+    recognizer_latency: float = 0.25
+    # Share of Gemini calls that fail with 503 Service Unavailable
+    llm_error_rate: float = 0.0
+    # Share of Gemini calls that take llm_slow_latency instead (before the first chunk when streamed)
+    llm_slow_rate: float = 0.0
+    llm_slow_latency: float = 5.0
+
+
+class FakeChunk:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeGeminiModel:
+    """Replaces ``genai.GenerativeModel``; replies are derived from the prompt."""
+
+    def __init__(self, latency: FakeLatency):
+        self.latency = latency
+        # Seeded so a benchmark run injects the same faults every time
+        self._random = random.Random(0)
+        self._lock = threading.Lock()
+
+    def _words(self, prompt: str) -> list:
+        seed = int.from_bytes(hashlib.sha256(prompt.encode("utf-8")).digest()[:4], "big")
+        return [WORDS[(seed + i) % len(WORDS)] + " " for i in range(self.latency.chunks)]
+
+    def _wait(self, seconds: float, request_options: dict):
+        """Sleep like an upstream call, failing the way the real client does."""
+        with self._lock:
+            failing = self._random.random() < self.latency.llm_error_rate
+            slow = self._random.random() < self.latency.llm_slow_rate
+        if slow:
+            seconds = self.latency.llm_slow_latency
+        timeout = (request_options or {}).get("timeout")
+        if timeout is not None and seconds > timeout:
+            time.sleep(timeout)
+            raise google_exceptions.DeadlineExceeded("fake Gemini deadline exceeded")
+        time.sleep(seconds)
+        if failing:
+            raise google_exceptions.ServiceUnavailable("fake Gemini outage")
+
+    def generate_content(self, prompt: str, stream: bool = False, request_options: dict = None, **kwargs):
+        words = self._words(prompt)
+        if not stream:
+            self._wait(self.latency.llm_latency, request_options)
+            return FakeChunk("".join(words).strip())
+
+        def chunks():
+            self._wait(self.latency.llm_ttft, request_options)
+            for index, word in enumerate(words):
+                if index:
+                    time.sleep(self.latency.chunk_interval)
+                yield FakeChunk(word)
+        return chunks()
+
+    def count_tokens(self, prompt: str, request_options: dict = None, **kwargs):
+        self._wait(0.0, request_options)
+        return len(self._words(prompt))
+
+
+class FakeRecognizer:
+    """Replaces ``sr.Recognizer``; reports how much audio it was given."""
+
+    def __init__(self, latency: FakeLatency):
+        self.latency = latency
+
+    def recognize_google(self, audio, language: str = "en-US", **kwargs) -> str:
+        time.sleep(self.latency.recognizer_latency)
+        seconds = len(audio.frame_data) / (audio.sample_rate * audio.sample_width)
+        return f"tell me about {seconds:.1f} seconds of bamboo"
+
+
+def install(latency: FakeLatency):
+    """Point the global services at the fakes."""
+    from app.services import get_ai_service, get_speech_service
+
+    ai_service = get_ai_service()
+    speech_service = get_speech_service()
+    ai_service.api_key = "benchmark"
+    ai_service.model = FakeGeminiModel(latency)
+    speech_service.recognizer = FakeRecognizer(latency)
+
+
+def speech_wav(seconds: float = 3.0, sample_rate: int = 44100, channels: int = 2) -> bytes:
+    """A WAV upload shaped like real speech: bursts of tone between silences."""
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    envelope = ((t % 1.0) > 0.3) & ((t % 1.0) < 0.8) & (t > 0.5) & (t < seconds - 0.5)
+    rng = np.random.default_rng(0)
+    signal = 0.4 * np.sin(2 * np.pi * 220 * t) * envelope + 0.002 * rng.standard_normal(t.size)
+    samples = (np.clip(signal, -1, 1) * 32767).astype("<i2")
+    samples = np.repeat(samples[:, None], channels, axis=1)
+
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(samples.tobytes())
+    return buffer.getvalue()
+
+
+class FakeRedis:
+    """An in-process stand-in for a ``redis.asyncio`` client with ``decode_responses=True``.
+
+    Covers exactly the commands ``RedisSharedState`` sends, including
+    ``WATCH`` transactions and pub/sub. Several ``RedisSharedState``
+    instances built on one ``FakeRedis`` behave like workers sharing a server.
+    """
+
+    def __init__(self):
+        self._data: dict = {}
+        # key -> time.monotonic() deadline
+        self._expires: dict[str, float] = {}
+        # Bumped on every write, which is what WATCH compares
+        self._versions: dict[str, int] = {}
+        self._subscribers: dict[str, set] = {}
+
+    def pipeline(self, transaction: bool = True) -> "FakePipeline":
+        return FakePipeline(self, transaction)
+
+    def pubsub(self) -> "FakePubSub":
+        return FakePubSub(self)
+
+    async def aclose(self):
+        pass
+
+    def __getattr__(self, command: str):
+        if not hasattr(type(self), f"_{command}"):
+            raise AttributeError(command)
+
+        async def call(*args, **kwargs):
+            return self.execute(command, *args, **kwargs)
+        return call
+
+    def execute(self, command: str, *args, **kwargs):
+        return getattr(self, f"_{command}")(*args, **kwargs)
+
+    def version(self, key: str) -> int:
+        self._expire_if_due(key)
+        return self._versions.get(key, 0)
+
+    def _expire_if_due(self, key: str):
+        deadline = self._expires.get(key)
+        if deadline is not None and time.monotonic() >= deadline:
+            self._remove(key)
+
+    def _remove(self, key: str) -> bool:
+        self._expires.pop(key, None)
+        if self._data.pop(key, None) is None:
+            return False
+        self._touch(key)
+        return True
+
+    def _touch(self, key: str):
+        self._versions[key] = self._versions.get(key, 0) + 1
+
+    def _read(self, key: str, default=None):
+        self._expire_if_due(key)
+        return self._data.get(key, default)
+
+    def _write(self, key: str, value):
+        self._data[key] = value
+        self._touch(key)
+
+    # Commands, named after the redis-py methods
+
+    def _get(self, key: str):
+        return self._read(key)
+
+    def _set(self, key: str, value, nx: bool = False, px: int = None):
+        if nx and self._read(key) is not None:
+            return None
+        self._write(key, str(value))
+        self._expires.pop(key, None)
+        if px is not None:
+            self._expires[key] = time.monotonic() + px / 1000
+        return True
+
+    def _delete(self, *keys: str) -> int:
+        return sum(self._remove(key) for key in keys)
+
+    def _expire(self, key: str, seconds: int) -> bool:
+        return self._pexpire(key, seconds * 1000)
+
+    def _pexpire(self, key: str, milliseconds: int) -> bool:
+        if self._read(key) is None:
+            return False
+        self._expires[key] = time.monotonic() + milliseconds / 1000
+        self._touch(key)
+        return True
+
+    def _hgetall(self, key: str) -> dict:
+        return dict(self._read(key, {}))
+
+    def _hmget(self, key: str, *fields: str) -> list:
+        value = self._read(key, {})
+        return [value.get(field) for field in fields]
+
+    def _hset(self, key: str, field: str = None, value=None, mapping: dict = None) -> int:
+        items = dict(mapping or {})
+        if field is not None:
+            items[field] = value
+        hash_ = self._read(key, {})
+        added = sum(field not in hash_ for field in items)
+        self._write(key, {**hash_, **{name: str(item) for name, item in items.items()}})
+        return added
+
+    def _hsetnx(self, key: str, field: str, value) -> bool:
+        if field in self._read(key, {}):
+            return False
+        self._hset(key, field, value)
+        return True
+
+    def _rpush(self, key: str, *values) -> int:
+        items = self._read(key, []) + [str(value) for value in values]
+        self._write(key, items)
+        return len(items)
+
+    def _lrange(self, key: str, start: int, end: int) -> list:
+        items = self._read(key, [])
+        return items[start:None if end == -1 else end + 1]
+
+    def _ltrim(self, key: str, start: int, end: int) -> bool:
+        items = self._lrange(key, start, end)
+        if items:
+            self._write(key, items)
+        else:
+            self._remove(key)
+        return True
+
+    def _time(self) -> tuple[int, int]:
+        now = time.time()
+        return int(now), int(now % 1 * 1_000_000)
+
+    def _publish(self, channel: str, message: str) -> int:
+        subscribers = self._subscribers.get(channel, ())
+        for pubsub in subscribers:
+            pubsub.deliver({"type": "message", "channel": channel, "data": message})
+        return len(subscribers)
+
+
+class FakePipeline:
+    """``FakeRedis.pipeline()``: queues commands, or runs them at once while watching keys."""
+
+    def __init__(self, redis: FakeRedis, transaction: bool):
+        self.redis = redis
+        self.transaction = transaction
+        self._queue: list = []
+        # key -> version when WATCH was sent
+        self._watched: dict[str, int] = {}
+        self._immediate = False
+
+    async def __aenter__(self) -> "FakePipeline":
+        return self
+
+    async def __aexit__(self, *exc):
+        self.reset()
+
+    def reset(self):
+        self._queue.clear()
+        self._watched.clear()
+        self._immediate = False
+
+    async def watch(self, *keys: str):
+        self._watched.update((key, self.redis.version(key)) for key in keys)
+        self._immediate = True
+
+    def multi(self):
+        self._immediate = False
+
+    async def execute(self) -> list:
+        from app.shared import WatchError
+
+        try:
+            if any(self.redis.version(key) != version for key, version in self._watched.items()):
+                raise WatchError("Watched variable changed.")
+            return [self.redis.execute(command, *args, **kwargs) for command, args, kwargs in self._queue]
+        finally:
+            self.reset()
+
+    def __getattr__(self, command: str):
+        if not hasattr(FakeRedis, f"_{command}"):
+            raise AttributeError(command)
+
+        def call(*args, **kwargs):
+            if self._immediate:
+                async def run():
+                    return self.redis.execute(command, *args, **kwargs)
+                return run()
+            self._queue.append((command, args, kwargs))
+            return self
+        return call
+
+
+class FakePubSub:
+    """``FakeRedis.pubsub()``: a subscription whose messages arrive through ``listen``."""
+
+    def __init__(self, redis: FakeRedis):
+        self.redis = redis
+        self.channels: set[str] = set()
+        self._messages: asyncio.Queue = asyncio.Queue()
+
+    def deliver(self, message: dict):
+        self._messages.put_nowait(message)
+
+    async def subscribe(self, *channels: str):
+        for channel in channels:
+            self.redis._subscribers.setdefault(channel, set()).add(self)
+            self.channels.add(channel)
+            self.deliver({"type": "subscribe", "channel": channel, "data": len(self.channels)})
+
+    async def listen(self):
+        while True:
+            yield await self._messages.get()
+
+    async def aclose(self):
+        for channel in self.channels:
+            self.redis._subscribers.get(channel, set()).discard(self)
+        self.channels.clear()
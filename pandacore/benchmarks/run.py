@@ -0,0 +1,348 @@
+"""
+Load test for the PandaLora backend.
+
+Starts ``benchmarks.server`` (the real app with local Gemini and recognizer
+stand-ins) in a subprocess, drives the text, speech, SSE and WebSocket
+routes at a fixed concurrency and writes latency percentiles, time to first
+chunk, throughput and event loop lag to a JSON file.
+
+Usage:
+    python -m benchmarks.run --concurrency 32 --requests 400 --output bench.json
+    python -m benchmarks.run --baseline bench.json --output bench-new.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from dataclasses import asdict, dataclass, field, fields
+from typing import Awaitable, Callable, Optional
+
+import httpx
+import websockets
+
+from .fakes import FakeLatency, speech_wav
+from .server import add_latency_arguments
+
+SCENARIOS = ("text", "speech", "sse", "ws")
+PREFIX = "/api/v1"
+
+
+@dataclass
+class Sample:
+    latency: float
+    ttft: Optional[float] = None
+    error: Optional[str] = None
+
+
+@dataclass
+class ScenarioResult:
+    requests: int = 0
+    errors: int = 0
+    duration: float = 0.0
+    samples: list = field(default_factory=list)
+    loop_lag: list = field(default_factory=list)
+    error_kinds: dict = field(default_factory=dict)
+
+    def summary(self) -> dict:
+        ok = [s for s in self.samples if s.error is None]
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "error_kinds": self.error_kinds,
+            "duration": round(self.duration, 3),
+            "rps": round(len(ok) / self.duration, 2) if self.duration else 0.0,
+            "latency": percentiles([s.latency for s in ok]),
+            "ttft": percentiles([s.ttft for s in ok if s.ttft is not None]),
+            "loop_lag": percentiles(self.loop_lag),
+        }
+
+
+def percentiles(values: list) -> dict:
+    """p50/p95/p99/mean/max in milliseconds (nearest rank)."""
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def rank(p: float) -> float:
+        return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))]
+
+    return {
+        "p50": round(rank(50) * 1000, 2),
+        "p95": round(rank(95) * 1000, 2),
+        "p99": round(rank(99) * 1000, 2),
+        "mean": round(sum(ordered) / len(ordered) * 1000, 2),
+        "max": round(ordered[-1] * 1000, 2),
+    }
+
+
+def is_end_frame(frame: dict) -> bool:
+    return frame.get("type") == "end"
+
+
+class LoadDriver:
+    """Issues requests against one base URL with a fixed number of concurrent clients."""
+
+    def __init__(self, base_url: str, concurrency: int, requests: int, audio: bytes):
+        self.base_url = base_url.rstrip("/")
+        self.concurrency = concurrency
+        self.requests = requests
+        self.audio = audio
+        self.run_id = uuid.uuid4().hex[:8]
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=60,
+            limits=httpx.Limits(max_connections=concurrency * 2, max_keepalive_connections=concurrency * 2),
+        )
+
+    def message(self, index: int) -> str:
+        # Unique text per request so the response cache does not short-circuit the run
+        return f"benchmark {self.run_id} message {index}: what do pandas dream about?"
+
+    async def text(self, worker: int, index: int) -> Sample:
+        started = time.perf_counter()
+        response = await self.client.post(
+            f"{PREFIX}/chat/text",
+            params={"conversation_id": f"bench-{self.run_id}-text-{worker}"},
+            json={"text": self.message(index)},
+        )
+        response.raise_for_status()
+        return Sample(time.perf_counter() - started)
+
+    async def speech(self, worker: int, index: int) -> Sample:
+        started = time.perf_counter()
+        response = await self.client.post(
+            f"{PREFIX}/chat/speech",
+            files={"audio_file": ("speech.wav", self.audio, "audio/wav")},
+            data={"conversation_id": f"bench-{self.run_id}-speech-{worker}-{index}"},
+        )
+        response.raise_for_status()
+        return Sample(time.perf_counter() - started)
+
+    async def sse(self, worker: int, index: int) -> Sample:
+        started = time.perf_counter()
+        ttft = None
+        url = f"{PREFIX}/chat/stream/bench-{self.run_id}-sse-{worker}"
+        async with self.client.stream("POST", url, json={"text": self.message(index)}) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                event = json.loads(line[6:])
+                if ttft is None and event.get("chunk") and not event.get("is_complete"):
+                    ttft = time.perf_counter() - started
+                if event.get("is_complete"):
+                    if event.get("chunk", "").startswith("Error:"):
+                        raise RuntimeError(event["chunk"])
+                    break
+        return Sample(time.perf_counter() - started, ttft)
+
+    async def ws_session(self, worker: int, counter, out: list):
+        """One WebSocket connection per client, reused for all of its messages."""
+        url = self.base_url.replace("http", "ws", 1) + f"{PREFIX}/ws/chat/bench-{self.run_id}-ws-{worker}"
+        async with websockets.connect(url, max_size=None) as ws:
+            for index in counter:
+                started = time.perf_counter()
+                ttft = None
+                try:
+                    await ws.send(json.dumps({"type": "message", "text": self.message(index)}))
+                    while True:
+                        frame = json.loads(await ws.recv())
+                        if is_end_frame(frame):
+                            break
+                        if frame.get("type") == "error":
+                            raise RuntimeError(frame.get("detail"))
+                        if ttft is None and frame.get("type") == "chunk":
+                            ttft = time.perf_counter() - started
+                    out.append(Sample(time.perf_counter() - started, ttft))
+                except Exception as e:
+                    out.append(Sample(time.perf_counter() - started, error=type(e).__name__))
+                    if isinstance(e, websockets.ConnectionClosed):
+                        return
+
+    async def run(self, scenario: str) -> ScenarioResult:
+        result = ScenarioResult()
+        counter = iter(range(self.requests))
+        await self.loop_lag()  # discard samples from before this scenario
+
+        started = time.perf_counter()
+        if scenario == "ws":
+            await asyncio.gather(*(self.ws_session(worker, counter, result.samples) for worker in range(self.concurrency)))
+        else:
+            request: Callable[[int, int], Awaitable[Sample]] = getattr(self, scenario)
+
+            async def client(worker: int):
+                for index in counter:
+                    began = time.perf_counter()
+                    try:
+                        result.samples.append(await request(worker, index))
+                    except Exception as e:
+                        kind = f"HTTP {e.response.status_code}" if isinstance(e, httpx.HTTPStatusError) else type(e).__name__
+                        result.samples.append(Sample(time.perf_counter() - began, error=kind))
+
+            await asyncio.gather(*(client(worker) for worker in range(self.concurrency)))
+        result.duration = time.perf_counter() - started
+
+        result.loop_lag = await self.loop_lag()
+        result.requests = len(result.samples)
+        for sample in result.samples:
+            if sample.error is not None:
+                result.errors += 1
+                result.error_kinds[sample.error] = result.error_kinds.get(sample.error, 0) + 1
+        return result
+
+    async def loop_lag(self) -> list:
+        try:
+            response = await self.client.get("/_bench/loop-lag")
+            return response.json()["samples"] if response.status_code == 200 else []
+        except httpx.HTTPError:
+            return []
+
+    async def close(self):
+        await self.client.aclose()
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(args) -> tuple:
+    port = free_port()
+    command = [sys.executable, "-m", "benchmarks.server", "--port", str(port)]
+    for latency_field in fields(FakeLatency):
+        command += [f"--{latency_field.name.replace('_', '-')}", str(getattr(args, latency_field.name))]
+    if args.cache:
+        command.append("--cache")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    process = subprocess.Popen(command, cwd=root)
+
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Benchmark server exited with code {process.returncode}")
+        try:
+            if httpx.get(f"{base_url}/health", timeout=1).status_code == 200:
+                return process, base_url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("Benchmark server did not become healthy within 60s")
+
+
+def git_revision(root: str) -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=root, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current: dict, baseline: dict) -> list:
+    """Lines describing how each scenario moved relative to a previous run."""
+    lines = []
+    for name, result in current["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        changes = []
+        for metric, key in [("latency", "p50"), ("latency", "p95"), ("latency", "p99"), ("ttft", "p50")]:
+            old, new = before.get(metric, {}).get(key), result.get(metric, {}).get(key)
+            if old and new is not None:
+                changes.append(f"{metric} {key} {(new - old) / old:+.1%}")
+        if before.get("rps"):
+            changes.append(f"rps {(result['rps'] - before['rps']) / before['rps']:+.1%}")
+        lines.append(f"{name:>7}: " + ", ".join(changes))
+    return lines
+
+
+async def run_scenarios(base_url: str, args) -> dict:
+    driver = LoadDriver(base_url, args.concurrency, args.requests, speech_wav(args.audio_seconds))
+    results = {}
+    try:
+        for scenario in args.scenarios:
+            result = await driver.run(scenario)
+            results[scenario] = result.summary()
+            summary = results[scenario]
+            print(
+                f"{scenario:>7}: {summary['rps']:8.1f} req/s  "
+                f"p50 {summary['latency'].get('p50', 0):8.1f}ms  "
+                f"p95 {summary['latency'].get('p95', 0):8.1f}ms  "
+                f"p99 {summary['latency'].get('p99', 0):8.1f}ms  "
+                f"ttft p50 {summary['ttft'].get('p50', 0):7.1f}ms  "
+                f"loop lag p99 {summary['loop_lag'].get('p99', 0):6.1f}ms  "
+                f"errors {summary['errors']}"
+            )
+    finally:
+        await driver.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the PandaLora backend against local fakes.")
+    parser.add_argument("--url", help="Benchmark an already running server instead of starting one")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma separated subset of: " + ", ".join(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200, help="Requests per scenario")
+    parser.add_argument("--audio-seconds", type=float, default=3.0, help="Length of the uploaded speech clip")
+    parser.add_argument("--cache", action="store_true", help="Keep the server's response cache enabled")
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--baseline", help="Previous results file to compare against")
+    add_latency_arguments(parser)
+    args = parser.parse_args()
+    args.scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    process = None
+    base_url = args.url
+    if base_url is None:
+        process, base_url = start_server(args)
+    try:
+        results = asyncio.run(run_scenarios(base_url, args))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "revision": git_revision(root),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "config": {
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "audio_seconds": args.audio_seconds,
+            "cache": args.cache,
+            "fakes": asdict(FakeLatency(**{f.name: getattr(args, f.name) for f in fields(FakeLatency)})),
+        },
+        "scenarios": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f"Compared to {args.baseline} ({baseline.get('revision') or 'unknown revision'}):")
+        for line in compare(report, baseline):
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
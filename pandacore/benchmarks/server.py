@@ -0,0 +1,85 @@
+"""
+Runs the PandaLora app with the benchmark fakes installed.
+
+Usage: python -m benchmarks.server --port 8765 [--llm-latency 0.3 ...]
+
+Besides the normal API it serves ``GET /_bench/loop-lag``, which reports how
+late the event loop woke up for a periodic probe since the last reset.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+from dataclasses import fields
+
+from .fakes import FakeLatency, install
+
+PROBE_INTERVAL = 0.01
+
+
+def add_latency_arguments(parser: argparse.ArgumentParser):
+    for field in fields(FakeLatency):
+        parser.add_argument(f"--{field.name.replace('_', '-')}", type=type(field.default), default=field.default)
+
+
+class LoopLagProbe:
+    """Measures how late the event loop runs a task scheduled every ``interval`` seconds."""
+
+    def __init__(self, interval: float = PROBE_INTERVAL):
+        self.interval = interval
+        self.samples: list = []
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, time.perf_counter() - expected))
+
+    def drain(self) -> list:
+        samples, self.samples = self.samples, []
+        return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--cache", action="store_true", help="Keep the response cache enabled")
+    add_latency_arguments(parser)
+    args = parser.parse_args()
+
+    # Configure the app before it is imported; keep benchmark data out of the real database
+    workdir = tempfile.mkdtemp(prefix="pandalora-bench-")
+    os.environ["GEMINI_API_KEY"] = "benchmark"
+    os.environ["CONVERSATION_DB_PATH"] = os.path.join(workdir, "conversations.db")
+    os.environ["RESPONSE_CACHE_ENABLED"] = "true" if args.cache else "false"
+
+    import uvicorn
+    from app.main import app
+
+    # Per-request INFO logging would dominate the measurements
+    logging.getLogger().setLevel(logging.WARNING)
+
+    install(FakeLatency(**{field.name: getattr(args, field.name) for field in fields(FakeLatency)}))
+    probe = LoopLagProbe()
+
+    @app.on_event("startup")
+    async def start_probe():
+        probe.start()
+
+    @app.get("/_bench/loop-lag")
+    async def loop_lag():
+        return {"interval": probe.interval, "samples": probe.drain()}
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Tests import the application as ``app``, the way uvicorn runs it
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GEMINI_API_KEY", "test")
+# Keep the conversation store out of the working directory
+os.environ.setdefault("CONVERSATION_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="pandalora-tests-"), "conversations.db"))
+
+
+@pytest.fixture(scope="session")
+def client():
+    # One startup and shutdown for the whole run: shutting down closes the
+    # process-wide services for good, as it does in a real worker
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    with TestClient(app) as client:
+        yield client
@@ -0,0 +1,128 @@
+import json
+import uuid
+
+import numpy as np
+
+from app import services
+from app.workers import ExecutorOverloaded
+
+
+def receive_until(websocket, *types: str) -> list[dict]:
+    frames = []
+    while True:
+        frame = json.loads(websocket.receive_text())
+        frames.append(frame)
+        if frame["type"] in types:
+            return frames
+
+
+def test_speech_socket_keeps_answering_after_an_overloaded_turn(client, monkeypatch):
+    speech_service = services.get_speech_service()
+    ai_service = services.get_ai_service()
+    calls = []
+
+    async def recognize(pcm, language="en-US"):
+        return "hello panda"
+
+    async def generate_streaming_response(message, history=None, pool="text", conversation_id=None):
+        calls.append(message)
+        if len(calls) == 1:
+            raise ExecutorOverloaded("voice", retry_after=2)
+        yield "Hello."
+
+    monkeypatch.setattr(speech_service, "recognize", recognize)
+    monkeypatch.setattr(ai_service, "generate_streaming_response", generate_streaming_response)
+
+    rate = 16000
+    t = np.arange(rate) / rate
+    burst = (8000 * np.sin(2 * np.pi * 440 * t)).astype(np.int16)
+    gap = np.zeros(rate, dtype=np.int16)
+    audio = np.concatenate([burst, gap, burst, gap]).tobytes()
+
+    with client.websocket_connect(f"/api/v1/ws/speech/{uuid.uuid4()}") as websocket:
+        websocket.send_text(json.dumps({"type": "config", "format": "pcm", "sample_rate": rate}))
+        for start in range(0, len(audio), 3200):
+            websocket.send_bytes(audio[start:start + 3200])
+        websocket.send_text(json.dumps({"type": "end"}))
+        frames = receive_until(websocket, "end")
+
+    kinds = [frame["type"] for frame in frames]
+    errors = [frame for frame in frames if frame["type"] == "error"]
+    assert len(calls) == 2
+    assert len(errors) == 1 and errors[0]["retry_after"] == 2
+    assert kinds.count("transcript") == 2
+    assert kinds.count("response_end") == 1
+    assert kinds[-1] == "end"
+
+
+def test_batch_streams_ndjson_results_and_limits_json_bodies(client, monkeypatch):
+    from app import api
+
+    async def generate_response(message, history=None, **kwargs):
+        return message.upper()
+
+    monkeypatch.setattr(services.get_ai_service(), "generate_response", generate_response)
+    body = "\n".join(json.dumps({"text": f"item {index}", "id": str(index)}) for index in range(5)) + "\n{oops\n"
+    response = client.post(
+        "/api/v1/chat/batch",
+        params={"persist": "false"},
+        content=body,
+        headers={"content-type": "application/x-ndjson"},
+    )
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    results = {line["index"]: line for line in lines if line["type"] == "result"}
+    assert response.status_code == 200
+    assert results[3].get("response") == "ITEM 3", results[3]
+    assert results[5]["status"] == 422
+    assert lines[-1] == {**lines[-1], "type": "summary", "total": 6, "succeeded": 5, "failed": 1}
+
+    monkeypatch.setattr(api.batch_runner, "max_document_bytes", 100)
+    response = client.post("/api/v1/chat/batch", json={"items": [{"text": "x" * 200}]})
+    assert response.status_code == 413
+
+
+def test_superseded_stream_leaves_no_unanswered_message(client, monkeypatch):
+    import threading
+    import time
+
+    ai_service = services.get_ai_service()
+    started = threading.Event()
+
+    async def generate_streaming_response(message, history=None, pool="text", conversation_id=None):
+        import asyncio
+
+        started.set()
+        for word in ("slow ", "reply ", "to ", message):
+            await asyncio.sleep(0.2)
+            yield word
+
+    async def generate_response(message, history=None, **kwargs):
+        return f"answer to {message}"
+
+    monkeypatch.setattr(ai_service, "generate_streaming_response", generate_streaming_response)
+    monkeypatch.setattr(ai_service, "generate_response", generate_response)
+    conversation_id = str(uuid.uuid4())
+    streamed = {}
+
+    def stream():
+        response = client.get(f"/api/v1/chat/stream/{conversation_id}", params={"message": "one"})
+        streamed["body"] = response.text
+
+    reader = threading.Thread(target=stream)
+    reader.start()
+    assert started.wait(5)
+    time.sleep(0.1)
+    response = client.post(
+        "/api/v1/chat/text",
+        params={"conversation_id": conversation_id, "policy": "supersede"},
+        json={"text": "two"},
+    )
+    reader.join(5)
+
+    assert response.status_code == 200
+    assert "Superseded" in streamed["body"]
+    history = client.get(f"/api/v1/conversation/{conversation_id}").json()["messages"]
+    assert [(message["role"], message["content"]) for message in history] == [
+        ("user", "two"),
+        ("assistant", "answer to two"),
+    ]
@@ -0,0 +1,134 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from app.audio import (
+    PCMAudio,
+    PCMStreamDecoder,
+    SpeechStreamSession,
+    StreamingVAD,
+    StreamResampler,
+    VADSettings,
+    resample,
+    trim_silence,
+)
+
+
+def tone(seconds: float, rate: int, amplitude: float = 8000.0, frequency: float = 440.0) -> np.ndarray:
+    t = np.arange(int(seconds * rate)) / rate
+    return (amplitude * np.sin(2 * np.pi * frequency * t)).astype(np.int16)
+
+
+def silence(seconds: float, rate: int) -> np.ndarray:
+    return np.zeros(int(seconds * rate), dtype=np.int16)
+
+
+def chunks(data: bytes, size: int):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+def test_stream_resampler_matches_a_single_pass():
+    rng = np.random.default_rng(0)
+    signal = tone(2.0, 44100)
+    whole = StreamResampler(44100, 16000).feed(signal)
+    resampler = StreamResampler(44100, 16000)
+    parts = []
+    start = 0
+    while start < len(signal):
+        size = int(rng.integers(1, 3000))
+        parts.append(resampler.feed(signal[start:start + size]))
+        start += size
+    chunked = np.concatenate(parts)
+    assert len(chunked) == len(whole) == len(resample(signal, 44100, 16000))
+    assert np.array_equal(chunked, whole)
+
+
+def test_pcm_decoder_upsamples_slow_streams():
+    decoder = PCMStreamDecoder(16000, sample_rate=8000)
+    data = tone(1.0, 8000).tobytes()
+    samples = np.concatenate([decoder.feed(chunk) for chunk in chunks(data, 999)])
+    assert samples.dtype == np.int16
+    assert abs(len(samples) - 16000) <= 2
+
+
+def test_speech_session_streams_8khz_pcm_at_the_target_rate():
+    async def run():
+        session = SpeechStreamSession(VADSettings(), 16000, audio_format="pcm", sample_rate=8000, max_pending=8)
+        audio = np.concatenate([silence(0.5, 8000), tone(1.0, 8000), silence(1.5, 8000), tone(0.6, 8000)])
+        for chunk in chunks(audio.tobytes(), 1600):
+            await session.feed(chunk)
+        await session.finish()
+        utterances = []
+        while (utterance := session.utterances.get_nowait()) is not None:
+            utterances.append(utterance)
+        return utterances
+
+    utterances = asyncio.run(run())
+    assert len(utterances) == 2
+    assert all(utterance.sample_rate == 16000 for utterance in utterances)
+    # Tone plus pre-roll and hangover; at 8000 Hz mislabelled as 16000 it would be half as long
+    assert 1.0 <= utterances[0].duration <= 1.6
+    assert 0.6 <= utterances[1].duration <= 1.2
+
+
+def noise(seconds: float, rate: int, amplitude: float, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return rng.normal(0, amplitude, int(seconds * rate))
+
+
+def test_trim_silence_removes_leading_and_trailing_silence():
+    audio = np.concatenate([silence(1.0, 16000), tone(1.0, 16000), silence(1.0, 16000)])
+    trimmed, removed = trim_silence(PCMAudio(samples=audio, sample_rate=16000), VADSettings())
+    assert 1.4 <= removed <= 2.0
+    assert trimmed.duration == pytest.approx(3.0 - removed)
+
+
+def test_trim_silence_keeps_audio_without_quiet_frames():
+    settings = VADSettings()
+    steady = PCMAudio(samples=tone(2.0, 16000), sample_rate=16000)
+    trimmed, removed = trim_silence(steady, settings)
+    assert trimmed is steady and removed == 0.0
+
+    # Noise whose level swings by less than the VAD margin
+    t = np.arange(2 * 16000) / 16000
+    for depth in (0.3, 0.6):
+        envelope = 1 + depth * np.sin(2 * np.pi * 3 * t)
+        samples = np.clip(noise(2.0, 16000, 3000) * envelope, -32768, 32767).astype(np.int16)
+        modulated = PCMAudio(samples=samples, sample_rate=16000)
+        trimmed, removed = trim_silence(modulated, settings)
+        assert trimmed is modulated and removed == 0.0
+
+
+def feed_vad(vad: StreamingVAD, audio: np.ndarray, chunk: int = 1600) -> list[PCMAudio]:
+    utterances = []
+    for start in range(0, len(audio), chunk):
+        utterances += vad.feed(audio[start:start + chunk])
+    return utterances
+
+
+def test_streaming_vad_learns_loud_background_noise():
+    rate = 16000
+    background = noise(8.0, rate, 1500)
+    speech = np.zeros_like(background)
+    speech[4 * rate:5 * rate] = tone(1.0, rate, amplitude=15000)
+    audio = np.clip(background + speech, -32768, 32767).astype(np.int16)
+
+    vad = StreamingVAD(VADSettings(), rate)
+    utterances = feed_vad(vad, audio)
+    assert vad.flush() is None
+    # The noise reads as speech only until the floor catches up with it,
+    # not until max_utterance_ms cuts it off
+    assert all(utterance.duration < 3.0 for utterance in utterances)
+    assert 1.0 <= utterances[-1].duration <= 1.6
+
+
+def test_streaming_vad_learns_noise_that_starts_mid_stream():
+    rate = 16000
+    audio = np.concatenate([silence(0.5, rate), noise(12.0, rate, 1500).astype(np.int16)])
+    vad = StreamingVAD(VADSettings(), rate)
+    utterances = feed_vad(vad, audio)
+    assert len(utterances) == 1
+    assert utterances[0].duration < 3.0
+    assert not vad.in_speech
@@ -0,0 +1,80 @@
+import asyncio
+
+from app.batch import BatchRunner, PreviousItemFailed, read_lines
+
+
+async def chunked(*chunks: bytes):
+    for chunk in chunks:
+        yield chunk
+
+
+async def collect(source) -> list:
+    return [item async for item in source]
+
+
+def test_read_lines_splits_across_chunk_boundaries():
+    lines = asyncio.run(collect(read_lines(chunked(b'{"a"', b': 1}\n{"b": 2}\n', b"\n", b"tail"), 100)))
+    assert lines == [b'{"a": 1}', b'{"b": 2}', b"", b"tail"]
+
+
+def test_read_lines_reports_overlong_lines_and_carries_on():
+    lines = asyncio.run(collect(read_lines(chunked(b"short\n", b"x" * 8, b"x" * 8, b"\nnext\n"), 10)))
+    assert lines[0] == b"short"
+    assert isinstance(lines[1], ValueError)
+    assert lines[2] == b"next"
+
+
+def test_batch_runner_orders_items_within_a_key_and_skips_after_a_failure():
+    running = set()
+    overlap = []
+
+    async def handle(item):
+        key, value = item
+        assert key not in running
+        running.add(key)
+        overlap.append(len(running))
+        await asyncio.sleep(0.01)
+        running.discard(key)
+        if value == "fail":
+            raise RuntimeError("boom")
+        return value
+
+    items = [("a", 1), ("b", 1), ("a", "fail"), ("b", 2), ("a", 3)]
+
+    async def run():
+        return await collect(BatchRunner(concurrency=4).run(chunked(*items), handle, key=lambda item: item[0]))
+
+    results = {result.index: result for result in asyncio.run(run())}
+    assert len(results) == 5
+    assert results[0].value == 1 and results[3].value == 2
+    assert isinstance(results[2].error, RuntimeError)
+    assert isinstance(results[4].error, PreviousItemFailed)
+    # The two conversations ran side by side
+    assert max(overlap) == 2
+
+
+def test_batch_runner_reads_only_a_bounded_window_ahead():
+    read = []
+    release = asyncio.Event()
+
+    async def source():
+        for index in range(100):
+            read.append(index)
+            yield index
+
+    async def handle(item):
+        await release.wait()
+        return item
+
+    async def run():
+        results = BatchRunner(concurrency=2, read_ahead=5).run(source(), handle)
+        first = asyncio.ensure_future(results.__anext__())
+        await asyncio.sleep(0.05)
+        window = len(read)
+        release.set()
+        await first
+        await results.aclose()
+        return window
+
+    # One extra item is pulled from the source while waiting for room
+    assert asyncio.run(run()) <= 6
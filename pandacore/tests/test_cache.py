@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+from app.cache import LRUCache, ResponseCache
+
+
+def test_lru_cache_evicts_least_recent():
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert "a" in cache and "c" in cache and "b" not in cache
+
+
+def test_response_cache_survives_restart_on_disk(tmp_path):
+    async def main():
+        key = ResponseCache.key("prompt", "model")
+        await ResponseCache(directory=str(tmp_path)).set(key, "bamboo")
+        # A fresh process only has the disk tier
+        fresh = ResponseCache(directory=str(tmp_path))
+        assert await fresh.get(key) == "bamboo"
+        assert fresh.disk_hits == 1
+
+    asyncio.run(main())
+
+
+def test_concurrent_misses_share_one_computation():
+    async def main():
+        cache = ResponseCache()
+        calls = 0
+
+        async def compute():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.05)
+            return "reply"
+
+        results = await asyncio.gather(*(cache.get_or_compute("k", compute) for _ in range(5)))
+        assert results == ["reply"] * 5
+        assert calls == 1
+        assert cache.coalesced == 4
+        # Stored, so the next caller does not compute at all
+        assert await cache.get_or_compute("k", compute) == "reply"
+        assert calls == 1
+
+    asyncio.run(main())
+
+
+def test_computation_outlives_a_caller_that_gives_up():
+    async def main():
+        cache = ResponseCache()
+        release = asyncio.Event()
+
+        async def compute():
+            await release.wait()
+            return "reply"
+
+        leaving = asyncio.ensure_future(cache.get_or_compute("k", compute))
+        staying = asyncio.ensure_future(cache.get_or_compute("k", compute))
+        await asyncio.sleep(0.01)
+        leaving.cancel()
+        await asyncio.sleep(0.01)
+        release.set()
+        assert await staying == "reply"
+        with pytest.raises(asyncio.CancelledError):
+            await leaving
+
+    asyncio.run(main())
+
+
+def test_computation_is_cancelled_when_the_last_caller_gives_up():
+    async def main():
+        cache = ResponseCache()
+        cancelled = asyncio.Event()
+
+        async def compute():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+            return "reply"
+
+        callers = [asyncio.ensure_future(cache.get_or_compute("k", compute)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        callers[0].cancel()
+        await asyncio.sleep(0.01)
+        assert not cancelled.is_set()
+        callers[1].cancel()
+        await asyncio.wait_for(cancelled.wait(), 1)
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.sleep(0)
+        # Nothing was stored and nothing is left in flight
+        assert cache.stats()["entries"] == 0
+        assert not cache._in_flight and not cache._waiters
+
+    asyncio.run(main())
@@ -0,0 +1,122 @@
+import asyncio
+import json
+
+from app.connections import (
+    CLOSE_GOING_AWAY, CLOSE_TRY_AGAIN_LATER, ConnectionManager, FrameKind, SlowClientPolicy,
+)
+
+
+class FakeWebSocket:
+    """Records frames; ``stalled`` holds every send until it is cleared."""
+
+    def __init__(self):
+        self.frames = []
+        self.closed_with = None
+        self.stalled = asyncio.Event()
+        self.stalled.set()
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        await self.stalled.wait()
+        self.frames.append(json.loads(text))
+
+    async def close(self, code=1000):
+        self.closed_with = code
+
+
+def test_frames_are_stamped_with_increasing_seq():
+    async def main():
+        manager = ConnectionManager()
+        websocket = FakeWebSocket()
+        connection = await manager.connect(websocket, "c1")
+        for index in range(3):
+            connection.send({"type": "chunk", "text": str(index)}, FrameKind.CHUNK)
+        await connection.drain(1)
+        assert [frame["seq"] for frame in websocket.frames] == [1, 2, 3]
+        assert [frame["text"] for frame in websocket.frames] == ["0", "1", "2"]
+
+    asyncio.run(main())
+
+
+def test_slow_client_gets_chunks_merged_not_lost():
+    async def main():
+        manager = ConnectionManager(max_queue=2, policy=SlowClientPolicy.COALESCE)
+        websocket = FakeWebSocket()
+        websocket.stalled.clear()
+        connection = await manager.connect(websocket, "c1")
+        for index in range(10):
+            assert connection.send({"type": "chunk", "text": str(index)}, FrameKind.CHUNK)
+        websocket.stalled.set()
+        await connection.drain(1)
+        assert "".join(frame["text"] for frame in websocket.frames) == "0123456789"
+        assert len(websocket.frames) < 10
+        assert connection.coalesced > 0
+
+    asyncio.run(main())
+
+
+def test_drop_policy_still_delivers_control_frames():
+    async def main():
+        manager = ConnectionManager(max_queue=1, policy=SlowClientPolicy.DROP)
+        websocket = FakeWebSocket()
+        websocket.stalled.clear()
+        connection = await manager.connect(websocket, "c1")
+        for index in range(5):
+            connection.send({"type": "event", "n": index}, FrameKind.EVENT)
+        connection.send({"type": "end"})
+        websocket.stalled.set()
+        await connection.drain(1)
+        assert websocket.frames[-1]["type"] == "end"
+        assert connection.dropped > 0
+
+    asyncio.run(main())
+
+
+def test_disconnect_policy_closes_a_client_that_falls_behind():
+    async def main():
+        manager = ConnectionManager(max_queue=1, policy=SlowClientPolicy.DISCONNECT)
+        websocket = FakeWebSocket()
+        websocket.stalled.clear()
+        connection = await manager.connect(websocket, "c1")
+        connection.send({"type": "chunk", "text": "a"}, FrameKind.CHUNK)
+        connection.send({"type": "chunk", "text": "b"}, FrameKind.CHUNK)
+        assert not connection.send({"type": "chunk", "text": "c"}, FrameKind.CHUNK)
+        await asyncio.sleep(0)
+        assert websocket.closed_with == CLOSE_TRY_AGAIN_LATER
+
+    asyncio.run(main())
+
+
+def test_broadcast_skips_the_origin_and_other_conversations():
+    async def main():
+        manager = ConnectionManager()
+        origin, follower, elsewhere = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+        origin_connection = await manager.connect(origin, "c1")
+        follower_connection = await manager.connect(follower, "c1")
+        await manager.connect(elsewhere, "c2")
+        await manager.deliver({"type": "message", "conversation_id": "c1", "origin": origin_connection.id})
+        await follower_connection.drain(1)
+        assert follower.frames == [{"seq": 1, "type": "message", "conversation_id": "c1"}]
+        assert origin.frames == [] and elsewhere.frames == []
+
+    asyncio.run(main())
+
+
+def test_heartbeat_closes_silent_clients_but_not_ones_in_a_turn():
+    async def main():
+        manager = ConnectionManager(ping_interval=0.02, ping_timeout=0.02)
+        silent, busy = FakeWebSocket(), FakeWebSocket()
+        await manager.connect(silent, "c1")
+        busy_connection = await manager.connect(busy, "c1")
+        manager.start()
+        with busy_connection.turn():
+            await asyncio.sleep(0.1)
+        await manager.close()
+        assert silent.closed_with == CLOSE_GOING_AWAY
+        assert {"seq": 1, "type": "ping"} in silent.frames
+        assert busy.closed_with is None
+        assert manager.stats()["timed_out"] == 1
+
+    asyncio.run(main())
@@ -0,0 +1,49 @@
+import asyncio
+
+from app.context import ContextBuilder, estimate_tokens, truncate_to_tokens
+from app.models import ChatMessage
+
+
+def history(count: int) -> list[ChatMessage]:
+    return [
+        ChatMessage(role="user" if index % 2 == 0 else "assistant", content=f"message number {index:02d}",
+                    timestamp=f"2026-01-01T00:00:{index:02d}")
+        for index in range(count)
+    ]
+
+
+def test_truncate_to_tokens_marks_the_cut():
+    text = "bamboo " * 100
+    cut = truncate_to_tokens(text, 10)
+    assert cut.endswith(" [...]")
+    assert estimate_tokens(cut) <= 10
+    assert truncate_to_tokens("short", 10) == "short"
+
+
+def test_prompt_keeps_the_newest_turns_within_the_budget():
+    builder = ContextBuilder("You are a panda.", budget=30)
+    prompt = builder.build("hello", history(10))
+    assert prompt.startswith("You are a panda.\n\n")
+    assert prompt.endswith("Human: hello\nPandaLora: ")
+    assert "message number 09" in prompt
+    assert "message number 00" not in prompt
+
+
+def test_evicted_turns_are_folded_into_a_summary_in_the_background():
+    async def main():
+        folded = []
+
+        async def summarize(previous, messages):
+            folded.append([m.content for m in messages])
+            return "they talked about numbers"
+
+        builder = ContextBuilder("You are a panda.", budget=30, summary_batch=2, summarize=summarize)
+        # The first prompt does not wait for the summary
+        assert "Summary" not in builder.build("hello", history(10), "c1")
+        await asyncio.sleep(0.01)
+        assert folded and "message number 00" in folded[0]
+        prompt = builder.build("hello", history(10), "c1")
+        assert "Summary of the earlier conversation: they talked about numbers" in prompt
+        assert builder.stats()["summaries_built"] == 1
+
+    asyncio.run(main())
@@ -0,0 +1,41 @@
+import asyncio
+import json
+
+from app.framing import ChunkCoalescer, Envelope
+
+
+async def paced(chunks, interval):
+    for chunk in chunks:
+        await asyncio.sleep(interval)
+        yield chunk
+
+
+def collect(coalescer, source):
+    async def main():
+        return [chunk async for chunk in coalescer.coalesce(source)]
+    return asyncio.run(main())
+
+
+def test_envelope_matches_a_full_serialization():
+    envelope = Envelope({"type": "chunk", "conversation_id": "c1"}, "content", before="data: ", after="\n\n")
+    text = 'quote " newline \n and ünïcode'
+    frame = envelope.fill(text)
+    assert frame.startswith("data: ") and frame.endswith("\n\n")
+    assert json.loads(frame[len("data: "):]) == {"type": "chunk", "conversation_id": "c1", "content": text}
+
+
+def test_coalescer_merges_fast_chunks_but_sends_the_first_at_once():
+    chunks = collect(ChunkCoalescer(max_chars=8, max_delay=1.0), paced(["a"] + ["bc"] * 8, 0))
+    assert chunks[0] == "a"
+    assert "".join(chunks) == "a" + "bc" * 8
+    assert all(len(chunk) == 8 for chunk in chunks[1:])
+
+
+def test_coalescer_flushes_when_the_window_expires():
+    chunks = collect(ChunkCoalescer(max_chars=1000, max_delay=0.02), paced(["a", "b", "c"], 0.05))
+    # Chunks further apart than the window are not held back for each other
+    assert chunks == ["a", "b", "c"]
+
+
+def test_disabled_coalescer_passes_chunks_through():
+    assert collect(ChunkCoalescer(max_chars=0), paced(["a", "b"], 0)) == ["a", "b"]
@@ -0,0 +1,30 @@
+from app.metrics import Registry
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = Registry()
+    latency = registry.histogram("test_seconds", "Test latency.", ["route"], buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 5.0):
+        latency.observe(value, route="/chat")
+    text = registry.render()
+    assert "# TYPE test_seconds histogram" in text
+    assert 'test_seconds_bucket{route="/chat",le="0.1"} 1' in text
+    assert 'test_seconds_bucket{route="/chat",le="1.0"} 3' in text
+    assert 'test_seconds_bucket{route="/chat",le="+Inf"} 4' in text
+    assert 'test_seconds_count{route="/chat"} 4' in text
+    assert 'test_seconds_sum{route="/chat"} 6.05' in text
+
+
+def test_counter_escapes_label_values():
+    registry = Registry()
+    errors = registry.counter("test_errors_total", "Test errors.", ["detail"])
+    errors.inc(detail='say "hi"\n')
+    errors.inc(2, detail='say "hi"\n')
+    assert 'test_errors_total{detail="say \\"hi\\"\\n"} 3' in registry.render()
+
+
+def test_requests_are_labelled_with_the_route_template(client):
+    client.get("/api/v1/conversation/metrics-test-conversation")
+    text = client.get("/metrics").text
+    assert '/conversation/{conversation_id}",status="200"' in text
+    assert "metrics-test-conversation" not in text
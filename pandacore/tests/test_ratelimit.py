@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+from starlette.requests import Request
+
+from app.ratelimit import STREAM, TEXT, VOICE, BucketLimit, RateLimited, RateLimiter
+
+
+def request(headers: dict = None, host: str = "10.0.0.1") -> Request:
+    return Request({
+        "type": "http",
+        "headers": [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()],
+        "client": (host, 1234),
+    })
+
+
+def test_client_bucket_refuses_turns_it_cannot_afford():
+    async def main():
+        limiter = RateLimiter(client=BucketLimit(capacity=5, rate=0), conversation=None)
+        await limiter.check("ip:a", VOICE)
+        with pytest.raises(RateLimited) as raised:
+            await limiter.check("ip:a", VOICE)
+        assert raised.value.scope == "client"
+        # Two tokens were left; a cheaper turn still fits
+        await limiter.check("ip:a", STREAM)
+        # Other clients have their own bucket
+        await limiter.check("ip:b", VOICE)
+
+    asyncio.run(main())
+
+
+def test_conversation_limit_gives_the_client_its_tokens_back():
+    async def main():
+        limiter = RateLimiter(client=BucketLimit(capacity=3, rate=0), conversation=BucketLimit(capacity=1, rate=0))
+        await limiter.check("ip:a", TEXT, "c1")
+        with pytest.raises(RateLimited) as raised:
+            await limiter.check("ip:a", TEXT, "c1")
+        assert raised.value.scope == "conversation"
+        # The refused turn cost the client nothing
+        await limiter.check("ip:a", TEXT, "c2")
+        await limiter.check("ip:a", TEXT, "c3")
+
+    asyncio.run(main())
+
+
+def test_pace_waits_for_the_bucket_to_refill():
+    async def main():
+        limiter = RateLimiter(client=BucketLimit(capacity=1, rate=20), conversation=None, max_wait=1)
+        await limiter.check("ip:a", TEXT)
+        started = asyncio.get_running_loop().time()
+        await limiter.pace("ip:a", TEXT)
+        assert asyncio.get_running_loop().time() - started >= 0.04
+
+    asyncio.run(main())
+
+
+def test_clients_are_identified_by_hashed_key_or_address():
+    limiter = RateLimiter()
+    keyed = limiter.identify(request({"Authorization": "Bearer secret"}))
+    assert keyed == limiter.identify(request({"X-API-Key": "secret"}))
+    assert keyed.startswith("key:") and "secret" not in keyed
+    assert limiter.identify(request(host="10.0.0.9")) == "ip:10.0.0.9"
+    # Forwarded addresses are only believed behind a trusted proxy
+    assert limiter.identify(request({"X-Forwarded-For": "1.2.3.4"})) == "ip:10.0.0.1"
+    assert RateLimiter(trust_proxy=True).identify(request({"X-Forwarded-For": "1.2.3.4, 10.0.0.1"})) == "ip:1.2.3.4"
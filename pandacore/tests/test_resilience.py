@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+
+from app.resilience import CircuitBreaker, CircuitOpen, ResilientCaller, UpstreamTimeout
+
+
+def caller(**kwargs) -> ResilientCaller:
+    kwargs.setdefault("backoff", 0.0)
+    kwargs.setdefault("hedge_percentile", None)
+    return ResilientCaller("test", **kwargs)
+
+
+def attempts(*outcomes):
+    """An attempt function that fails or answers with each outcome in turn."""
+    calls = []
+
+    async def attempt(timeout):
+        outcome = outcomes[len(calls)]
+        calls.append(timeout)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+    return attempt, calls
+
+
+def test_transient_failures_are_retried():
+    attempt, calls = attempts(ConnectionError("reset"), ConnectionError("reset"), "reply")
+    assert asyncio.run(caller(retries=2).call(attempt)) == "reply"
+    assert len(calls) == 3
+
+
+def test_rejected_requests_are_not_retried_and_do_not_trip_the_breaker():
+    resilient = caller(breaker=CircuitBreaker("test", failure_threshold=1))
+    attempt, calls = attempts(ValueError("bad prompt"))
+    with pytest.raises(ValueError):
+        asyncio.run(resilient.call(attempt))
+    assert len(calls) == 1
+    assert resilient.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_slow_attempt_times_out():
+    async def attempt(timeout):
+        await asyncio.sleep(1)
+
+    with pytest.raises(UpstreamTimeout):
+        asyncio.run(caller(timeout=0.05, retries=0).call(attempt))
+
+
+def test_breaker_opens_then_lets_one_probe_through():
+    resilient = caller(retries=0, breaker=CircuitBreaker("test", failure_threshold=2, reset_timeout=0.05))
+    attempt, calls = attempts(ConnectionError(), ConnectionError(), "recovered")
+
+    async def main():
+        for _ in range(2):
+            with pytest.raises(ConnectionError):
+                await resilient.call(attempt)
+        # Open: refused without reaching the upstream
+        with pytest.raises(CircuitOpen):
+            await resilient.call(attempt)
+        assert len(calls) == 2
+        await asyncio.sleep(0.06)
+        assert await resilient.call(attempt) == "recovered"
+        assert resilient.breaker.state == CircuitBreaker.CLOSED
+
+    asyncio.run(main())
+
+
+def test_slow_attempt_is_hedged_and_the_duplicate_wins():
+    resilient = caller(hedge_percentile=95.0)
+    for _ in range(20):
+        resilient.latency.record(0.01)
+    started = []
+
+    async def attempt(timeout):
+        started.append(timeout)
+        if len(started) == 1:
+            await asyncio.sleep(1)
+            return "primary"
+        return "hedge"
+
+    assert asyncio.run(asyncio.wait_for(resilient.call(attempt), 0.5)) == "hedge"
+    assert len(started) == 2
+
+
+def test_stream_retries_until_the_first_chunk():
+    opened = []
+
+    def open_stream(timeout):
+        async def source():
+            opened.append(timeout)
+            if len(opened) == 1:
+                raise ConnectionError("dropped before the first chunk")
+            for chunk in ("a", "b"):
+                yield chunk
+        return source()
+
+    async def main():
+        return [chunk async for chunk in caller(retries=1).stream(open_stream)]
+
+    assert asyncio.run(main()) == ["a", "b"]
+    assert len(opened) == 2
@@ -0,0 +1,21 @@
+import os
+import subprocess
+import sys
+
+
+def test_importing_services_leaves_audio_stack_unloaded():
+    # A text-only worker imports app.services but never builds SpeechService
+    # or a TTS engine, so NumPy and gTTS must stay out of its startup path
+    probe = (
+        "import sys, app.services, app.main; "
+        "print(','.join(m for m in ('numpy', 'gtts', 'app.audio', 'speech_recognition') if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", probe],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        env={**os.environ, "TTS_ENGINE": "none"},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert result.stdout.strip() == ""
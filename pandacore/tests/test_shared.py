@@ -0,0 +1,128 @@
+import asyncio
+
+import pytest
+
+from app.models import ChatMessage
+from app.shared import LocalSharedState, LockTimeout, RedisSharedState, SQLiteSharedState
+from benchmarks.fakes import FakeRedis
+
+
+def workers(count: int, **kwargs) -> list[RedisSharedState]:
+    """Redis backends that share one server, like separate worker processes."""
+    server = FakeRedis()
+    return [RedisSharedState(client=server, **kwargs) for _ in range(count)]
+
+
+def test_redis_lock_is_exclusive_across_workers():
+    async def main():
+        first, second = workers(2)
+        held = []
+
+        async def hold(state, name):
+            async with state.lock("conversation-1"):
+                held.append(f"{name} in")
+                await asyncio.sleep(0.05)
+                held.append(f"{name} out")
+
+        await asyncio.gather(hold(first, "a"), hold(second, "b"))
+        # The second worker only got in once the first let go
+        assert held in (["a in", "a out", "b in", "b out"], ["b in", "b out", "a in", "a out"])
+
+        async with first.lock("conversation-1"):
+            with pytest.raises(LockTimeout):
+                async with second.lock("conversation-1", timeout=0.05):
+                    pass
+        # Released, so it is free again
+        async with second.lock("conversation-1", timeout=0.05):
+            pass
+
+    asyncio.run(main())
+
+
+def test_redis_lock_outlives_its_ttl_while_held():
+    async def main():
+        first, second = workers(2, lock_ttl=0.1)
+        async with first.lock("slow-reply"):
+            # Renewed in the background, so it does not expire under the holder
+            await asyncio.sleep(0.25)
+            with pytest.raises(LockTimeout):
+                async with second.lock("slow-reply", timeout=0.05):
+                    pass
+        await first.close()
+
+    asyncio.run(main())
+
+
+def test_redis_pubsub_reaches_other_workers():
+    async def main():
+        publisher, listener = workers(2)
+        received = asyncio.Queue()
+
+        async def handler(message):
+            await received.put(message)
+
+        listener.subscribe("replies", handler)
+        await listener.start()
+        await publisher.publish("replies", {"conversation_id": "c1", "text": "hello"})
+        assert await asyncio.wait_for(received.get(), 1) == {"conversation_id": "c1", "text": "hello"}
+        await listener.close()
+
+    asyncio.run(main())
+
+
+def test_redis_conversation_and_buckets_are_shared():
+    async def main():
+        first, second = workers(2)
+        now = "2026-01-01T00:00:00"
+        for index in range(4):
+            await first.append_message("c1", ChatMessage(role="user", content=f"m{index}", timestamp=now), 3, now)
+        conversation = await second.load_conversation("c1")
+        assert [m.content for m in conversation.messages] == ["m1", "m2", "m3"]
+
+        assert (await first.take_tokens("client", 2, capacity=3, rate=0)).allowed
+        level = await second.take_tokens("client", 2, capacity=3, rate=0)
+        assert not level.allowed and level.tokens == 1
+
+    asyncio.run(main())
+
+
+def test_local_history_keeps_the_newest_messages():
+    async def main():
+        state = LocalSharedState()
+        now = "2026-01-01T00:00:00"
+        for index in range(5):
+            await state.append_message("c1", ChatMessage(role="user", content=f"m{index}"), 2, now)
+        assert [m.content for m in (await state.load_conversation("c1")).messages] == ["m3", "m4"]
+        assert await state.load_conversation("c2") is None
+
+    asyncio.run(main())
+
+
+def test_sqlite_workers_share_locks_and_events(tmp_path):
+    async def main():
+        path = str(tmp_path / "shared.db")
+        first = SQLiteSharedState(path, poll_interval=0.01)
+        second = SQLiteSharedState(path, poll_interval=0.01)
+        received = asyncio.Queue()
+
+        async def handler(message):
+            await received.put(message)
+
+        second.subscribe("replies", handler)
+        await second.start()
+        # Let the poller note where the event log ends before anything is published
+        await asyncio.sleep(0.05)
+        await first.publish("replies", {"text": "hello"})
+        assert await asyncio.wait_for(received.get(), 1) == {"text": "hello"}
+
+        async with first.lock("conversation-1"):
+            with pytest.raises(LockTimeout):
+                async with second.lock("conversation-1", timeout=0.05):
+                    pass
+        async with second.lock("conversation-1", timeout=0.05):
+            pass
+
+        await first.close()
+        await second.close()
+
+    asyncio.run(main())
@@ -0,0 +1,35 @@
+from app.models import ChatMessage
+from app.store import SQLiteConversationStore
+
+
+def message(seq: int) -> ChatMessage:
+    return ChatMessage(role="user", content=f"m{seq}", timestamp=f"2026-01-01T00:00:{seq:02d}", seq=seq)
+
+
+def test_messages_are_readable_before_and_after_the_commit(tmp_path):
+    path = str(tmp_path / "conversations.db")
+    # A long flush interval keeps the messages in memory at first
+    store = SQLiteConversationStore(path, flush_interval=10)
+    for seq in range(1, 6):
+        store.append("c1", message(seq))
+    assert [m.content for m in store.load("c1", 3).messages] == ["m3", "m4", "m5"]
+    assert store.last_seq("c1") == 5
+    store.flush()
+    assert [m.seq for m in store.load_after("c1", 2, 10)] == [3, 4, 5]
+    assert store.load("missing", 10) is None
+    store.close()
+
+    # Durable once flushed, across a reopen
+    reopened = SQLiteConversationStore(path)
+    assert [m.content for m in reopened.load("c1", 10).messages] == ["m1", "m2", "m3", "m4", "m5"]
+    reopened.close()
+
+
+def test_close_persists_pending_messages(tmp_path):
+    path = str(tmp_path / "conversations.db")
+    store = SQLiteConversationStore(path, flush_interval=10)
+    store.append("c1", message(1))
+    store.close()
+    reopened = SQLiteConversationStore(path)
+    assert reopened.last_seq("c1") == 1
+    reopened.close()
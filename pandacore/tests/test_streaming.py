@@ -0,0 +1,110 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.streaming import BroadcastStream, ResumableStreams, iterate_in_thread, split_for_replay
+
+
+async def chunks(count: int, interval: float = 0.0):
+    for index in range(count):
+        await asyncio.sleep(interval)
+        yield f"data: {index}\n\n"
+
+
+def test_iterate_in_thread_passes_items_and_errors():
+    def blocking():
+        yield 1
+        yield 2
+        raise ValueError("upstream broke")
+
+    async def main():
+        seen = []
+        with pytest.raises(ValueError):
+            async for item in iterate_in_thread(blocking):
+                seen.append(item)
+        assert seen == [1, 2]
+
+    asyncio.run(main())
+
+
+def test_iterate_in_thread_stops_the_producer_when_the_consumer_leaves():
+    closed = threading.Event()
+
+    def endless():
+        try:
+            while True:
+                time.sleep(0.001)
+                yield "chunk"
+        finally:
+            closed.set()
+
+    async def main():
+        stream = iterate_in_thread(endless, maxsize=1)
+        async for _ in stream:
+            break
+        await stream.aclose()
+
+    asyncio.run(main())
+    assert closed.wait(1)
+
+
+def test_late_subscriber_sees_the_whole_broadcast():
+    async def main():
+        stream = BroadcastStream(chunks(5, 0.01))
+        early = asyncio.ensure_future(collect(stream.subscribe()))
+        await asyncio.sleep(0.025)
+        late = await collect(stream.subscribe())
+        assert late == await early
+        assert len(late) == 5
+
+    async def collect(source):
+        return [item async for item in source]
+
+    asyncio.run(main())
+
+
+def test_resumed_stream_picks_up_after_the_last_event():
+    async def main():
+        streams = ResumableStreams(linger=1.0)
+        stream_id, stream = streams.start(chunks(4, 0.01))
+        received = []
+        events = ResumableStreams.events(stream_id, stream)
+        async for frame in events:
+            received.append(frame)
+            if len(received) == 2:
+                break
+        await events.aclose()
+
+        # The client reconnects with the ID of the last frame it got
+        last_event_id = received[-1].split("\n", 1)[0][len("id: "):]
+        resumed_id, resumed, start = streams.resume(last_event_id)
+        assert resumed is stream and start == 2
+        received += [frame async for frame in ResumableStreams.events(resumed_id, resumed, start)]
+        assert received == [f"id: {stream_id}:{index}\ndata: {index}\n\n" for index in range(4)]
+        assert streams.stats()["resumed"] == 1
+
+        assert streams.resume("unknown:3") is None
+        assert streams.resume("garbage") is None
+
+    asyncio.run(main())
+
+
+def test_abandoned_stream_stops_after_linger():
+    async def main():
+        stream = BroadcastStream(chunks(100, 0.01), linger=0.05)
+        subscriber = stream.subscribe()
+        await subscriber.__anext__()
+        await subscriber.aclose()
+        await asyncio.sleep(0.1)
+        assert stream.done and isinstance(stream.error, asyncio.CancelledError)
+
+    asyncio.run(main())
+
+
+def test_split_for_replay_keeps_words_whole():
+    text = "the moon hangs low over the bamboo grove"
+    parts = split_for_replay(text, size=10)
+    assert "".join(parts) == text
+    assert all(part.endswith(" ") for part in parts[:-1])
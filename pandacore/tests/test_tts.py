@@ -0,0 +1,49 @@
+import asyncio
+
+from app.tts import SentenceSplitter, SpeechPipeline, ToneEngine, split_sentences
+
+
+def test_splitter_emits_sentences_as_they_complete():
+    splitter = SentenceSplitter(min_chars=10)
+    assert splitter.feed("Bamboo is my favourite") == []
+    assert splitter.feed(" food. Hi! It grows") == ["Bamboo is my favourite food."]
+    assert splitter.feed(" fast.\n") == ["Hi! It grows fast."]
+    assert splitter.flush() is None
+
+
+def test_splitter_cuts_long_unpunctuated_text_at_a_space():
+    sentences = split_sentences("word " * 30, max_chars=40)
+    assert all(len(sentence) <= 40 for sentence in sentences)
+    assert " ".join(sentences).split() == ["word"] * 30
+
+
+def test_pipeline_returns_audio_in_sentence_order():
+    async def synthesize(sentence):
+        # Later sentences finish first
+        await asyncio.sleep(0.05 if sentence.startswith("First") else 0.0)
+        if "broken" in sentence:
+            raise RuntimeError("engine failed")
+        return sentence.encode()
+
+    async def main():
+        pipeline = SpeechPipeline(synthesize, "wav", SentenceSplitter(min_chars=1))
+        pipeline.feed("First sentence. A broken one. ")
+        await asyncio.sleep(0.01)
+        # The second is done, but the first is not, so nothing is ready yet
+        assert pipeline.ready() == []
+        pipeline.feed("Third")
+        pipeline.finish()
+        spoken = [sentence async for sentence in pipeline.rest()]
+        # The failed sentence is skipped; the others keep their index
+        assert [(s.index, s.audio) for s in spoken] == [(0, b"First sentence."), (2, b"Third")]
+
+    asyncio.run(main())
+
+
+def test_tone_engine_output_grows_with_the_text():
+    engine = ToneEngine()
+    short = engine.synthesize("hi", "en")
+    long = engine.synthesize("hello there my bamboo loving friend", "en")
+    assert short.startswith(b"RIFF") and len(long) > len(short)
+    joined = engine.join([short, long])
+    assert len(joined) == len(short) + len(long) - 44
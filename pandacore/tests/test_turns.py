@@ -0,0 +1,103 @@
+import asyncio
+
+import pytest
+
+from app.shared import LocalSharedState
+from app.turns import ConversationBusy, TurnCoordinator, TurnPolicy, TurnSuperseded
+
+
+def test_queue_policy_runs_turns_one_after_another():
+    async def main():
+        turns = TurnCoordinator(LocalSharedState(), TurnPolicy.QUEUE)
+        log = []
+
+        async def take_turn(name):
+            async with turns.turn("c1"):
+                log.append(f"{name} start")
+                await asyncio.sleep(0.02)
+                log.append(f"{name} end")
+
+        await asyncio.gather(take_turn("a"), take_turn("b"))
+        assert log == ["a start", "a end", "b start", "b end"]
+        assert not turns.busy("c1")
+
+    asyncio.run(main())
+
+
+def test_queue_policy_gives_up_after_the_timeout():
+    async def main():
+        turns = TurnCoordinator(LocalSharedState(), TurnPolicy.QUEUE, queue_timeout=0.05)
+        async with turns.turn("c1"):
+            with pytest.raises(ConversationBusy):
+                async with turns.turn("c1"):
+                    pass
+
+    asyncio.run(main())
+
+
+def test_reject_policy_fails_fast_while_a_turn_is_in_flight():
+    async def main():
+        turns = TurnCoordinator(LocalSharedState(), TurnPolicy.REJECT)
+        async with turns.turn("c1"):
+            with pytest.raises(ConversationBusy):
+                turns.check("c1")
+            with pytest.raises(ConversationBusy):
+                async with turns.turn("c1"):
+                    pass
+            # Other conversations are unaffected
+            async with turns.turn("c2"):
+                pass
+        assert turns.stats()["rejected"] == 2
+        async with turns.turn("c1"):
+            pass
+
+    asyncio.run(main())
+
+
+def test_supersede_policy_cancels_the_earlier_turn():
+    async def main():
+        turns = TurnCoordinator(LocalSharedState(), TurnPolicy.SUPERSEDE)
+        started = asyncio.Event()
+
+        async def first():
+            async with turns.turn("c1") as turn:
+                started.set()
+                await turn.run(asyncio.sleep(10))
+
+        async def second():
+            await started.wait()
+            async with turns.turn("c1"):
+                return "answered"
+
+        outcome = await asyncio.wait_for(asyncio.gather(first(), second(), return_exceptions=True), 1)
+        assert isinstance(outcome[0], TurnSuperseded)
+        assert outcome[1] == "answered"
+        assert turns.stats()["superseded"] == 1
+
+    asyncio.run(main())
+
+
+def test_superseded_stream_stops_yielding():
+    async def main():
+        turns = TurnCoordinator(LocalSharedState(), TurnPolicy.SUPERSEDE)
+        chunks = []
+
+        async def source():
+            for index in range(100):
+                await asyncio.sleep(0.01)
+                yield index
+
+        async def first():
+            async with turns.turn("c1") as turn:
+                async for chunk in turn.stream(source()):
+                    chunks.append(chunk)
+
+        task = asyncio.ensure_future(first())
+        await asyncio.sleep(0.05)
+        async with turns.turn("c1"):
+            pass
+        with pytest.raises(TurnSuperseded):
+            await task
+        assert 0 < len(chunks) < 100
+
+    asyncio.run(main())
@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+
+from app.warmup import FAILED, READY, WarmUp
+
+
+def test_failed_step_is_reported_but_does_not_block_readiness():
+    async def fine():
+        await asyncio.sleep(0.01)
+
+    async def broken():
+        raise ConnectionError("no network")
+
+    async def main():
+        warm_up = WarmUp({"gemini": broken, "audio": fine})
+        assert not warm_up.ready
+        warm_up.start()
+        await warm_up._task
+        assert warm_up.ready and warm_up.degraded
+        assert warm_up.state["audio"]["state"] == READY
+        assert warm_up.state["gemini"] == {"state": FAILED, "error": "no network", "seconds": pytest.approx(0, abs=0.5)}
+
+    asyncio.run(main())
+
+
+def test_slow_step_times_out():
+    async def hang():
+        await asyncio.sleep(10)
+
+    async def main():
+        warm_up = WarmUp({"tts": hang}, timeout=0.05)
+        await warm_up.run()
+        assert warm_up.state["tts"]["state"] == FAILED
+
+    asyncio.run(main())
+
+
+def test_steps_are_chosen_from_the_environment(monkeypatch):
+    steps = {"gemini": None, "audio": None, "tts": None}
+    monkeypatch.setenv("WARMUP", "audio, tts")
+    assert set(WarmUp.from_env(steps).steps) == {"audio", "tts"}
+    monkeypatch.setenv("WARMUP", "none")
+    assert WarmUp.from_env(steps).ready
+    monkeypatch.setenv("WARMUP", "gpu")
+    with pytest.raises(ValueError):
+        WarmUp.from_env(steps)
@@ -0,0 +1,80 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.workers import BoundedExecutor, ExecutorOverloaded, current_client
+
+
+def pool(workers: int = 1, queue: int = 8, queue_timeout: float = None) -> BoundedExecutor:
+    return BoundedExecutor("test", ThreadPoolExecutor(max_workers=workers), workers, queue, queue_timeout)
+
+
+def test_full_queue_sheds_load():
+    async def main():
+        executor = pool(queue=1)
+        async with executor.slot():
+            waiting = asyncio.ensure_future(executor.claim())
+            await asyncio.sleep(0)
+            with pytest.raises(ExecutorOverloaded) as raised:
+                await executor.claim()
+            assert raised.value.retry_after >= 1
+        (await waiting)()
+        assert executor.stats()["rejected"] == 1
+        assert executor.stats()["active"] == 0
+
+    asyncio.run(main())
+
+
+def test_waiting_past_the_queue_timeout_gives_up():
+    async def main():
+        executor = pool(queue_timeout=0.05)
+        async with executor.slot():
+            with pytest.raises(ExecutorOverloaded) as raised:
+                await executor.claim()
+        assert raised.value.reason == "busy"
+        assert executor.stats()["timed_out"] == 1
+        # The abandoned waiter does not keep the slot
+        async with executor.slot():
+            pass
+
+    asyncio.run(main())
+
+
+def test_slots_go_round_robin_between_clients():
+    async def main():
+        executor = pool()
+        order = []
+
+        async def job(client, name):
+            current_client.set(client)
+            async with executor.slot():
+                order.append(name)
+
+        async with executor.slot():
+            jobs = [asyncio.ensure_future(job("busy", f"busy{i}")) for i in range(3)]
+            await asyncio.sleep(0)
+            jobs.append(asyncio.ensure_future(job("quiet", "quiet0")))
+            await asyncio.sleep(0)
+        await asyncio.gather(*jobs)
+        # The quiet client's job did not wait behind all of the busy client's
+        assert order == ["busy0", "quiet0", "busy1", "busy2"]
+
+    asyncio.run(main())
+
+
+def test_cancelled_caller_keeps_the_slot_until_the_thread_returns():
+    async def main():
+        executor = pool()
+        call = asyncio.ensure_future(executor.run(time.sleep, 0.1))
+        await asyncio.sleep(0.02)
+        call.cancel()
+        await asyncio.sleep(0.01)
+        assert executor.saturated
+        await asyncio.sleep(0.15)
+        assert not executor.saturated
+        assert await executor.run(sum, [1, 2]) == 3
+        executor.shutdown()
+
+    asyncio.run(main())